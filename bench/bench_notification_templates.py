@@ -0,0 +1,37 @@
+"""
+Measures how many expected notification messages per second are rendered by a compiled template from the registry,
+compared with the NotificationHelper keyword building the same message. Run from the project's root directory:
+
+    > python bench/bench_notification_templates.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+from SnowLibrary.keywords.notification_helper import NotificationHelper  # noqa: E402
+from SnowLibrary.notification_templates import registry  # noqa: E402
+
+RENDERS = 100000
+VALUES = {"number": "OIR0001234", "state": "Work in Progress", "business": "Futures", "application": "Clearing",
+          "severity": "2", "text": "Users cannot log in to the clearing application"}
+
+
+def main():
+    helper = NotificationHelper()
+    template = registry.get("oir_sms")
+    candidates = {
+        "registry template": lambda: template.render(VALUES),
+        "Get Expected Message": lambda: helper.get_expected_message("oir_sms", **VALUES),
+        "Get Expected Notification Message": lambda: helper.get_expected_notification_message(
+            VALUES["number"], VALUES["state"], VALUES["business"], VALUES["application"], VALUES["severity"],
+            VALUES["text"], "sms"),
+    }
+    for name, render in candidates.items():
+        seconds = min(timeit.repeat(render, number=RENDERS, repeat=3))
+        print("{n:<36} {r:>10,.0f} messages/s".format(n=name, r=RENDERS / seconds))
+
+
+if __name__ == "__main__":
+    main()
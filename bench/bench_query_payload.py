@@ -0,0 +1,121 @@
+"""
+Measures the size of a page of Table API results and the time to fetch and parse it, with and without gzip compression
+and the query options of Execute Query. A local HTTP server stands in for ServiceNow, answering with records of a wide
+table with many reference fields, shaped like the real responses for each option. Run from the project's root
+directory:
+
+    > python bench/bench_query_payload.py
+"""
+import gzip
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+from SnowLibrary.json_stream import iter_records  # noqa: E402
+from SnowLibrary.session import SnowSession  # noqa: E402
+
+RECORDS = 2000
+REFERENCE_FIELDS = ["caller_id", "opened_by", "assigned_to", "assignment_group", "cmdb_ci", "company", "location",
+                    "business_service", "resolved_by", "closed_by", "sys_domain", "parent"]
+PLAIN_FIELDS = ["number", "state", "priority", "impact", "urgency", "short_description", "sys_created_on",
+                "sys_updated_on"]
+REPEATS = 5
+
+
+def build_page(exclude_reference_link, display_value):
+    """Returns the body of a page of incident records, as ServiceNow would return it with the given options."""
+    records = list()
+    for n in range(RECORDS):
+        record = {"sys_id": "{:032x}".format(n)}
+        for field in PLAIN_FIELDS:
+            value = "{f} {n}".format(f=field, n=n)
+            record[field] = {"value": value, "display_value": value} if display_value == "all" else value
+        for field in REFERENCE_FIELDS:
+            sys_id = "{:032x}".format((REFERENCE_FIELDS.index(field) << 64) + n % 97)
+            name = "{f} record {n}".format(f=field, n=n % 97)
+            if display_value == "all":
+                value = {"value": sys_id, "display_value": name}
+            elif display_value == "true":
+                value = {"display_value": name}
+            else:
+                value = {"value": sys_id}
+            if not exclude_reference_link:
+                value["link"] = "https://instance.service-now.com/api/now/table/{f}/{s}".format(f=field, s=sys_id)
+            elif display_value != "all":
+                value = next(iter(value.values()))
+            record[field] = value
+        records.append(record)
+    return json.dumps({"result": records}).encode("utf-8")
+
+
+class TableAPI(BaseHTTPRequestHandler):
+    pages = dict()
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        options = (params.get("sysparm_exclude_reference_link", "false").lower() == "true",
+                   params.get("sysparm_display_value", "false").lower())
+        compress = "gzip" in self.headers.get("Accept-Encoding", "")
+        key = options + (compress,)
+        if key not in self.pages:
+            page = build_page(*options)
+            self.pages[key] = gzip.compress(page, 6) if compress else page
+        body = self.pages[key]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch(session, url, params, encoding):
+    """Fetches and parses one page, and returns the number of bytes received and the number of records."""
+    response = session.get(url, params=params, stream=True, headers={"Accept-Encoding": encoding})
+    response.raw.decode_content = True
+    size = int(response.headers["Content-Length"])
+    count = sum(1 for _ in iter_records(response.raw))
+    response.close()
+    return size, count
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TableAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/api/now/table/incident".format(server.server_port)
+    session = SnowSession()
+    candidates = [
+        ("previous defaults, no gzip", {"sysparm_exclude_reference_link": "false"}, "identity"),
+        ("previous defaults, gzip", {"sysparm_exclude_reference_link": "false"}, "gzip"),
+        ("exclude_reference_link", {"sysparm_exclude_reference_link": "true"}, "identity"),
+        ("exclude_reference_link, gzip", {"sysparm_exclude_reference_link": "true"}, "gzip"),
+        ("display_value=all, gzip", {"sysparm_exclude_reference_link": "false", "sysparm_display_value": "all"},
+         "gzip"),
+    ]
+    print("{r:,} records with {f} reference fields per page".format(r=RECORDS, f=len(REFERENCE_FIELDS)))
+    for name, params, encoding in candidates:
+        params = dict(params, sysparm_no_count="true", sysparm_limit=RECORDS)
+        fetch(session, url, params, encoding)  # Let the server build and cache the page.
+        times = list()
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            size, count = fetch(session, url, params, encoding)
+            times.append(time.perf_counter() - start)
+        assert count == RECORDS
+        print("{n:<32} {b:>12,} bytes {t:>9.1f} ms".format(n=name, b=size, t=statistics.median(times) * 1000))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
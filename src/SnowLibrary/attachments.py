@@ -0,0 +1,93 @@
+import hashlib
+import os
+import time
+
+from robot.api import logger
+
+CHUNK_SIZE = 1 << 20
+
+
+def _new_hash(checksum):
+    """Returns a new hash object for the ``checksum`` algorithm name (e.g. md5 or sha256), or None if it is empty."""
+    if not checksum:
+        return None
+    try:
+        return hashlib.new(checksum.lower())
+    except ValueError:
+        raise AssertionError("Unknown checksum algorithm {c}. Expected one of {a}.".format(
+            c=checksum, a=", ".join(sorted(hashlib.algorithms_guaranteed))))
+
+
+class Transfer:
+    """
+    Keeps track of the bytes of a file uploaded or downloaded so far, logging progress every 10 percent of ``size`` (if
+    it is known), and computing the ``checksum`` of the bytes as they go through.
+    """
+
+    def __init__(self, name, size=None, checksum=None):
+        self.name = name
+        self.size = size
+        self.transferred = 0
+        self.hash = _new_hash(checksum)
+        self._started = time.monotonic()
+        self._next_progress = 10
+
+    def update(self, chunk):
+        self.transferred += len(chunk)
+        if self.hash is not None:
+            self.hash.update(chunk)
+        if self.size and self.transferred * 100 >= self._next_progress * self.size:
+            percent = self.transferred * 100 // self.size
+            logger.debug("{n}: {p}% ({b:,} bytes) transferred.".format(n=self.name, p=percent, b=self.transferred))
+            self._next_progress = (percent // 10 + 1) * 10
+
+    def summary(self):
+        """Returns the number of bytes, seconds, throughput and checksum of the transfer so far."""
+        seconds = time.monotonic() - self._started
+        return {"bytes": self.transferred, "seconds": round(seconds, 3),
+                "bytes_per_second": round(self.transferred / seconds) if seconds > 0 else None,
+                "checksum": self.hash.hexdigest() if self.hash is not None else None}
+
+
+class UploadStream:
+    """
+    A read-only file-like view of the file at ``path`` to use as a request body, so that requests sends it with a
+    Content-Length header in chunks read as the connection sends them, instead of loading it into memory. Each chunk
+    updates ``transfer``. Bodies with a ``read`` method are never sent twice by SnowSession, since they are consumed.
+    """
+
+    def __init__(self, path, transfer):
+        self._file = open(path, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self.transfer = transfer
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        chunk = self._file.read(size)
+        self.transfer.update(chunk)
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+def download(response, path, transfer, chunk_size=CHUNK_SIZE):
+    """
+    Writes the body of the streamed ``response`` to ``path`` chunk by chunk, through a temporary file that replaces
+    ``path`` once it is complete.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary = path + ".part"
+    try:
+        with open(temporary, "wb") as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+                transfer.update(chunk)
+        os.replace(temporary, path)
+    finally:
+        response.close()
+        if os.path.exists(temporary):
+            os.remove(temporary)
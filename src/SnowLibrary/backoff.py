@@ -0,0 +1,17 @@
+import random
+
+
+def exponential_backoff(initial=1.0, maximum=30.0, multiplier=2.0, jitter=True):
+    """
+    Yields an endless series of delays in seconds, starting at ``initial`` and growing by ``multiplier`` up to
+    ``maximum``. If ``jitter`` is True, each delay is drawn uniformly between half of and the full backoff value, so that
+    many callers waiting on the same thing do not all retry at the same moment.
+    """
+    delay = float(initial)
+    maximum = float(maximum)
+    while True:
+        if jitter:
+            yield random.uniform(delay / 2, delay)
+        else:
+            yield delay
+        delay = min(delay * multiplier, maximum)
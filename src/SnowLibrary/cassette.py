@@ -0,0 +1,139 @@
+import base64
+import gzip
+import io
+import json
+import os
+import threading
+from urllib.parse import parse_qsl, urlparse
+
+from requests.models import Response
+from robot.api import logger
+
+from SnowLibrary.exceptions import CassetteMiss
+
+# Request body fields that are different on every run, and so are left out of the key of the request.
+VOLATILE_BODY_FIELDS = ("batch_request_id",)
+# Response headers that are not recorded: cookies, and the headers describing the encoding of the content, which is
+# recorded decoded.
+UNRECORDED_HEADERS = ("set-cookie", "content-encoding", "content-length", "transfer-encoding")
+
+
+def request_key(method, url, body=None):
+    """
+    Returns the key identifying a request in a cassette: its method, host, path, query parameters in a normal order
+    and body. JSON bodies are normalized too, so that the order of their keys does not matter.
+    """
+    url = urlparse(url)
+    query = "&".join("{}={}".format(k, v) for k, v in sorted(parse_qsl(url.query, keep_blank_values=True)))
+    if hasattr(body, "read"):
+        body = "<stream>"  # A streamed body cannot be read without consuming it.
+    elif isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    if body:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            pass
+        else:
+            if isinstance(data, dict):
+                data = {k: v for k, v in data.items() if k not in VOLATILE_BODY_FIELDS}
+            body = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return "{m} {h}{p}?{q} {b}".format(m=method, h=url.netloc, p=url.path, q=query, b=body or "")
+
+
+class Cassette:
+    """
+    Records the responses of ServiceNow to the requests sent through the library, in a gzip compressed JSON file, and
+    replays them from memory instead of sending the requests again.
+
+    In RECORD mode, every response is recorded under the key of its request (see `request_key`), and `save` writes them
+    all to ``path``. In REPLAY mode, the file is loaded once, and each request is answered with the next response
+    recorded for its key, the last one being repeated once they are used up, so that a query repeated around an insert
+    is replayed with each of its results in turn. Requests that were not recorded are sent to the instance. STRICT
+    mode replays like REPLAY mode, but raises CassetteMiss for requests that were not recorded.
+
+    Request headers, including credentials, are not recorded.
+    """
+
+    MODES = ("RECORD", "REPLAY", "STRICT")
+
+    def __init__(self, path, mode="REPLAY"):
+        mode = mode.upper()
+        if mode not in self.MODES:
+            raise AssertionError("Invalid cassette mode {m}. Expected one of {v}.".format(
+                m=mode, v=", ".join(self.MODES)))
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.interactions = dict()
+        self._played = dict()
+        self._lock = threading.Lock()
+        if not self.recording:
+            self.load()
+
+    @property
+    def recording(self):
+        return self.mode == "RECORD"
+
+    def load(self):
+        """Read the interactions recorded in the cassette file."""
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                self.interactions = json.load(f)["interactions"]
+        except FileNotFoundError:
+            raise AssertionError("The cassette {} does not exist. Record it first.".format(self.path))
+        logger.debug("Loaded {n} recorded requests from the cassette {p}.".format(n=len(self.interactions),
+                                                                                 p=self.path))
+
+    def save(self):
+        """Write the recorded interactions to the cassette file."""
+        with self._lock:
+            data = {"version": 1, "interactions": self.interactions}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temporary = self.path + ".tmp"
+            with gzip.open(temporary, "wt", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(temporary, self.path)
+        logger.debug("Saved {n} recorded requests to the cassette {p}.".format(n=len(self.interactions), p=self.path))
+
+    def record(self, request, response, content):
+        """Record ``response`` to ``request``, whose body ``content`` has already been read."""
+        recorded = {"status_code": response.status_code, "reason": response.reason, "url": response.url,
+                    "headers": {k: v for k, v in response.headers.items() if k.lower() not in UNRECORDED_HEADERS}}
+        try:
+            recorded["text"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            recorded["base64"] = base64.b64encode(content).decode("ascii")
+        key = request_key(request.method, request.url, request.body)
+        with self._lock:
+            self.interactions.setdefault(key, list()).append(recorded)
+
+    def play(self, request):
+        """Returns the recorded response to ``request``, or None if there is none and the cassette is not STRICT."""
+        key = request_key(request.method, request.url, request.body)
+        with self._lock:
+            recorded = self.interactions.get(key)
+            if recorded is None:
+                self.misses += 1
+                if self.mode == "STRICT":
+                    raise CassetteMiss("No response to {m} {u} was recorded in the cassette {p}.".format(
+                        m=request.method, u=request.url, p=self.path))
+                return None
+            self.hits += 1
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+            recorded = recorded[min(played, len(recorded) - 1)]
+        if "text" in recorded:
+            content = recorded["text"].encode("utf-8")
+        else:
+            content = base64.b64decode(recorded["base64"])
+        response = Response()
+        response.status_code = recorded["status_code"]
+        response.reason = recorded["reason"]
+        response.url = recorded["url"]
+        response.headers.update(recorded["headers"])
+        response.raw = io.BytesIO(content)
+        response.request = request
+        return response
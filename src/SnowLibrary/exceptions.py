@@ -1,3 +1,6 @@
+from requests.exceptions import RequestException
+
+
 class Error(Exception):
     """Base class for exceptions in this module."""
     pass
@@ -7,3 +10,18 @@ class QueryNotExecuted(Error):
     """Raised when it is expected that a query has already been executed, but was not in SnowLibrary.RESTQuery."""
     def __init__(self, message):
         self.message = message
+
+
+class CircuitOpen(Error, RequestException):
+    """Raised instead of sending a request to a ServiceNow instance that has recently failed too many requests in a row.
+    It is a RequestException, so it is handled like the connection errors it stands in for."""
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+
+class CassetteMiss(Error):
+    """Raised when a strict cassette in REPLAY mode has no recorded response for a request."""
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
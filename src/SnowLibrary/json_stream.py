@@ -0,0 +1,80 @@
+import codecs
+import json
+import re
+
+from pysnow.exceptions import MissingResult, ResponseError
+
+_RESULT = re.compile(r'"result"\s*:\s*([\[{])')
+_SEPARATORS = " \t\r\n,"
+_decoder = json.JSONDecoder()
+
+
+def iter_records(raw, chunk_size=65536):
+    """
+    Incrementally parses a Table API response body from the file-like ``raw`` and yields each record in its ``result``
+    as soon as the record has been read, without holding the rest of the page in memory. Records are decoded one at a
+    time by the C accelerated JSON decoder, so this is also much faster than an event based parser. Stop iterating
+    (and close the response) to stop reading from the network.
+
+    Raises pysnow's ResponseError if the body contains an ``error`` object instead, and MissingResult if it contains
+    neither.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def read_more(size):
+        nonlocal buffer, position, eof
+        chunk = raw.read(size)
+        if not chunk:
+            eof = True
+            buffer = buffer[position:] + decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[position:] + decoder.decode(chunk)
+        position = 0
+
+    match = None
+    while match is None and not eof:
+        read_more(chunk_size)
+        match = _RESULT.search(buffer)
+    if match is None:
+        _raise_for_body(buffer)
+    position = match.end()
+    if match.group(1) == "{":
+        position -= 1  # A single record, e.g. the response to an insert.
+    size = chunk_size
+    while True:
+        while position < len(buffer) and buffer[position] in _SEPARATORS:
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise MissingResult("The response ended before the end of the result.")
+            read_more(chunk_size)
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            record, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more(size)
+            size *= 2  # Grow the reads for records larger than a chunk, so they are not re-parsed too many times.
+            continue
+        size = chunk_size
+        position = end
+        yield record
+        if match.group(1) == "{":
+            return
+
+
+def _raise_for_body(body):
+    """Raises the appropriate error for a response body that has no ``result``."""
+    try:
+        content = json.loads(body)
+    except ValueError:
+        content = None
+    if isinstance(content, dict) and "error" in content:
+        raise ResponseError(content["error"])
+    raise MissingResult("The expected `result` key was missing in the response. Cannot continue")
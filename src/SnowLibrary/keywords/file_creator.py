@@ -1,7 +1,13 @@
+import glob
+import json
 import os
 import re
 import random
-import csv
+import math
+import string
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
 
 import rstr
 from robot.libraries.OperatingSystem import OperatingSystem
@@ -9,6 +15,9 @@ from robot.libraries.BuiltIn import BuiltIn
 from robot.api import logger
 from robot.api.deco import keyword
 
+from ..line_index import LineIndex
+from ..writers import WRITERS
+
 
 class DataFile:
     """
@@ -35,6 +44,13 @@ class DataFile:
 
     VALID_DELIMITERS = {"COMMA": ",", "PIPE": "|", "TAB": "\t", "COLON": ":", "SEMICOLON": ";"}
 
+    VALID_OUTPUT_FORMATS = ["CSV", "FIXED_WIDTH", "JSONL", "XLSX"]
+
+    # Detail rows are generated and written this many at a time.
+    BATCH_SIZE = 10000
+    # The line offset index of a data file records the position of every INDEX_STRIDE-th row.
+    INDEX_STRIDE = 1000
+
     def __init__(self, name=None):
         """
         Initialize the data file instance. The default delimter is set to comma on instantiation.  This cna be changed using the
@@ -45,14 +61,14 @@ class DataFile:
         self.delimiter = ","
         self.row_definition = DataRow()
         self.number_of_rows = 0
+        self.output_format = "CSV"
+        self.max_rows_per_file = None
+        self.max_bytes_per_file = None
+        self.file_names = list()
         self._exists = False
-
-    def _append(self, data):
-        """Private method to write to the data file."""
-        with open(self.absolute_name, 'a', newline='') as f:
-            writer = csv.writer(f, delimiter=self.delimiter, quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(data)
-            logger.info("Writing data to file: {}".format(data))
+        self._has_header = False
+        self._part_rows = 0
+        self._part_bytes = 0
 
     @keyword
     def define_file_name(self, name):
@@ -68,7 +84,7 @@ class DataFile:
     @keyword
     def define_data_field(self, data_type, header, **kwargs):
         """Define a data field which will be included in this file.  Required arguments are the type of data, which can
-        be integer, string, or boolean. Optional keyword arguments include:
+        be integer, string, boolean, date, datetime, decimal, sys_id or email. Optional keyword arguments include:
         
         - ``required``:  Specify whether or not the field must always include data. True by default. Currently, does nothing with False.
         - ``min_length``: The minimum length of the data in this field. Defaults to 1 and only used if `options` is not provided.
@@ -80,6 +96,33 @@ class DataFile:
         - ``characters``: Indicate if the data field can only contains characters from a specific subtype.  Valid subtypes 
         are letters, uppercase, lowercase, digits, printable, punctuation, nonwhitespace, nondigits, nonletters, 
         normal, postalsafe, urlsafe, domainsafe. CREDIT - `rstr module<https://pypi.org/project/rstr/ >`_.
+        - ``source_table``: Sample the data from the values of ``source_field`` in this ServiceNow table (queried with
+        SnowLibrary.RESTQuery), so the file contains valid references such as real user sys_ids or group names. The values are
+        fetched once per ``cache_ttl`` seconds (default 3600), not once per row. If provided, options, regexp and starts_with are ignored.
+        - ``source_field``: The field to sample values from. Defaults to sys_id.
+        - ``source_query``: An encoded query limiting the records to sample values from, e.g. ``active=true``.
+        - ``replacement``: If False, each value from the source is only used once. True by default.
+        - ``unique``: If True, every row gets a different value, e.g. for coalesce keys. Only for integer fields or digit
+        characters. Values are ``max_length`` digits long (after ``starts_with``) and are never repeated, with constant memory use.
+        - ``sequence``: If True, rows get consecutive numbers starting at ``sequence_start`` (default 1) and increasing by
+        ``sequence_step`` (default 1), zero padded to ``min_length`` digits (after ``starts_with``).
+        - ``min_value`` / ``max_value``: The range of date (``YYYY-MM-DD``), datetime (``YYYY-MM-DD hh:mm:ss``) and decimal fields.
+        Dates default to 2000-01-01 through 2030-12-31, decimals to 0 through the largest value fitting the precision and scale.
+        - ``precision`` / ``scale``: The total number of digits, and the digits after the decimal point, of a decimal field.
+        Defaults to 10 and 2.
+        - ``domain``: The domain of the addresses generated for an email field. Defaults to example.com. The length of the part
+        before the @ is between ``min_length`` and ``max_length`` (at most 64).
+        - ``weights``: A comma-separated string of relative weights for ``options``, in the same order, to mimic skewed
+        production data. Weighted options are picked in constant time per row.
+        - ``width``: The width of the column when the file is written in fixed width format. Defaults to the length of the
+        longest value the field can generate, and must be provided for fields using ``regexp`` or ``source_table``.
+        - ``length_distribution``: How string lengths are distributed between ``min_length`` and ``max_length``: uniform
+        (default), normal (with ``length_mean`` and ``length_stddev``) or zipf (with ``zipf_exponent``, favouring short lengths).
+
+        | Define Data Field | header=REQ_STATUS | data_type=string | options=APPROVED, REJECTED, WITHDRAWN | weights=70, 29, 1 |
+        | Define Data Field | header=COMMENTS   | data_type=string | min_length=1 | max_length=500 | length_distribution=zipf |
+
+        | Define Data Field | header=ASSIGNED_TO | data_type=string | source_table=sys_user | source_field=user_name | source_query=active=true |
         """
         f = DataField(data_type, header, **kwargs)
         self.row_definition.add_data_field(f)
@@ -94,17 +137,77 @@ class DataFile:
         else:
             self.delimiter = self.VALID_DELIMITERS[delimiter.upper()]
 
+    @keyword
+    def define_output_format(self, output_format):
+        """Define the format of the file. If unspecified, this will be defaulted to CSV. Valid values are
+        (case-insensitive):
+
+        - ``CSV``: Delimited text, using the delimiter set with `Define Delimiter`.
+        - ``FIXED_WIDTH``: Values are left aligned and padded with spaces to the width of their column, see the ``width``
+        argument of `Define Data Field`. Longer values are truncated.
+        - ``JSONL``: JSON Lines, one JSON object per row, keyed by the field headers. There is no header row.
+        - ``XLSX``: An Excel workbook. Requires the openpyxl package. The whole workbook, including the header row if
+        `Append Header Row` was used, is written by `Append Detail Rows`, which can only be used once per file.
+
+        Text files are always written in UTF-8, whatever the locale of the machine.
+
+        | Define Output Format | FIXED_WIDTH |
+        """
+        if output_format.upper() not in self.VALID_OUTPUT_FORMATS:
+            raise AssertionError("Invalid output format.  Output format must be CSV, FIXED_WIDTH, JSONL or XLSX.")
+        else:
+            self.output_format = output_format.upper()
+
+    @keyword
+    def define_file_split(self, max_rows=None, max_bytes=None):
+        """Split the detail rows into several files holding at most ``max_rows`` detail rows and/or ``max_bytes`` bytes
+        each, instead of writing a single file. This must be used before `Create Data File`. The files are named after the
+        file name with a sequence number, e.g. requisitions_001.csv, requisitions_002.csv... for requisitions.csv, and each
+        of them starts with the header row if `Append Header Row` was used. The names of the files written are returned by
+        `Get Data File Names`. ``max_bytes`` cannot be used with XLSX files.
+
+        | Define File Split | max_rows=50000 |
+        """
+        if max_rows is None and max_bytes is None:
+            raise AssertionError("Either max_rows or max_bytes must be provided to split the file.")
+        try:
+            self.max_rows_per_file = int(max_rows) if max_rows is not None else None
+            self.max_bytes_per_file = int(max_bytes) if max_bytes is not None else None
+        except ValueError:
+            raise AssertionError("Failed attempting to convert input to an integer.")
+        if min(v for v in (self.max_rows_per_file, self.max_bytes_per_file) if v is not None) <= 0:
+            raise AssertionError("The maximum number of rows and bytes per file must be positive integers.")
+
+    @keyword
+    def get_data_file_names(self):
+        """Returns the list of absolute names of the files written, which is a single file unless `Define File Split`
+        was used."""
+        if self._is_split():
+            return list(self.file_names)
+        return [self.absolute_name]
+
     @keyword
     def create_data_file(self):
         """Create a file with the given name.  The file name must be defined first using `Define File Name` keyword. 
         This keyword leverages the Robot Framework OperatingSystem library keyword `Create File`, so if the directory
-        for the file does not exist, it is created, along with missing intermediate directories."""
+        for the file does not exist, it is created, along with missing intermediate directories. The parts of a split
+        file left by an earlier test or run are removed."""
         if self.absolute_name is None:
             raise AssertionError("The file name has not been defined.  Define it using the 'Define File Name' keyword")
         else:
             operating_sys = OperatingSystem()
             try:
-                operating_sys.create_file(self.absolute_name)
+                if self._is_split():
+                    operating_sys.create_directory(os.path.dirname(self.absolute_name))
+                    for name in self._existing_part_names():  # Parts of an earlier run would be appended to.
+                        operating_sys.remove_file(name)
+                    self.file_names = list()
+                    self._part_rows = 0
+                    self._part_bytes = 0
+                else:
+                    operating_sys.create_file(self.absolute_name)
+                    operating_sys.remove_file(self.absolute_name + ".idx")
+                operating_sys.remove_file(self.absolute_name + ".state")
                 self._exists = True
             except PermissionError as e:
                 logger.error(e.strerror)
@@ -130,7 +233,11 @@ class DataFile:
             raise AssertionError("The data file has not been created. Use the 'Create Data File' keyword to create it.")
         else:
             headers = self.row_definition.create_header_row()
-            self._append(headers)
+            self._has_header = True
+            if self.output_format in ("CSV", "FIXED_WIDTH") and not self._is_split():
+                with open(self.absolute_name, 'a', newline='', encoding="utf-8") as f:
+                    f.write("".join(self._get_writer().render_header(headers)))
+                logger.info("Writing data to file: {}".format(headers))
 
     @keyword
     def append_detail_rows(self):
@@ -142,21 +249,220 @@ class DataFile:
         elif self.number_of_rows == 0:
             raise AssertionError("The number of detail rows has not been defined. Use the `Number Of Detail Rows Is` keyword first.")
         else:
-            for i in range(self.number_of_rows):
-                detail_row = self.row_definition.create_detail_row()
-                self._append(detail_row)
+            writer = self._get_writer()
+            if self.output_format == "XLSX":
+                self._write_workbooks(writer)
+            else:
+                self._write_lines(writer, self.number_of_rows)
+            logger.info("Wrote {n} detail rows to file: {f}".format(n=self.number_of_rows, f=self.absolute_name))
+
+    @keyword
+    def append_more_detail_rows(self, rows):
+        """Append ``rows`` more detail rows to the end of an existing data file, e.g. to grow a large file a little more in
+        each run of a soak test. The rows are generated from the current field definitions, and the time taken only
+        depends on ``rows``: the existing content of the file is never read. The file can have been created in an earlier
+        test or run, as long as `Define File Name` and `Define Output Format` match it. If the file has a row index (see
+        `Get Data File Row`), it is updated with the new rows. XLSX files are not supported.
+
+        Unique and sequence fields carry on from the values already in the file: their state is saved next to it as
+        ``<file name>.state`` whenever rows are written, and loaded again by this keyword, in place of ``sequence_start``.
+        Fields are matched by header, and the state is removed by `Create Data File` and `Remove Data File`.
+
+        | Define File Name | ${absolute_file_name} |
+        | Define Data Field | header=REQ_ID | data_type=integer | min_length=15 | max_length=15 | unique=True |
+        | Append More Detail Rows | 100000 |
+        """
+        try:
+            rows = int(rows)
+        except ValueError:
+            raise AssertionError("Failed attempting to convert input to an integer.")
+        if rows < 0:
+            raise AssertionError("Number of details rows must be a positive integer.")
+        if self.output_format == "XLSX":
+            raise AssertionError("Detail rows cannot be appended to XLSX files.")
+        if self.absolute_name is None:
+            raise AssertionError("The file name has not been defined.  Define it using the 'Define File Name' keyword")
+        if not self._exists and not os.path.isfile(self.absolute_name):
+            raise AssertionError("The data file has not been created. Use the 'Create Data File' keyword to create it.")
+        self._load_field_state()
+        self._write_lines(self._get_writer(), rows)
+        if not self._is_split() and os.path.isfile(self.absolute_name + ".idx"):
+            self._get_index()
+        logger.info("Appended {n} detail rows to file: {f}".format(n=rows, f=self.absolute_name))
+
+    @keyword
+    def get_data_file_row(self, row):
+        """Returns row number ``row`` of the data file, counting from 1, which is the header row if the file has one.
+        The row is returned as a list of values for CSV and fixed width files, and as a dictionary for JSONL files.
+
+        Rows are found with an index of the file, saved next to it as ``<file name>.idx``, which records where every
+        1000th row starts. The index is built by the first use of this keyword or `Get Random Data File Rows` on a file,
+        and afterwards only the rows appended since are read to update it, so rows of very large files are fetched without
+        scanning them. Rows are counted as lines, so values must not contain line breaks.
+
+        | ${row}= | Get Data File Row | 1000000 |
+        """
+        try:
+            row = int(row)
+        except ValueError:
+            raise AssertionError("Failed attempting to convert input to an integer.")
+        index = self._get_index()
+        if not 1 <= row <= index.line_count:
+            raise AssertionError("Row {r} is out of range, the file has {n} rows.".format(r=row, n=index.line_count))
+        return self._parse_line(index.read_line(row - 1))
+
+    @keyword
+    def get_random_data_file_rows(self, count, skip_header_row=False):
+        """Returns a list of ``count`` different rows of the data file, picked at random, in the order they are in the
+        file. Set ``skip_header_row`` to True to leave out the first row. The rows are returned and found like with
+        `Get Data File Row`.
+
+        | ${sample}= | Get Random Data File Rows | 100 | skip_header_row=True |
+        """
+        try:
+            count = int(count)
+        except ValueError:
+            raise AssertionError("Failed attempting to convert input to an integer.")
+        index = self._get_index()
+        first = 1 if _is_true(skip_header_row) else 0
+        if not 0 <= count <= index.line_count - first:
+            raise AssertionError("Cannot pick {c} rows from a file with {n} rows.".format(c=count,
+                                                                                       n=index.line_count - first))
+        numbers = sorted(random.sample(range(first, index.line_count), count))
+        return [self._parse_line(line) for line in index.read_lines(numbers)]
+
+    def _is_split(self):
+        return self.max_rows_per_file is not None or self.max_bytes_per_file is not None
+
+    def _get_writer(self):
+        return WRITERS[self.output_format](self.row_definition.fields, self.delimiter)
+
+    def _detail_row_batches(self, count):
+        """Yields ``count`` detail rows to write, generated BATCH_SIZE rows at a time."""
+        for written in range(0, count, self.BATCH_SIZE):
+            yield self.row_definition.create_detail_rows(min(self.BATCH_SIZE, count - written))
+
+    def _write_lines(self, writer, count):
+        """Append ``count`` detail rows to a text file, or to the parts of a split file."""
+        if self._is_split():
+            self._write_parts(writer, count)
+        else:
+            with open(self.absolute_name, 'a', newline='', encoding="utf-8") as f:
+                for rows in self._detail_row_batches(count):
+                    f.write("".join(writer.render(rows)))
+        self._save_field_state()
+
+    def _load_field_state(self):
+        """Restore the state of the unique and sequence fields saved by the last rows written to the file, if any."""
+        try:
+            with open(self.absolute_name + ".state", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        for field in self.row_definition.fields:
+            if field.header in state:
+                field.set_state(state[field.header])
+
+    def _save_field_state(self):
+        """Save the state of the unique and sequence fields next to the file, so that later appends carry on from it."""
+        state = {field.header: field.get_state() for field in self.row_definition.fields}
+        state = {header: value for header, value in state.items() if value is not None}
+        if state:
+            with open(self.absolute_name + ".state", 'w', encoding="utf-8") as f:
+                json.dump(state, f)
+
+    def _get_index(self):
+        """Returns the row index of the data file, brought up to date."""
+        if self.absolute_name is None:
+            raise AssertionError("The file name has not been defined.  Define it using the 'Define File Name' keyword")
+        if self.output_format == "XLSX" or self._is_split():
+            raise AssertionError("Rows can only be read from data files that are neither XLSX nor split.")
+        index = LineIndex(self.absolute_name, self.INDEX_STRIDE)
+        index.update()
+        return index
+
+    def _parse_line(self, line):
+        return self._get_writer().parse(line.decode("utf-8"))
+
+    def _part_name(self, number):
+        root, extension = os.path.splitext(self.absolute_name)
+        return "{r}_{n:03d}{e}".format(r=root, n=number, e=extension)
+
+    def _existing_part_names(self):
+        """Returns the names of the existing parts of the split file, including those written by another instance."""
+        root, extension = os.path.splitext(self.absolute_name)
+        names = glob.glob(glob.escape(root) + "_[0-9][0-9][0-9]*" + glob.escape(extension))
+        return sorted(n for n in names if re.fullmatch(r"\d{3,}", n[len(root) + 1:len(n) - len(extension)]))
+
+    def _write_parts(self, writer, count):
+        """Write the detail rows of a split file, starting a new file whenever the current one is full. Further calls
+        carry on filling the last file."""
+        header = "".join(writer.render_header(self.row_definition.create_header_row())) if self._has_header else ""
+        f = None
+        try:
+            for rows in self._detail_row_batches(count):
+                for line in writer.render(rows):
+                    size = len(line.encode("utf-8")) if self.max_bytes_per_file else 0
+                    if f is None or self._part_is_full(size):
+                        if f is not None:
+                            f.close()
+                        if not self.file_names or self._part_is_full(size):
+                            self.file_names.append(self._part_name(len(self.file_names) + 1))
+                            self._part_rows = 0
+                            self._part_bytes = 0
+                        f = open(self.file_names[-1], 'a', newline='', encoding="utf-8")
+                        if self._part_rows == 0 and self._part_bytes == 0 and header:
+                            f.write(header)
+                            self._part_bytes = len(header.encode("utf-8"))
+                    f.write(line)
+                    self._part_rows += 1
+                    self._part_bytes += size
+        finally:
+            if f is not None:
+                f.close()
+
+    def _part_is_full(self, size):
+        """Returns whether a line of ``size`` bytes would not fit in the current part of a split file."""
+        if self.max_rows_per_file is not None and self._part_rows >= self.max_rows_per_file:
+            return True
+        return self.max_bytes_per_file is not None and self._part_rows > 0 and \
+            self._part_bytes + size > self.max_bytes_per_file
+
+    def _write_workbooks(self, writer):
+        """Write the detail rows to one workbook, or to workbooks of at most max_rows_per_file rows if the file is split."""
+        if self.max_bytes_per_file is not None:
+            raise AssertionError("XLSX files can only be split by number of rows.")
+        if self.file_names:
+            raise AssertionError("The detail rows of XLSX files can only be appended once.")
+        headers = self.row_definition.create_header_row() if self._has_header else None
+        rows = (row for batch in self._detail_row_batches(self.number_of_rows) for row in batch)
+        if not self._is_split():
+            self.file_names.append(self.absolute_name)
+            writer.write(self.absolute_name, rows, headers)
+            return
+        remaining = self.number_of_rows
+        while remaining > 0:
+            self.file_names.append(self._part_name(len(self.file_names) + 1))
+            part = min(remaining, self.max_rows_per_file)
+            writer.write(self.file_names[-1], (next(rows) for _ in range(part)), headers)
+            remaining -= part
 
     @keyword
     def remove_data_file(self):
         """Remove a file with the given name.  The file name must be defined first using `Define File Name` keyword. 
         This keyword leverages the Robot Framework OperatingSystem library keyword `Remove File`. If the file does not
-        exist, nothing will happen."""
+        exist, nothing will happen. Every part of a split file is removed, even if it was written by another test."""
         if self.absolute_name is None:
             raise AssertionError("The file name has not been defined.  Define it using the 'Define File Name' keyword")
         else:
             operating_sys = OperatingSystem()
             try:
                 operating_sys.remove_file(self.absolute_name)
+                operating_sys.remove_file(self.absolute_name + ".idx")
+                operating_sys.remove_file(self.absolute_name + ".state")
+                for name in set(self.file_names) | set(self._existing_part_names()):
+                    operating_sys.remove_file(name)
+                self.file_names = list()
                 self._exists = False
             except PermissionError as e:
                 logger.error(e.strerror)
@@ -169,8 +475,9 @@ class DataFile:
         if self.absolute_name is None:
             raise AssertionError("The file name has not been defined.  Define it using the 'Define File Name' keyword")
         else:
-            with open(self.absolute_name, 'r') as f:
-                actual_rows = len(f.readlines())
+            actual_rows = 0
+            for name in self.get_data_file_names():
+                actual_rows += _count_lines(name)
         bi = BuiltIn()
         if actual_rows != bi.convert_to_integer(expected_rows):
             bi.fail("Expected file to contain {e} rows, but found {a} rows instead.".format(e=expected_rows, a=actual_rows))
@@ -213,13 +520,138 @@ class DataRow:
             detail_list = [f.get_data() for f in self.fields]
             return detail_list
 
+    def create_detail_rows(self, count):
+        """Returns a list of ``count`` detail rows, generated column by column, with the fields in this data row."""
+        if not self._has_fields:
+            raise AssertionError("No data fields have been added to the data row. Detail row would be empty.")
+        else:
+            columns = [f.get_data_batch(count) for f in self.fields]
+            return list(zip(*columns))
+
+
+def _count_lines(name):
+    """Returns the number of lines in the file ``name``, reading it in chunks rather than all at once."""
+    lines, last = 0, b"\n"
+    with open(name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return lines + (last != b"\n")
+
+
+def _is_true(value):
+    """Returns whether a keyword argument, which may have been passed as a string from Robot Framework, is true."""
+    if isinstance(value, str):
+        return value.strip().upper() == "TRUE"
+    return bool(value)
+
+
+class _RandomPermutation:
+    """
+    A random bijection of the integers in [0, size), computed one value at a time with a small Feistel network and cycle
+    walking. Values are unique without having to remember the values already generated, so memory use is constant
+    however large the key space is.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, size):
+        self.size = size
+        self._half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self._mask = (1 << self._half_bits) - 1
+        self._keys = [random.getrandbits(64) for _ in range(self.ROUNDS)]
+
+    def _encrypt(self, value):
+        left, right = value >> self._half_bits, value & self._mask
+        for key in self._keys:
+            left, right = right, left ^ ((((right ^ key) * 0x9E3779B97F4A7C15) >> 17) & self._mask)
+        return (left << self._half_bits) | right
+
+    def __getitem__(self, index):
+        value = self._encrypt(index)
+        while value >= self.size:  # The network covers a power of 4, so walk until landing back inside the range.
+            value = self._encrypt(value)
+        return value
+
+
+class _AliasSampler:
+    """
+    Samples indexes 0..n-1 with the given relative weights in constant time per sample, using Vose's alias method.
+    The probability and alias tables are built once in O(n).
+    """
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        self.probability = [0.0] * n
+        self.alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        for i in small + large:  # Whatever is left is 1.0, give or take rounding errors.
+            self.probability[i] = 1.0
+
+    def sample(self):
+        """Returns one index."""
+        i = random.randrange(len(self.probability))
+        return i if random.random() < self.probability[i] else self.alias[i]
+
+    def sample_batch(self, count):
+        """Returns a list of ``count`` indexes."""
+        n, probability, alias, rand = len(self.probability), self.probability, self.alias, random.random
+        indexes = list()
+        for _ in range(count):
+            x = rand() * n
+            i = int(x)
+            indexes.append(i if x - i < probability[i] else alias[i])
+        return indexes
+
+
+_source_values = dict()
+
+
+def _get_source_values(table, field, query, ttl):
+    """
+    Returns the non-empty values of ``field`` in the ServiceNow ``table`` records matching the encoded ``query``. The
+    values are fetched page by page once, and cached in this process for ``ttl`` seconds.
+    """
+    key = (table, field, query)
+    cached = _source_values.get(key)
+    if cached is not None and cached[0] > time.time():
+        return cached[1]
+    from SnowLibrary.keywords.rest_api import RESTQuery  # Imported here, since rest_api imports this module.
+    values = list()
+    for record in RESTQuery(query_table=table)._paginate(query or "", fields=[field]):
+        value = record.get(field, "")
+        if isinstance(value, dict):
+            value = value.get("value", "")
+        if value != "":
+            values.append(value)
+    if not values:
+        raise AssertionError("No values found for {f} in {t} to use as a data source.".format(f=field, t=table))
+    logger.info("Loaded {n} values for {f} from {t}.".format(n=len(values), f=field, t=table))
+    _source_values[key] = (time.time() + float(ttl), values)
+    return values
+
 
 class DataField:
     """Files are made up of rows of data, which are made up of data fields.  This class is used to track attributes of data fields,
     so that they can be quickly created and written to a data row, which will then be written to the file.
     """
 
-    VALID_DATA_TYPES = ["INTEGER", "STRING", "BOOLEAN"]
+    VALID_DATA_TYPES = ["INTEGER", "STRING", "BOOLEAN", "DATE", "DATETIME", "DECIMAL", "SYS_ID", "EMAIL"]
+    DATE_FORMAT = "%Y-%m-%d"
+    DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"  # The format used by ServiceNow, see RESTQuery._parse_datetime
+    DEFAULT_RANGES = {"DATE": ("2000-01-01", "2030-12-31"),
+                      "DATETIME": ("2000-01-01 00:00:00", "2030-12-31 23:59:59")}
+    EMAIL_CHARACTERS = string.ascii_lowercase + string.digits
+    LENGTH_DISTRIBUTIONS = ["UNIFORM", "NORMAL", "ZIPF"]
     CHARACTER_TYPES = {"LETTERS": rstr.letters, "UPPERCASE": rstr.uppercase, "PRINTABLE": rstr.printable,
                        "PUNCTUATION": rstr.punctuation,
                        "NONWHITESPACE": rstr.nonwhitespace, "LOWERCASE": rstr.lowercase, "DIGITS": rstr.digits,
@@ -230,10 +662,14 @@ class DataField:
                        }
 
     def __init__(self, data_type, header, required=True, min_length=1, max_length=1000, options=None, regexp=None,
-                 starts_with=None, characters=None):
+                 starts_with=None, characters=None, source_table=None, source_field=None, source_query=None,
+                 replacement=True, cache_ttl=3600, unique=False, sequence=False, sequence_start=1, sequence_step=1,
+                 min_value=None, max_value=None, precision=10, scale=2, domain="example.com", weights=None,
+                 length_distribution="uniform", length_mean=None, length_stddev=None, zipf_exponent=1.0, width=None):
         """
         Initialize the data field instance.
-        :param data_type:  The type of data that will be contained in the field, e.g. integer, string, boolean.
+        :param data_type:  The type of data that will be contained in the field: integer, string, boolean, date, datetime,
+               decimal, sys_id or email.
         :param header:  The content of the header row that for the column that contains this data field.
         :param required:  Specify whether or not the field must always include data. True by default. Currently, does nothing with False.
         :param min_length: The minimum length of the data in this field. Defaults to 1 and only used if `options` is not provided.
@@ -245,6 +681,32 @@ class DataField:
         :param characters: Indicate if the data field can only contains characters from a specific subtype.  Valid subtypes 
                are letters, uppercase, lowercase, digits, printable, punctuation, nonwhitespace, nondigits, nonletters, 
                normal, postalsafe, urlsafe, domainsafe. CREDIT - `rstr module<https://pypi.org/project/rstr/ >`_.
+        :param source_table:  Sample the data from the values of `source_field` in this ServiceNow table, e.g. real user sys_ids.
+               If provided, options, regexp and starts_with are ignored.
+        :param source_field:  The field to sample values from. Defaults to sys_id.
+        :param source_query:  An encoded query limiting the records to sample values from, e.g. active=true.
+        :param replacement:  Whether a value can be used more than once. True by default. If False, each value is only used
+               once, and an error is raised when every value has been used.
+        :param cache_ttl:  The number of seconds the values fetched from ServiceNow are reused for. Defaults to 3600.
+        :param unique:  Generate a different value in every row, e.g. for coalesce keys. Only for digit fields. Values are
+               `max_length` digits long (after `starts_with`), drawn in a random order from every possible value.
+        :param sequence:  Generate consecutive numbers instead of random data, starting at `sequence_start` and increasing by
+               `sequence_step`, zero padded to `min_length` digits (after `starts_with`).
+        :param min_value:  The smallest value for date (YYYY-MM-DD), datetime (YYYY-MM-DD hh:mm:ss) and decimal fields.
+               Defaults to 2000-01-01 for dates, and 0 for decimals.
+        :param max_value:  The largest value for date, datetime and decimal fields. Defaults to 2030-12-31 for dates, and the
+               largest decimal that fits `precision` and `scale`.
+        :param precision:  The total number of digits of a decimal field. Defaults to 10.
+        :param scale:  The number of digits after the decimal point of a decimal field. Defaults to 2.
+        :param domain:  The domain of the addresses generated for an email field. Defaults to example.com.
+        :param weights:  A comma-separated string of relative weights for `options`, in the same order, e.g. 70, 29, 1.
+               Options are picked uniformly if not provided.
+        :param length_distribution:  How the length of generated strings is distributed between `min_length` and `max_length`:
+               uniform (default), normal or zipf.
+        :param length_mean:  The mean length for the normal distribution. Defaults to halfway between the lengths.
+        :param length_stddev:  The standard deviation for the normal distribution. Defaults to a sixth of the length range.
+        :param zipf_exponent:  The exponent of the zipf distribution, which makes shorter lengths more likely. Defaults to 1.
+        :param width:  The width of the column in fixed width files. Defaults to the longest value the field can generate.
         """
         self.data_type = data_type
         self.header = header
@@ -272,6 +734,31 @@ class DataField:
             self.characters = characters
         else:
             self.characters = characters   # Otherwise, use the specified characters set.
+        self.source_table = source_table
+        self.source_field = source_field or "sys_id"
+        self.source_query = source_query
+        self.replacement = _is_true(replacement)
+        self.cache_ttl = float(cache_ttl)
+        self._unused_source_values = None
+        self.unique = _is_true(unique)
+        self.sequence = _is_true(sequence)
+        self.sequence_step = int(sequence_step)
+        self._next_in_sequence = int(sequence_start)
+        self._permutation = None
+        self._generated = 0
+        self.min_value = min_value
+        self.max_value = max_value
+        self.precision = int(precision)
+        self.scale = int(scale)
+        self.domain = domain
+        self.weights = weights
+        self.length_distribution = length_distribution
+        self.length_mean = length_mean
+        self.length_stddev = length_stddev
+        self.zipf_exponent = float(zipf_exponent)
+        self._option_sampler = None
+        self._length_sampler = None
+        self.width = int(width) if width is not None else None
         self._validate()
 
     def _validate(self):
@@ -279,6 +766,10 @@ class DataField:
         self._validate_data_type()
         self._validate_characters()
         self._validate_regexp()
+        self._validate_unique_and_sequence()
+        self._validate_range()
+        self._validate_weights()
+        self._validate_length_distribution()
         logger.debug("Instance attributes passed validation.")
 
     def _validate_characters(self):
@@ -295,7 +786,8 @@ class DataField:
         """Ensures that the input `data_type` is one of VALID_DATA_TYPES."""
         if self.data_type.upper() not in self.VALID_DATA_TYPES:
             raise AssertionError(
-                "Invalid data type specified.  Expected either integer, string, or boolean, but `{}` was provided.".format(
+                "Invalid data type specified.  Expected one of integer, string, boolean, date, datetime, decimal, sys_id "
+                "or email, but `{}` was provided.".format(
                     self.data_type))
         else:
             logger.debug("Valid data type provided on instantiation.")
@@ -311,18 +803,264 @@ class DataField:
         else:
             logger.debug("No regular expression provided on instantiation.")
 
+    def _get_source_data(self):
+        """Sample a value from the source table, with or without replacement."""
+        values = _get_source_values(self.source_table, self.source_field, self.source_query, self.cache_ttl)
+        if self.replacement:
+            return random.choice(values)
+        if self._unused_source_values is None:
+            self._unused_source_values = random.sample(values, len(values))
+        if not self._unused_source_values:
+            raise AssertionError("Every value of {f} in {t} has already been used for {h}.".format(
+                f=self.source_field, t=self.source_table, h=self.header))
+        return self._unused_source_values.pop()
+
+    def _validate_range(self):
+        """Parses and checks the bounds of date, datetime and decimal fields, and precomputes their generator ranges.
+        Also checks that the minimum length of email fields fits the part of the address before the @."""
+        data_type = self.data_type.upper()
+        if data_type == "EMAIL" and self.min_length > 64:
+            raise AssertionError("The part of an email address before the @ is at most 64 characters, but the minimum "
+                                 "length of {h} is {m}.".format(h=self.header, m=self.min_length))
+        if data_type in ["DATE", "DATETIME"]:
+            value_format = self.DATE_FORMAT if data_type == "DATE" else self.DATETIME_FORMAT
+            low, high = self.DEFAULT_RANGES[data_type]
+            try:
+                low = datetime.strptime(str(self.min_value or low), value_format)
+                high = datetime.strptime(str(self.max_value or high), value_format)
+            except ValueError:
+                raise AssertionError("Invalid range for a {t} field, values must be in the format {f}.".format(
+                    t=data_type.lower(), f=value_format.replace("%Y", "YYYY").replace("%m", "MM").replace(
+                        "%d", "DD").replace("%H", "hh").replace("%M", "mm").replace("%S", "ss")))
+            if data_type == "DATE":
+                self._low, self._span = low.toordinal(), high.toordinal() - low.toordinal() + 1
+            else:
+                self._low, self._span = low, int((high - low).total_seconds()) + 1
+        elif data_type == "DECIMAL":
+            if not 0 <= self.scale <= self.precision or self.precision < 1:
+                raise AssertionError("Invalid precision and scale for a decimal field: scale must be between 0 and the "
+                                     "precision.")
+            largest = 10 ** self.precision - 1
+            try:
+                low = int(Decimal(str(self.min_value or 0)).scaleb(self.scale))
+                high = int(Decimal(str(self.max_value)).scaleb(self.scale)) if self.max_value is not None else largest
+            except InvalidOperation:
+                raise AssertionError("Invalid range for a decimal field, values must be numbers.")
+            if max(abs(low), abs(high)) > largest:
+                raise AssertionError("The range of the decimal field does not fit its precision and scale.")
+            self._low, self._span = low, high - low + 1
+        else:
+            return
+        if self._span < 1:
+            raise AssertionError("The minimum value of {} is greater than its maximum value.".format(self.header))
+
+    def _get_dates(self, count):
+        """Returns ``count`` random dates in the field's range, as YYYY-MM-DD."""
+        low, span, randrange, fromordinal = self._low, self._span, random.randrange, date.fromordinal
+        return [fromordinal(low + randrange(span)).isoformat() for _ in range(count)]
+
+    def _get_datetimes(self, count):
+        """Returns ``count`` random datetimes in the field's range, as YYYY-MM-DD hh:mm:ss."""
+        low, span, randrange = self._low, self._span, random.randrange
+        return [str(low + timedelta(seconds=randrange(span))) for _ in range(count)]
+
+    def _get_decimals(self, count):
+        """Returns ``count`` random decimals in the field's range, with ``scale`` digits after the point."""
+        low, span, randrange, scale = self._low, self._span, random.randrange, self.scale
+        if scale == 0:
+            return [str(low + randrange(span)) for _ in range(count)]
+        divisor = 10 ** scale
+        template = "{}{}.{:0" + str(scale) + "d}"
+        values = list()
+        for _ in range(count):
+            value = low + randrange(span)
+            whole, fraction = divmod(abs(value), divisor)
+            values.append(template.format("-" if value < 0 else "", whole, fraction))
+        return values
+
+    def _get_sys_ids(self, count):
+        """Returns ``count`` random 32 character hexadecimal sys_ids."""
+        getrandbits = random.getrandbits
+        return ["%032x" % getrandbits(128) for _ in range(count)]
+
+    def _get_emails(self, count):
+        """Returns ``count`` random email addresses at the field's domain."""
+        choices, randint, characters = random.choices, random.randint, self.EMAIL_CHARACTERS
+        low, high = max(self.min_length, 1), max(min(self.max_length, 64), 1)
+        suffix = "@" + self.domain
+        return ["".join(choices(characters, k=randint(low, high))) + suffix for _ in range(count)]
+
+    _TYPE_GENERATORS = {"DATE": _get_dates, "DATETIME": _get_datetimes, "DECIMAL": _get_decimals,
+                        "SYS_ID": _get_sys_ids, "EMAIL": _get_emails}
+
+    def _validate_weights(self):
+        """Parses the option weights and builds the alias table used to pick weighted options."""
+        if self.weights is None:
+            return
+        if self.options is None:
+            raise AssertionError("Weights can only be provided along with options.")
+        try:
+            weights = [float(w) for w in str(self.weights).split(",")]
+        except ValueError:
+            raise AssertionError("Invalid weights `{}`, must be comma-separated numbers.".format(self.weights))
+        if len(weights) != len(self.options):
+            raise AssertionError("Expected {o} weights, one for each option, but got {w}.".format(o=len(self.options),
+                                                                                              w=len(weights)))
+        if min(weights) < 0 or sum(weights) <= 0:
+            raise AssertionError("Weights must not be negative, and at least one must be positive.")
+        self._option_sampler = _AliasSampler(weights)
+
+    def _validate_length_distribution(self):
+        """Ensures the length distribution is valid and builds the alias table used to pick lengths."""
+        distribution = str(self.length_distribution).upper()
+        if distribution not in self.LENGTH_DISTRIBUTIONS:
+            raise AssertionError("Invalid length distribution `{}`. Expected uniform, normal or zipf.".format(
+                self.length_distribution))
+        if distribution == "UNIFORM" or self.max_length < self.min_length:
+            return
+        lengths = range(self.min_length, self.max_length + 1)
+        if distribution == "NORMAL":
+            mean = float(self.length_mean) if self.length_mean is not None else (self.min_length + self.max_length) / 2
+            stddev = float(self.length_stddev) if self.length_stddev is not None else \
+                max((self.max_length - self.min_length) / 6, 0.5)
+            weights = [math.exp(-((n - mean) / stddev) ** 2 / 2) for n in lengths]
+        else:
+            weights = [1 / (rank ** self.zipf_exponent) for rank in range(1, len(lengths) + 1)]
+        self._lengths = list(lengths)
+        self._length_sampler = _AliasSampler(weights)
+
+    def _get_random_string(self):
+        """Returns a random string from the character set, with a length drawn from the length distribution."""
+        generate = self.CHARACTER_TYPES[self.characters.upper()]
+        if self._length_sampler is None:
+            return generate(self.min_length, self.max_length)
+        length = self._lengths[self._length_sampler.sample()]
+        return generate(length, length)
+
+    def _validate_unique_and_sequence(self):
+        """Ensures that unique or sequence modes are only used for digit fields without options, regexp or source."""
+        if self.unique or self.sequence:
+            if self.unique and self.sequence:
+                raise AssertionError("A field cannot be both unique and a sequence. Sequences are always unique.")
+            if self.options is not None or self.regexp is not None or self.source_table is not None:
+                raise AssertionError("Unique and sequence values cannot be combined with options, regexp or a source table.")
+            if self.characters is None or self.characters.upper() != "DIGITS":
+                raise AssertionError("Unique and sequence values are only supported for integer fields or digit characters.")
+            if self.max_length < 1:
+                raise AssertionError("The maximum length leaves no room for unique or sequence values.")
+            if self.sequence and self.sequence_step == 0:
+                raise AssertionError("The sequence step must not be 0.")
+
+    def get_state(self):
+        """Returns the state needed to carry on generating unique or sequence values, or None for other fields."""
+        if self.sequence:
+            return {"next_in_sequence": self._next_in_sequence}
+        if self.unique and self._permutation is not None:
+            return {"size": self._permutation.size, "keys": self._permutation._keys, "generated": self._generated}
+        return None
+
+    def set_state(self, state):
+        """Carries on generating unique or sequence values from ``state``, as returned by ``get_state``."""
+        if self.sequence and "next_in_sequence" in state:
+            self._next_in_sequence = state["next_in_sequence"]
+        elif self.unique and "keys" in state:
+            self._get_unique_batch(0)
+            if state["size"] != self._permutation.size:
+                raise AssertionError("The unique values of {h} were generated with a different length.".format(h=self.header))
+            self._permutation._keys = state["keys"]
+            self._generated = state["generated"]
+
+    def _get_unique_batch(self, count):
+        """Returns ``count`` values that have not been generated by this field before."""
+        if self._permutation is None:
+            # Integers without a prefix must not begin with 0, so they are drawn from 10^(n-1) to 10^n - 1.
+            self._low = 10 ** (self.max_length - 1) if self.starts_with is None and self.max_length > 1 else 0
+            self._permutation = _RandomPermutation(10 ** self.max_length - self._low)
+        if self._generated + count > self._permutation.size:
+            raise AssertionError("Only {n} unique values of {l} digits exist for {h}.".format(
+                n=self._permutation.size, l=self.max_length, h=self.header))
+        prefix = self.starts_with or ""
+        low = self._low
+        width = self.max_length
+        permutation = self._permutation
+        start = self._generated
+        self._generated += count
+        return [prefix + str(low + permutation[i]).zfill(width) for i in range(start, start + count)]
+
+    def _get_sequence_batch(self, count):
+        """Returns the next ``count`` numbers in the sequence."""
+        start, step = self._next_in_sequence, self.sequence_step
+        self._next_in_sequence += count * step
+        last = start + (count - 1) * step
+        if len(str(abs(last))) > self.max_length or last < 0:
+            raise AssertionError("The sequence for {h} exceeded {l} digits.".format(h=self.header, l=self.max_length))
+        prefix = self.starts_with or ""
+        width = self.min_length
+        return [prefix + str(n).zfill(width) for n in range(start, last + step, step)]
+
+    def get_width(self):
+        """Returns the width of this field's column in a fixed width file: `width` if it was provided, otherwise the
+        length of the longest value the field can generate."""
+        data_type = self.data_type.upper()
+        if self.width is not None:
+            return self.width
+        elif self.source_table is not None or (self.regexp is not None and self.starts_with is None):
+            raise AssertionError("The width of {} cannot be worked out from its definition, provide it with the width "
+                                 "argument.".format(self.header))
+        elif self.options is not None:
+            return max(len(option) for option in self.options)
+        elif data_type == "DATE":
+            return 10
+        elif data_type == "DATETIME":
+            return 19
+        elif data_type == "DECIMAL":
+            return self.precision + 2  # The sign and the decimal point.
+        elif data_type == "SYS_ID":
+            return 32
+        elif data_type == "EMAIL":
+            return max(min(self.max_length, 64), 1) + 1 + len(self.domain)  # Local parts are at most 64 characters.
+        return len(self.starts_with or "") + self.max_length
+
+    def get_data_batch(self, count):
+        """Generate and return a list of ``count`` values that fit the attributes of this field."""
+        if self.unique:
+            return self._get_unique_batch(count)
+        elif self.sequence:
+            return self._get_sequence_batch(count)
+        elif self.source_table is not None:
+            return [self.get_data() for _ in range(count)]
+        elif self._option_sampler is not None:
+            options = self.options
+            return [options[i] for i in self._option_sampler.sample_batch(count)]
+        elif self.options is not None:
+            return random.choices(self.options, k=count)
+        elif self.data_type.upper() in self._TYPE_GENERATORS:
+            return self._TYPE_GENERATORS[self.data_type.upper()](self, count)
+        else:
+            return [self.get_data() for _ in range(count)]
+
     def get_data(self):
         """Generate and return data that fits the attributes of this field."""
+        if self.unique or self.sequence:
+            return self.get_data_batch(1)[0]
+        # If a source table is provided for this field, sample its values, other things aren't relevant.
+        if self.source_table is not None:
+            data = self._get_source_data()
         # If options are provided for this field, choose one of them, other things aren't relevant.
-        if self.options is not None:
+        elif self._option_sampler is not None:
+            data = self.options[self._option_sampler.sample()]
+        elif self.options is not None:
             data = random.choice(self.options)
+        # Dates, datetimes, decimals, sys_ids and emails have their own generators.
+        elif self.data_type.upper() in self._TYPE_GENERATORS:
+            data = self._TYPE_GENERATORS[self.data_type.upper()](self, 1)[0]
         # If starts_with is provided, make a string that starts with this attribute. Update min_length and max_length accordingly.
         elif self.starts_with is not None:
-            data = self.starts_with + self.CHARACTER_TYPES[self.characters.upper()](self.min_length, self.max_length)
+            data = self.starts_with + self._get_random_string()
         # If regexp is provided, return a string matching the expression.
         elif self.regexp is not None:
             return rstr.xeger(self.regexp)
         # Otherwise, get a string between min_length and max_length using the given character type.
         else:
-            data = self.CHARACTER_TYPES[self.characters.upper()](self.min_length, self.max_length)
+            data = self._get_random_string()
         return data
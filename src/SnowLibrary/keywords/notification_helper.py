@@ -1,5 +1,7 @@
 from robot.api.deco import keyword
 
+from SnowLibrary import notification_templates
+
 class NotificationHelper:
     """
     This library implements keywords for checking SMS and Email notification format in ServiceNow. Keywords can be
@@ -13,52 +15,6 @@ class NotificationHelper:
 
     ROBOT_LIBRARY_SCOPE = "TEST CASE"
 
-    def _oir_number_transform(self,number):
-        """
-        Used to transfer number to expected format.
-        :param number: The OIR record number.
-        :return: The number only with digits. 
-        """
-        if (len(number) != 10):
-            raise AssertionError("Please enter the correct number, which is expected to have 10 digits.")
-        else:
-            self.expected_number = number[3:]
-        return self.expected_number
-
-    def _oir_severity_transform(self,severity):
-        """
-        Used to transfer severity to expected format.
-        :param severity: The OIR record severity.
-        :return: The expected format to present severity in notification message.
-        """
-        if (severity == "5"):
-            self.sev = "SEV5"
-        elif (severity == "4"):
-            self.sev = "SEV4"
-        elif (severity == "3"):
-            self.sev = "SEV3"
-        elif (severity == "2"):
-            self.sev = "SEV2"
-        elif (severity == "1"):
-            self.sev = "SEV1"
-        else:
-            raise AssertionError("Please enter the correct severity, which is the number from 1~5.")
-        return self.sev
-
-    def _oir_state_transform(self,state):
-        """
-        Used to transfer state to expected format.
-        :param state: The OIR record state.
-        :return: The expected format to present state in notification message.
-        """
-        if (state == "Work in Progress"):
-            self.stat = "WIP"
-        elif (state == "Root Cause Pending"):
-            self.stat = "RCP"
-        else:
-            raise AssertionError("Please enter the correct state, which is Work in Progress or Root Cause Pending.")
-        return self.stat
-
     def _active_bridge_number_transform(self,domestic,access_code,pin_code):
         """
         Used to transfer active bridge number to expected format.
@@ -73,6 +29,13 @@ class NotificationHelper:
             self.bridge_number=domestic + ",,"+access_code+"#,,"+pin_code+"#"
         return self.bridge_number
 
+    def _render_oir_message(self, type, number, state, severity, business, application, text):
+        """Renders the OIR message of the given type with the oir_sms or oir_email registry template."""
+        if type not in ("sms", "email"):
+            raise AssertionError("Please enter the correct type, which is sms or email.")
+        return notification_templates.registry.get("oir_" + type).render({"number": number, "state": state, "severity": severity, "business": business,
+                                "application": application, "text": text})
+
     @keyword
     def get_expected_notification_message(self, number, state, business, application, severity, description, type, work_note=None):
         """
@@ -86,24 +49,74 @@ class NotificationHelper:
         :param type: The message type: email or sms.
         :return: The expected message format. 
         """
-        self.sms_number=self._oir_number_transform(number)
-        self.stat=self._oir_state_transform(state)
-        self.sev=self._oir_severity_transform(severity)
-
-        if(work_note==None):
-            if(type=="sms"):
-                return self.sms_number + "|" + self.sev + "|" + business + "|" + self.stat + "|" + description
-            elif(type=="email"):
-                return number + " " + self.sev + " " + business + " " + self.stat + " " + application + " | " + description
-            else:
-                raise AssertionError("Please enter the correct type, which is sms or email.")
-        else:
-            if (type == "sms"):
-                return self.sms_number + "|" + self.sev + "|" + business + "|" + self.stat + "|" + work_note
-            elif (type == "email"):
-                return number + " " + self.sev + " " + business + " " + self.stat + " " + application + " | " + work_note
-            else:
-                raise AssertionError("Please enter the correct type, which is sms or email.")
+        text = description if work_note is None else work_note
+        return self._render_oir_message(type, number, state, severity, business, application, text)
+
+    @keyword
+    def get_expected_notification_messages(self, records, number_field="number", state_field="state",
+                                           severity_field="severity", business_field="business",
+                                           application_field="application", description_field="description",
+                                           work_note_field=None):
+        """
+        Used to get the expected automatic notification messages of many OIR records at once, e.g. all the records
+        returned by RESTQuery `Execute Query` with ``multiple=True``. Each record is a dictionary, and the ``*_field``
+        arguments give the names of its fields holding each part of the message. Reference fields returned as a
+        dictionary are rendered with their ``display_value`` if present, otherwise their ``value``. The state must be
+        the display value of the state, e.g. Work in Progress.
+        :param records: The list of OIR records.
+        :param work_note_field: The field holding the work note, which replaces the description if it is not empty.
+        :return: A list with a dictionary per record, with its ``number`` and its expected ``sms`` and ``email`` messages.
+
+        | ${records}= | Execute Query | multiple=True |
+        | ${messages}= | Get Expected Notification Messages | ${records} | description_field=short_description |
+        """
+        sms = notification_templates.registry.get("oir_sms")
+        email = notification_templates.registry.get("oir_email")
+        messages = list()
+        for record in records:
+            text = _field_value(record, work_note_field) if work_note_field is not None else ""
+            values = {"number": _field_value(record, number_field), "state": _field_value(record, state_field),
+                      "severity": _field_value(record, severity_field), "business": _field_value(record, business_field),
+                      "application": _field_value(record, application_field),
+                      "text": text or _field_value(record, description_field)}
+            try:
+                messages.append({"number": values["number"], "sms": sms.render(values), "email": email.render(values)})
+            except AssertionError as e:
+                raise AssertionError("{e} Record: {n}.".format(e=e, n=values["number"]))
+        return messages
+
+    @keyword
+    def load_notification_templates(self, path):
+        """
+        Loads notification template definitions from the JSON or YAML (requires the PyYAML package) file ``path``, for
+        use with `Get Expected Message`. The file maps template names to definitions, which replace any template with
+        the same name. Each definition has either a ``format`` string with ``{field}`` placeholders, or a list of
+        ``fields`` joined by a ``separator``, and optionally:
+
+        - ``transforms``: Maps fields to a transform applied to their value: the name of a built-in transform
+        (oir_number, severity, state, upper, lower, strip) or a lookup table of values.
+        - ``sources``: Maps fields to the name of the value they are taken from, when it is different.
+
+        Each template is compiled once when it is loaded. Templates stay loaded for the rest of the run, and a file is
+        only read again if it has changed. The built-in templates are oir_sms, oir_email, change_create, change_approve,
+        change_reject, change_complete and ctask_approve. Example JSON file:
+
+        | {"problem_email": {"format": "{number} - {priority} - {short_description}", "transforms": {"priority": {"1": "P1", "2": "P2"}}}}
+        """
+        notification_templates.registry.load(path)
+
+    @keyword
+    def get_expected_message(self, template, **values):
+        """
+        Used to get the expected message rendered by the notification ``template``, built-in or loaded with
+        `Load Notification Templates`, from the field ``values`` given as keyword arguments.
+        :param template: The name of the template.
+        :return: The expected message.
+
+        | ${sms}= | Get Expected Message | template=oir_sms | number=OIR0001234 | severity=1 | business=Futures | state=Work in Progress | text=Down |
+        | ${email}= | Get Expected Message | template=change_create | number=CHG0001234 | description=Patch |
+        """
+        return notification_templates.registry.get(template).render(values)
 
     @keyword
     def get_user_phone_number(self,info):
@@ -129,17 +142,10 @@ class NotificationHelper:
         :param type: notification message type: sms or email.
         :return: The expected message format.
         """
-        self.sms_number = self._oir_number_transform(number)
-        self.stat = self._oir_state_transform(state)
-        self.sev = self._oir_severity_transform(severity)
         self.bridge_number = self._active_bridge_number_transform(domestic,access_code,pin_code)
 
-        if (type == "sms"):
-            return self.sms_number + "|" + self.sev + "|" + business + "|" + self.stat + "|" + self.bridge_number
-        elif (type == "email"):
-            return number + " " + self.sev + " " + business + " " + self.stat + " " + application + " | " + description
-        else:
-            raise AssertionError("Please enter the correct type, which is sms or email.")
+        text = self.bridge_number if type == "sms" else description
+        return self._render_oir_message(type, number, state, severity, business, application, text)
 
     def get_expected_special_notification_message(self,number,state,severity,business,application,description,note,type):
         """
@@ -154,16 +160,8 @@ class NotificationHelper:
         :param type: notification message type: sms or email.
         :return: The expected message format.
         """
-        self.sms_number = self._oir_number_transform(number)
-        self.stat = self._oir_state_transform(state)
-        self.sev = self._oir_severity_transform(severity)
-
-        if (type == "sms"):
-            return self.sms_number + "|" + self.sev + "|" + business + "|" + self.stat + "|" + note
-        elif (type == "email"):
-            return number + " " + self.sev + " " + business + " " + self.stat + " " + application + " | " + description
-        else:
-            raise AssertionError("Please enter the correct type, which is sms or email.")
+        text = note if type == "sms" else description
+        return self._render_oir_message(type, number, state, severity, business, application, text)
 
     def get_expected_change_email_notification_message(self,number,description,approval_group,type):
         """
@@ -174,16 +172,10 @@ class NotificationHelper:
         :param type: Change notification type. (create, approve, reject,complete)
         :return: The expected message format.
         """
-        if(type == "create"):
-            return number + " - updated - " + description
-        elif (type == "approve"):
-            return number + " - requires your approval or rejection for group - " + approval_group
-        elif (type == "reject"):
-            return number + " - rejected - " + description
-        elif (type == "complete"):
-            return number + " - approved - " + description
-        else:
+        if type not in ("create", "approve", "reject", "complete"):
             raise AssertionError("Please enter the correct type, which is create, approve, complete or reject.")
+        return notification_templates.registry.get("change_" + type).render(
+            {"number": number, "description": description, "approval_group": approval_group})
 
     def get_expected_ctask_email_notification_message(self,number,description,type):
         """
@@ -193,4 +185,16 @@ class NotificationHelper:
         :param type: notification type. (approve)
         :return: The expected message format.
         """
-        return number + " authorized - " + description
+        return notification_templates.registry.get("ctask_approve").render({"number": number,
+                                                                            "description": description})
+
+
+def _field_value(record, field):
+    """Returns the value of ``field`` in ``record``, using the display value of reference fields returned as dictionaries."""
+    try:
+        value = record[field]
+    except KeyError:
+        raise AssertionError("The record does not have the field `{}`.".format(field))
+    if isinstance(value, dict):
+        return value.get("display_value", value.get("value", ""))
+    return value
@@ -1,16 +1,36 @@
+import base64
+import csv
+import gzip
+import json
+import mimetypes
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
 from datetime import timedelta
 from urllib.parse import urlparse
 
 import pysnow
 from pysnow.exceptions import QueryEmpty
-from requests.exceptions import RequestException
+from pysnow.query_builder import datetime_as_utc
+from requests.exceptions import ConnectionError, RequestException, Timeout
 from robot.api import logger
 from robot.api.deco import keyword
 from robot.libraries.BuiltIn import BuiltIn
+from robot.utils import timestr_to_secs
 
+from SnowLibrary.attachments import Transfer, UploadStream, download
+from SnowLibrary.backoff import exponential_backoff
+from SnowLibrary.cassette import Cassette
 from SnowLibrary.exceptions import QueryNotExecuted
+from SnowLibrary.json_stream import iter_records
+from SnowLibrary.keywords.file_creator import DataFile
+from SnowLibrary.record_tracker import tracker
+from SnowLibrary.records import ColumnarRecords
+from SnowLibrary.session import SnowSession, get_circuit_breaker, get_session, use_cassette
+from SnowLibrary.shared_cache import get_shared_cache
 
 
 class RESTQuery:
@@ -29,6 +49,15 @@ class RESTQuery:
      - ``IS EMPTY``
      - ``GREATER THAN``
      - ``LESS THAN``
+     - ``BETWEEN``
+     - ``IN`` / ``NOT IN`` (a list, or a comma-separated string of values)
+     - ``IS NOT EMPTY``
+     - ``LIKE``
+     - ``ANYTHING``
+     - ``ON`` (a date ``YYYY-MM-DD``, ``TODAY`` or ``YESTERDAY``)
+     - ``RELATIVE AFTER`` / ``RELATIVE BEFORE`` (a number and a unit: minutes, hours, days, months or years ago)
+
+    Fields on referenced records can be queried by dot-walking, e.g. ``assignment_group.name``.
 
     *Valid query operators*:
      - ``AND``
@@ -38,11 +67,38 @@ class RESTQuery:
     ROBOT_LIBRARY_SCOPE = "TEST CASE"
 
     VALID_QUERY_TYPES = ["EQUALS", "DOES NOT EQUAL", "CONTAINS", "DOES NOT CONTAIN", "STARTS WITH", "ENDS WITH",
-                         "IS EMPTY", "GREATER THAN", "LESS THAN", "BETWEEN"]
+                         "IS EMPTY", "GREATER THAN", "LESS THAN", "BETWEEN", "IN", "NOT IN", "IS NOT EMPTY", "LIKE",
+                         "ANYTHING", "ON", "RELATIVE AFTER", "RELATIVE BEFORE"]
 
     VALID_OPERANDS = ["AND", "OR", "NQ"]
 
-    def __init__(self, host=None, user=None, password=None, query_table=None, response=None):
+    # pysnow.QueryBuilder methods for the condition types taking one parameter.
+    _STRING_CONDITIONS = {"EQUALS": "equals", "DOES NOT EQUAL": "not_equals", "CONTAINS": "contains",
+                          "DOES NOT CONTAIN": "not_contains", "STARTS WITH": "starts_with", "ENDS WITH": "ends_with"}
+    _COMPARISON_CONDITIONS = {"GREATER THAN": "greater_than", "LESS THAN": "less_than"}
+    _NO_PARAMETER_CONDITIONS = {"IS EMPTY": "ISEMPTY", "IS NOT EMPTY": "ISNOTEMPTY", "ANYTHING": "ANYTHING"}
+    _RELATIVE_CONDITIONS = {"RELATIVE AFTER": "RELATIVEGT", "RELATIVE BEFORE": "RELATIVELT"}
+    _RELATIVE_UNITS = {"MINUTE": "minute", "HOUR": "hour", "DAY": "dayofweek", "MONTH": "month", "YEAR": "year"}
+    _ON_KEYWORDS = {"TODAY": "Today@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()",
+                    "YESTERDAY": "Yesterday@javascript:gs.beginningOfYesterday()@javascript:gs.endOfYesterday()"}
+
+    # IN conditions with more values than this are split into several requests to keep URLs short.
+    IN_CHUNK_SIZE = 200
+    _IN_CHUNK_PLACEHOLDER = "@IN_CHUNK@"
+
+    # Encoded query operators and the number of parameters for each condition type, used by query templates.
+    _ENCODED_CONDITIONS = {"EQUALS": ("=", 1), "DOES NOT EQUAL": ("!=", 1), "CONTAINS": ("LIKE", 1),
+                           "DOES NOT CONTAIN": ("NOT LIKE", 1), "STARTS WITH": ("STARTSWITH", 1),
+                           "ENDS WITH": ("ENDSWITH", 1), "IS EMPTY": ("ISEMPTY", 0), "GREATER THAN": (">", 1),
+                           "LESS THAN": ("<", 1), "BETWEEN": ("BETWEEN", 2), "IN": ("IN", 1), "NOT IN": ("NOT IN", 1),
+                           "IS NOT EMPTY": ("ISNOTEMPTY", 0), "LIKE": ("LIKE", 1), "ANYTHING": ("ANYTHING", 0)}
+    _ENCODED_OPERANDS = {"AND": "^", "OR": "^OR", "NQ": "^NQ"}
+
+    # Query templates defined with `Define Query Template`, shared by all tests in the process.
+    _query_templates = dict()
+
+    def __init__(self, host=None, user=None, password=None, query_table=None, response=None, shared_cache=None,
+                 cache_ttl=300, cache_max_entries=10000):
         """
         The following arguments can be optionally provided when importing this library:
         - ``host``: The URL to your target ServiceNow instance (e.g. https://iceuat.service-now.com/). If none is provided,
@@ -53,7 +109,15 @@ class RESTQuery:
                     the ``SNOW_REST_PASS`` environment variable.
         - ``query_table``: The table to query.  This can be changed or set at any time with the `Query Table Is` keyword.
         - ``response``: Set the response object from the ServiceNow REST API (intended to be used for testing).
+        - ``shared_cache``: The path to a local cache file shared by every process running tests, e.g. all pabot
+                    workers. If none is provided, the library will use the ``SNOW_SHARED_CACHE`` environment variable
+                    if it is set. Otherwise no cache is used. See `Execute Query` for how to use it.
+        - ``cache_ttl``: The number of seconds cached query results are reused for. Defaults to 300.
+        - ``cache_max_entries``: The maximum number of query results kept in the shared cache. Defaults to 10000.
 
+        Every RESTQuery and RESTInsert library using the same instance and user in a process shares one connection
+        session, and with it a rate limit. See `Set Rate Limit`. Requests can be recorded and replayed offline with
+        `Use Cassette`.
         """
         if host is None:
             self.host = os.environ.get("SNOW_TEST_URL").strip()
@@ -74,12 +138,22 @@ class RESTQuery:
         if self.instance == "":
             raise AssertionError(
                 "Unable to determine SNOW Instance. Verify that the SNOW_TEST_URL environment variable been set.")
-        self.client = pysnow.Client(instance=self.instance, user=self.user, password=self.password)
+        self.client = pysnow.Client(instance=self.instance, session=get_session(self.instance, self.user, self.password))
         self.query_table = query_table
         self.query = pysnow.QueryBuilder()
         self.response = response
         self.record_count = None
         self.desired_response_fields = list()
+        self._in_chunks = None
+        self._template_query = None
+        self._template_join = "^"
+        self.query_options = {"exclude_reference_link": False, "display_value": False, "no_count": False}
+        if shared_cache is None:
+            shared_cache = os.environ.get("SNOW_SHARED_CACHE")
+        if shared_cache:
+            self.shared_cache = get_shared_cache(shared_cache, cache_ttl, cache_max_entries)
+        else:
+            self.shared_cache = None
 
     @staticmethod
     def _parse_datetime(date):
@@ -95,70 +169,89 @@ class RESTQuery:
                                  " the format YYYY-MM-DD hh:mm:ss.")
         return dt
 
+    @staticmethod
+    def _stream_records(response):
+        """
+        Yields the records in a streamed pysnow response one at a time, as they are read from the network, and closes
+        the connection once the last record has been read or the generator is closed.
+        """
+        raw_response = response._response
+        try:
+            raw_response.raise_for_status()
+            yield from iter_records(raw_response.raw)
+        finally:
+            raw_response.close()
+
+    @classmethod
+    def _first_or_none(cls, response):
+        """Returns the first record in a streamed pysnow response, or None. Nothing after the first record is read."""
+        records = cls._stream_records(response)
+        try:
+            return next(records, None)
+        finally:
+            records.close()
+
     def _add_valid_query_parameter(self, logical, field, condition_type, param_1=None, param_2=None):
         """
         Helper function to handle adding parameters to a query, which are then passed to the pysnow.QueryBuilder
         object.
         """
+        logical = logical.upper()
+        condition = condition_type.upper()
+        if logical != "NONE" and self._template_query is not None and not self.query._query:
+            # The first condition added after a query template starts the query builder, and is joined to the
+            # template's encoded query with its logical operator.
+            self._template_join = self._ENCODED_OPERANDS[logical]
+            logical = "NONE"
         if logical == "NONE":
             self.query.field('{}'.format(field))
-        elif logical.upper() == "AND":
+        elif logical == "AND":
             self.query.AND().field('{}'.format(field))
-        elif logical.upper() == "OR":
+        elif logical == "OR":
             self.query.OR().field('{}'.format(field))
         else:
             self.query.NQ().field('{}'.format(field))
 
         if param_1 is None and param_2 is None:
-            if condition_type.upper() != "IS EMPTY":
+            if condition not in self._NO_PARAMETER_CONDITIONS:
                 raise AssertionError(
                     "Unexpected arguments for condition type {condition_type}: expected 1 or 2 arguments, but got "
-                    "none.".format(condition_type=condition_type.upper()))
+                    "none.".format(condition_type=condition))
             else:
-                logger.debug("sysparm_query contains: {q}".format(q=self.query._query))
-                self.query.is_empty()
+                self.query._add_condition(self._NO_PARAMETER_CONDITIONS[condition], "", types=[str])
 
         elif param_2 is None:
-            if condition_type.upper() in ["IS EMPTY", "BETWEEN"]:
+            if condition in self._NO_PARAMETER_CONDITIONS or condition == "BETWEEN" \
+                    or condition in self._RELATIVE_CONDITIONS:
                 raise AssertionError(
                     "Unexpected arguments for condition type {condition_type}: expected 0 or 2 arguments,"
-                    " but got 1.".format(condition_type=condition_type.upper()))
+                    " but got 1.".format(condition_type=condition))
+            elif condition in self._COMPARISON_CONDITIONS:
+                compare = getattr(self.query, self._COMPARISON_CONDITIONS[condition])
+                if isinstance(param_1, datetime):
+                    compare(param_1)
+                else:
+                    try:
+                        compare(int(param_1))
+                    except AssertionError:
+                        raise AssertionError("Invalid parameter for this query type, must be an integer or a date.")
+            elif condition in ["IN", "NOT IN"]:
+                self._add_in_condition(condition, param_1)
+            elif condition == "ON":
+                self.query._add_condition("ON", self._encode_on_date(param_1), types=[str])
+            elif condition == "LIKE":
+                self.query._add_condition("LIKE", '{}'.format(param_1), types=[str])
             else:
-                if condition_type.upper() == "GREATER THAN":
-                    if isinstance(param_1, datetime):
-                        self.query.greater_than(param_1)
-                    else:
-                        try:
-                            self.query.greater_than(int(param_1))
-                        except AssertionError:
-                            raise AssertionError("Invalid parameter for this query type, must be an integer or a date.")
-                elif condition_type.upper() == "LESS THAN":
-                    if isinstance(param_1, datetime):
-                        self.query.less_than(param_1)
-                    else:
-                        try:
-                            self.query.less_than(int(param_1))
-                        except AssertionError:
-                            raise AssertionError("Invalid parameter for this query type, must be an integer or a date.")
-                elif condition_type.upper() == "EQUALS":
-                    self.query.equals('{}'.format(param_1))
-                elif condition_type.upper() == "DOES NOT EQUAL":
-                    self.query.not_equals('{}'.format(param_1))
-                elif condition_type.upper() == "CONTAINS":
-                    self.query.contains('{}'.format(param_1))
-                elif condition_type.upper() == "DOES NOT CONTAIN":
-                    self.query.not_contains('{}'.format(param_1))
-                elif condition_type.upper() == "STARTS WITH":
-                    self.query.starts_with('{}'.format(param_1))
-                elif condition_type.upper() == "ENDS WITH":
-                    self.query.ends_with('{}'.format(param_1))
-                logger.debug("sysparm_query contains: {q}".format(q=self.query._query))
+                getattr(self.query, self._STRING_CONDITIONS[condition])('{}'.format(param_1))
 
         else:
-            if condition_type.upper() != "BETWEEN":
+            if condition in self._RELATIVE_CONDITIONS:
+                self.query._add_condition(self._RELATIVE_CONDITIONS[condition],
+                                          self._encode_relative_date(param_1, param_2), types=[str])
+            elif condition != "BETWEEN":
                 raise AssertionError(
                     "Unexpected arguments for condition type {condition_type}: expected 0 or 1 argument,"
-                    " but got 2.".format(condition_type=condition_type.upper()))
+                    " but got 2.".format(condition_type=condition))
             else:
                 if isinstance(param_1, datetime) and isinstance(param_2, datetime):
                     self.query.between(param_1, param_2)
@@ -167,11 +260,188 @@ class RESTQuery:
                         self.query.between(int(param_1), int(param_2))
                     except AssertionError:
                         raise AssertionError("Invalid parameter for this query type, must be and integer or a date")
-                logger.debug("sysparm_query contains: {q}".format(q=self.query._query))
+        logger.debug("sysparm_query contains: {q}".format(q=self.query._query))
+
+    def _add_in_condition(self, condition, values):
+        """Adds an IN or NOT IN condition for ``values``, a list or a comma-separated string."""
+        self.query._add_condition(condition, self._encode_in_values(condition, values), types=[str])
+
+    def _encode_in_values(self, condition, values):
+        """
+        Returns the encoded operand of an IN or NOT IN condition for ``values``, a list or a comma-separated string. An
+        IN list longer than IN_CHUNK_SIZE is replaced by a placeholder and split into chunks, which `Execute Query` runs
+        as separate requests.
+        """
+        if isinstance(values, str):
+            values = values.split(",")
+        values = [str(v).strip() for v in values]
+        if not values:
+            raise AssertionError("Expected at least one value for condition type {}.".format(condition))
+        if condition == "IN" and len(values) > self.IN_CHUNK_SIZE:
+            if self._in_chunks is not None:
+                raise AssertionError("Only one IN condition with more than {} values can be added to a "
+                                     "query.".format(self.IN_CHUNK_SIZE))
+            self._in_chunks = [",".join(values[i:i + self.IN_CHUNK_SIZE])
+                               for i in range(0, len(values), self.IN_CHUNK_SIZE)]
+            return self._IN_CHUNK_PLACEHOLDER
+        return ",".join(values)
+
+    def _encode_on_date(self, date):
+        """Returns the encoded query operand for an ON condition: a date ``YYYY-MM-DD``, TODAY or YESTERDAY."""
+        if isinstance(date, datetime):
+            date = date.strftime("%Y-%m-%d")
+        if date.upper() in self._ON_KEYWORDS:
+            return self._ON_KEYWORDS[date.upper()]
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            raise AssertionError("Invalid parameter for condition type ON, must be a date in the format YYYY-MM-DD, "
+                                 "TODAY or YESTERDAY.")
+        return "{d}@javascript:gs.dateGenerate('{d}','start')@javascript:gs.dateGenerate('{d}','end')".format(d=date)
+
+    def _encode_relative_date(self, quantity, unit):
+        """Returns the encoded query operand for a relative date condition, e.g. ``3`` ``days`` ago."""
+        unit_name = str(unit).upper()
+        if unit_name.endswith("S"):
+            unit_name = unit_name[:-1]
+        if unit_name not in self._RELATIVE_UNITS:
+            raise AssertionError("Invalid unit for a relative date: {}. Expected minutes, hours, days, months or "
+                                 "years.".format(unit))
+        try:
+            quantity = int(quantity)
+        except ValueError:
+            raise AssertionError("Invalid quantity for a relative date, must be an integer.")
+        return "@{u}@ago@{q}".format(u=self._RELATIVE_UNITS[unit_name], q=quantity)
+
+    def _encoded_query(self):
+        """
+        Returns the encoded query: the query from `Use Query Template`, if any, followed by the conditions added with
+        the query builder. Raises QueryEmpty if there are no conditions.
+        """
+        if self._template_query is None:
+            return str(self.query)
+        if not self.query._query:
+            return self._template_query
+        return self._template_query + self._template_join + str(self.query)
+
+    def _chunked_queries(self):
+        """Returns the queries to execute: the query itself, or one encoded query per chunk of a long IN list."""
+        encoded = self._encoded_query()
+        if self._in_chunks is None:
+            return [encoded]
+        return [encoded.replace(self._IN_CHUNK_PLACEHOLDER, chunk) for chunk in self._in_chunks]
+
+    def _remaining_chunk_records(self, query_resource, records, queries, fields, limit):
+        """
+        Yields the records from the first chunk's ``records`` and then from each of the remaining chunked ``queries``,
+        skipping records already returned for another chunk, up to ``limit`` records.
+        """
+        seen = set()
+        returned = 0
+        for query in [None] + queries:
+            if query is not None:
+                records = self._stream_records(query_resource.get(query=query, stream=True, fields=fields,
+                                                                  limit=limit))
+            for record in records:
+                if "sys_id" in record:
+                    if record["sys_id"] in seen:
+                        continue
+                    seen.add(record["sys_id"])
+                yield record
+                returned += 1
+                if returned >= limit:
+                    records.close()
+                    return
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _compile_query_template(cls, shape):
+        """
+        Compiles a query shape, a tuple of (logical operator, field, condition type) tuples, into an encoded query
+        with a ``{}`` placeholder for each parameter. Returns the encoded query and the condition type of each
+        parameter. Compiled shapes are cached, so templates with the same shape are only compiled once.
+        """
+        parts = list()
+        conditions = list()
+        for logical, field, condition in shape:
+            operator, count = cls._ENCODED_CONDITIONS[condition]
+            placeholders = "@".join(["{}"] * count)
+            parts.append(cls._ENCODED_OPERANDS.get(logical, "") + field.replace("{", "{{").replace("}", "}}") +
+                         operator + placeholders)
+            conditions.extend([condition] * count)
+        return "".join(parts), tuple(conditions)
+
+    def _encode_template_value(self, condition, value):
+        """
+        Encodes a value of a query template condition like the query builder would: dates (datetime objects or
+        ``YYYY-MM-DD hh:mm:ss`` strings) are generated by ServiceNow for BETWEEN conditions, and converted to UTC for
+        other comparisons. IN and NOT IN values are lists or comma-separated strings, and long IN lists are chunked,
+        like with `Add Query Parameter`. The ``^`` separating conditions is escaped as ``^^`` in other values, so that a
+        value cannot add conditions to the query.
+        """
+        if condition in ("IN", "NOT IN"):
+            if isinstance(value, str):
+                value = value.split(",")
+            return self._encode_in_values(condition, [str(v).replace("^", "^^") for v in value])
+        if isinstance(value, str) and condition in ("BETWEEN", "GREATER THAN", "LESS THAN"):
+            try:
+                value = self._parse_datetime(value)
+            except AssertionError:
+                pass
+        if isinstance(value, datetime):
+            if condition == "BETWEEN":
+                return 'javascript:gs.dateGenerate("{}")'.format(value.strftime("%Y-%m-%d %H:%M:%S"))
+            return datetime_as_utc(value).strftime("%Y-%m-%d %H:%M:%S")
+        return str(value).replace("^", "^^")
 
     def _query_is_empty(self):
         """Checks if there are any current query parameters."""
-        return not self.query._query
+        return self._template_query is None and not self.query._query
+
+    def _cache_key(self, multiple, options):
+        """Builds the shared cache key identifying the current query."""
+        return json.dumps([self.instance, self.query_table, self._encoded_query(), self._in_chunks,
+                           sorted(self.desired_response_fields), bool(multiple), options])
+
+    @staticmethod
+    def _query_options(exclude_reference_link, display_value, no_count):
+        """Validates the query options, and returns them as a dictionary."""
+        if isinstance(display_value, str) and display_value.lower() == "all":
+            display_value = "all"
+        elif not isinstance(display_value, bool):
+            raise AssertionError("Invalid display value {}. Expected True, False or all.".format(display_value))
+        return {"exclude_reference_link": bool(exclude_reference_link), "display_value": display_value,
+                "no_count": bool(no_count)}
+
+    @staticmethod
+    def _apply_query_options(query_resource, options):
+        """Sets the sysparm parameters of ``query_resource`` for the query ``options``."""
+        query_resource.parameters.exclude_reference_link = options["exclude_reference_link"]
+        query_resource.parameters.display_value = options["display_value"]
+        if options["no_count"]:
+            query_resource.parameters.add_custom({"sysparm_no_count": "true"})
+
+    def _paginate(self, query, fields=None, page_size=1000, table=None):
+        """
+        Yields every record in ``table`` (the query table by default) matching the encoded ``query``, requesting
+        ``page_size`` records at a time so that memory use does not depend on the size of the result. Records are
+        ordered by sys_id so that pages do not overlap.
+        """
+        table = table or self.query_table
+        query = "^".join(q for q in (query, "ORDERBYsys_id") if q)
+        query_resource = self.client.resource(api_path="/table/{query_table}".format(query_table=table))
+        offset = 0
+        while True:
+            response = query_resource.get(query=query, stream=True, fields=list(fields or []), limit=page_size,
+                                          offset=offset)
+            returned = 0
+            for record in self._stream_records(response):
+                returned += 1
+                yield record
+            logger.debug("Retrieved {n} records from {t} at offset {o}.".format(n=returned, t=table, o=offset))
+            if returned < page_size:
+                return
+            offset += page_size
 
     def _reset_query(self):
         """
@@ -180,6 +450,9 @@ class RESTQuery:
         """
         self.query = pysnow.QueryBuilder()
         self.desired_response_fields = list()
+        self._in_chunks = None
+        self._template_query = None
+        self._template_join = "^"
 
     @keyword
     def get_record_by_sys_id(self, sys_id):
@@ -251,7 +524,64 @@ class RESTQuery:
         self.add_query_parameter("NONE", field.lower(), condition_type, param_1, param_2, is_date_field)
 
     @keyword
-    def execute_query(self, multiple=False):
+    def define_query_template(self, name, *conditions):
+        """
+        Defines a reusable query template called ``name``, for queries that are executed many times with the same
+        conditions but different values, e.g. in data-driven tests. Each condition is a string containing an optional
+        logical operator (AND, OR, NQ), a field and a condition type, with the values left out. The template is
+        compiled into an encoded query once, and is available to all later tests. Use it with `Use Query Template`.
+
+        | Define Query Template | open_by_group | assignment_group EQUALS | AND state DOES NOT EQUAL | OR priority LESS THAN |
+
+        Values for date fields should be given as ``YYYY-MM-DD hh:mm:ss``.
+        """
+        if not conditions:
+            raise AssertionError("A query template requires at least one condition.")
+        shape = list()
+        for position, condition in enumerate(conditions):
+            tokens = condition.split()
+            logical = "NONE"
+            if position > 0:
+                if not tokens or tokens[0].upper() not in self.VALID_OPERANDS:
+                    raise AssertionError("Condition '{}' must begin with one of the logical operators AND, OR or "
+                                         "NQ.".format(condition))
+                logical = tokens.pop(0).upper()
+            condition_type = " ".join(tokens[1:]).upper()
+            if len(tokens) < 2 or condition_type not in self.VALID_QUERY_TYPES:
+                raise AssertionError("Invalid condition '{}': expected a field and a condition type.".format(condition))
+            elif condition_type not in self._ENCODED_CONDITIONS:
+                raise AssertionError("Condition type {} is not supported in query templates.".format(condition_type))
+            shape.append((logical, tokens[0].lower(), condition_type))
+        self._query_templates[name] = self._compile_query_template(tuple(shape))
+        logger.info("Defined query template {n}: {q}".format(n=name, q=self._query_templates[name][0]))
+
+    @keyword
+    def use_query_template(self, name, *values):
+        """
+        Sets the query parameters from the query template ``name`` defined with `Define Query Template`, filling in
+        ``values`` in order. The values of IN and NOT IN conditions can be lists or comma-separated strings, like with
+        `Add Query Parameter`. More parameters can be added with `Add Query Parameter` before using `Execute Query`.
+
+        | Use Query Template | open_by_group | ${group_sys_id} | 7 | 2 |
+        | Execute Query      | multiple=${TRUE} |
+        """
+        if name not in self._query_templates:
+            raise AssertionError("Query template not found: {}. Define it with the Define Query Template "
+                                 "keyword.".format(name))
+        if not self._query_is_empty():
+            raise AssertionError("Query parameters have already been added. A query template must be used first.")
+        template, conditions = self._query_templates[name]
+        parameter_count = len(conditions)
+        if len(values) != parameter_count:
+            raise AssertionError("Query template {n} expects {e} values, but got {a}.".format(n=name, e=parameter_count,
+                                                                                            a=len(values)))
+        self._template_query = template.format(*(self._encode_template_value(condition, value)
+                                                   for condition, value in zip(conditions, values)))
+        logger.debug("sysparm_query contains: {q}".format(q=self._template_query))
+
+    @keyword
+    def execute_query(self, multiple=False, use_cache=False, columnar=False, exclude_reference_link=None,
+                      display_value=None, no_count=None):
         """
         Executes the query that has been created with the specified conditions AND sets the response to the first record
         in the returned data or None if ``multiple`` is *False* (default). If ``multiple`` is *True*, sets the response
@@ -261,37 +591,241 @@ class RESTQuery:
         If a sort condition has been set with `Add Sort` or specific fields to include on the response records have been
         set with `Include Fields In Response`, those requirements are honored here. If no query parameters are provided
         or no table has been defined, an error is thrown.
+
+        If ``use_cache`` is *True* and a shared cache has been configured when importing the library, the response is
+        read from the cache when another test or process already executed the same query within the cache TTL, and
+        stored in it otherwise. Only use this for data that does not change during the test run, such as table
+        definitions or reference data. For example:
+
+        | Query Table Is              | sys_db_object |
+        | Required Query Parameter Is | name          | EQUALS | incident |
+        | Execute Query               | use_cache=${TRUE} |
+
+        If ``multiple`` and ``columnar`` are both *True*, the records are stored column by column with repeated values
+        shared, which uses far less memory for large or wide results. Each record still behaves like a (read-only)
+        dictionary, and `Get Response Field Values` returns a column directly.
+
+        The following options change what ServiceNow returns. When they are not given, the defaults set with
+        `Set Query Options` are used.
+        - ``exclude_reference_link``: If *True*, reference fields hold the sys_id of the referenced record, instead of a
+          dictionary with its ``value`` and the ``link`` to its Table API URL. This roughly halves the size of the
+          response for tables with many reference fields.
+        - ``display_value``: *False* returns the values stored in the database, *True* the values displayed in the UI
+          (e.g. a state's label or a referenced record's name), and ``all`` both, as dictionaries with a ``value`` and a
+          ``display_value``. Display values take ServiceNow longer to work out.
+        - ``no_count``: If *True*, ServiceNow does not count the matching records, which saves it a query. The
+          X-Total-Count header is then missing from the response.
+
+        | Execute Query | multiple=${TRUE} | exclude_reference_link=${TRUE} |
         """
         assert self.query_table is not None, "Query table must already be specified in this test case, but is not."
+        options = self._query_options(
+            self.query_options["exclude_reference_link"] if exclude_reference_link is None else exclude_reference_link,
+            self.query_options["display_value"] if display_value is None else display_value,
+            self.query_options["no_count"] if no_count is None else no_count)
+        cache_key = None
+        if use_cache and self.shared_cache is not None and not self._query_is_empty():
+            cache_key = self._cache_key(multiple, options)
+            cached = self.shared_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Query response found in the shared cache.")
+                if multiple and columnar:
+                    self.response = ColumnarRecords(cached["response"])
+                else:
+                    self.response = cached["response"]
+                self.record_count = cached["record_count"]
+                logger.info("Number of records returned from query: " + str(self.record_count))
+                self._reset_query()
+                return
         query_resource = self.client.resource(api_path="/table/{query_table}".format(query_table=self.query_table))
+        self._apply_query_options(query_resource, options)
+        if self.desired_response_fields:
+            logger.info("Response fields specified in query parameters.")
+        else:
+            logger.info("No response fields specified in query parameters. All fields will be returned.")
         try:  # Catch empty queries or errors making the request
-            if self.desired_response_fields:
-                logger.info("Response fields specified in query parameters.")
-                response = query_resource.get(query=self.query,
-                                              stream=True,
-                                              fields=self.desired_response_fields,
-                                              limit=2000)
-            else:
-                logger.info("No response fields specified in query parameters. All fields will be returned.")
-                response = query_resource.get(query=self.query,
-                                              stream=True,
-                                              limit=2000)
+            queries = self._chunked_queries()
+            response = query_resource.get(query=queries[0],
+                                          stream=True,
+                                          fields=self.desired_response_fields,
+                                          limit=2000)
         except (QueryEmpty, RequestException) as e:
             logger.error(e.args)
             self._reset_query()
             raise
+        records = self._stream_records(response)
+        if len(queries) > 1:
+            logger.info("IN condition split into {} requests.".format(len(queries)))
+            records = self._remaining_chunk_records(query_resource, records, queries[1:],
+                                                    self.desired_response_fields, 2000)
         if not multiple:
-            self.response = response.first_or_none()
+            self.response = next(records, None)
+            records.close()
             if self.response is None:
                 self.record_count = 0
             else:
                 self.record_count = 1
+        elif columnar:
+            self.response = ColumnarRecords(records)
+            self.record_count = len(self.response)
         else:
-            self.response = list(response.all())
+            self.response = list(records)
             self.record_count = len(self.response)
         logger.info("Number of records returned from query: " + str(self.record_count))
+        if cache_key is not None:
+            if isinstance(self.response, ColumnarRecords):
+                cached_response = self.response.to_list()
+            else:
+                cached_response = self.response
+            self.shared_cache.set(cache_key, {"response": cached_response, "record_count": self.record_count})
         self._reset_query()
 
+    @keyword
+    def set_query_options(self, exclude_reference_link=False, display_value=False, no_count=False):
+        """
+        Sets the options used by `Execute Query` when they are not given to it, for this library instance. See
+        `Execute Query` for what they do. ``exclude_reference_link=${TRUE}`` makes responses much smaller, but changes
+        reference fields from dictionaries to plain sys_ids, so it is not the default. Neither is ``no_count=${TRUE}``, which
+        removes the total number of matching records from responses.
+
+        | Set Query Options | exclude_reference_link=${TRUE} | display_value=all | no_count=${TRUE} |
+        """
+        self.query_options = self._query_options(exclude_reference_link, display_value, no_count)
+
+    @keyword
+    def set_rate_limit(self, requests_per_second=None, burst=None, max_concurrency=None):
+        """
+        Limits the requests sent to ServiceNow as this user, by every RESTQuery and RESTInsert library in this process,
+        to ``requests_per_second`` on average, with bursts of up to ``burst`` requests (by default, one second's worth).
+        Without a value, requests are not limited. The default limit can be set with the ``SNOW_RATE_LIMIT`` environment
+        variable.
+
+        Whatever the limit, requests rejected by ServiceNow with status 429 (Too Many Requests) are retried after the
+        delay it asks for in the ``Retry-After`` or ``X-RateLimit-Reset`` header, and all requests wait meanwhile. The
+        number of concurrent requests, e.g. from `Cleanup Created Records`, is not limited until a rate limit or
+        ``max_concurrency`` is set, or a request is rate limited. From then on it adapts: it grows slowly while
+        requests succeed and halves when one is rate limited, up to ``max_concurrency`` (default 32).
+
+        | Set Rate Limit | 20 | burst=40 |
+        """
+        session = self.client.session
+        session.rate_limiter.configure(requests_per_second, burst)
+        if requests_per_second or max_concurrency is not None:
+            session.concurrency.enabled = True
+        if max_concurrency is not None:
+            session.concurrency.maximum = float(max_concurrency)
+            session.concurrency.limit = min(session.concurrency.limit, session.concurrency.maximum)
+        logger.info("Rate limit set to {r} requests per second.".format(r=requests_per_second or "no limit"))
+
+    @keyword
+    def set_retry_policy(self, retries=3, initial_delay="0.5 seconds", max_delay="8 seconds", failure_threshold=5,
+                         reset_timeout="30 seconds"):
+        """
+        Configures how requests to ServiceNow recover from transient failures, for every RESTQuery and RESTInsert library
+        using this instance and user in this process.
+
+        Queries and other idempotent requests failing with a connection error, a timeout or a gateway error (502, 503 or
+        504) are retried up to ``retries`` times, waiting an exponential backoff with random jitter that starts at
+        ``initial_delay`` and doubles up to ``max_delay``. Inserts are only retried if a correlation field is given to
+        `Insert Record` in RESTInsert. Use ``retries=0`` to disable retries.
+
+        After ``failure_threshold`` requests in a row failed despite the retries, the instance is considered down:
+        requests fail at once with a CircuitOpen error for ``reset_timeout``, then one request is sent to check whether
+        the instance is back. Times can be given in Robot Framework time format.
+
+        | Set Retry Policy | retries=5 | max_delay=30 seconds | failure_threshold=10 |
+        """
+        session = self.client.session
+        session.retries = int(retries)
+        session.retry_initial = timestr_to_secs(initial_delay)
+        session.retry_max = timestr_to_secs(max_delay)
+        breaker = get_circuit_breaker(urlparse(self.client.base_url).netloc)
+        breaker.threshold = int(failure_threshold)
+        breaker.reset_timeout = timestr_to_secs(reset_timeout)
+
+    @keyword
+    def use_cassette(self, path, mode="REPLAY"):
+        """
+        Records the responses to every request that RESTQuery and RESTInsert libraries send to ServiceNow in this
+        process, or replays them from a previous recording, using the cassette file at ``path`` (a gzip compressed JSON
+        file). Requests are matched by method, URL, query parameters in any order and body.
+
+        - ``RECORD``: send the requests and record the responses. The cassette is saved by `Stop Cassette`, or when the
+          process exits.
+        - ``REPLAY``: answer the recorded requests from the cassette, without sending them, and send the others.
+        - ``STRICT``: like REPLAY, but fail with CassetteMiss for requests that were not recorded, e.g. to check that a
+          read-only suite runs offline.
+
+        A query sent several times is replayed with each of its recorded responses in turn, then the last one again.
+        The cassette can also be set for the whole run with the ``SNOW_CASSETTE`` and ``SNOW_CASSETTE_MODE``
+        environment variables.
+
+        | Use Cassette | ${CURDIR}/cassettes/incidents.json.gz | RECORD |
+        """
+        use_cassette(Cassette(path, mode))
+        logger.info("Using the cassette {p} in {m} mode.".format(p=path, m=mode.upper()))
+
+    @keyword
+    def stop_cassette(self):
+        """
+        Stops recording or replaying requests with the cassette given to `Use Cassette`, saving it if it was recording.
+        Returns the number of requests replayed (hits) and not found (misses) in the cassette.
+        """
+        cassette = self.client.session.cassette
+        if cassette is None:
+            raise AssertionError("No cassette is in use. Use the `Use Cassette` keyword first.")
+        use_cassette(None)
+        logger.info("Stopped using the cassette {p}: {h} hits, {m} misses.".format(p=cassette.path, h=cassette.hits,
+                                                                                    m=cassette.misses))
+        return {"hits": cassette.hits, "misses": cassette.misses}
+
+    @keyword
+    def download_attachment(self, sys_id, path, checksum=None, expected_checksum=None):
+        """
+        Downloads the attachment ``sys_id`` to the file ``path``, writing it in chunks as it is received so that memory
+        use does not depend on its size. The file only appears at ``path`` once it is complete. Returns a dictionary with
+        the number of ``bytes`` downloaded, the ``seconds`` it took, the throughput in ``bytes_per_second`` and the
+        ``checksum`` of the file, if a ``checksum`` algorithm such as md5 or sha256 is given. If ``expected_checksum``
+        is given, the download fails if the file does not match it (computed with sha256 by default).
+
+        | ${download}= | Download Attachment | ${attachment_sys_id} | ${OUTPUT DIR}/orders.csv | expected_checksum=${sha256} |
+        """
+        if expected_checksum and not checksum:
+            checksum = "sha256"
+        transfer = Transfer(os.path.basename(path), checksum=checksum)
+        response = self.client.session.get(self.client.base_url + "/api/now/attachment/{}/file".format(sys_id),
+                                           stream=True, headers={"Accept": "*/*"})
+        if response.status_code == 404:
+            response.close()
+            raise AssertionError("No attachment with sys_id {} was found.".format(sys_id))
+        response.raise_for_status()
+        if "Content-Encoding" not in response.headers and response.headers.get("Content-Length"):
+            transfer.size = int(response.headers["Content-Length"])
+        download(response, path, transfer)
+        result = transfer.summary()
+        logger.info("Downloaded {b:,} bytes to {p} in {s} seconds.".format(b=result["bytes"], p=path,
+                                                                            s=result["seconds"]))
+        if expected_checksum and result["checksum"] != expected_checksum.lower():
+            raise AssertionError("The {c} checksum of {p} is {a}, expected {e}.".format(
+                c=checksum, p=path, a=result["checksum"], e=expected_checksum))
+        return result
+
+    @keyword
+    def get_shared_cache_statistics(self):
+        """
+        Returns a dictionary with the hits and misses of the shared cache for this worker process, the number of
+        entries in the cache, and the hits and misses of every worker that has used the same cache file. Fails if no
+        shared cache has been configured.
+        """
+        if self.shared_cache is None:
+            raise AssertionError("No shared cache has been configured. Set the shared_cache library argument or the "
+                                 "SNOW_SHARED_CACHE environment variable.")
+        stats = self.shared_cache.statistics()
+        logger.info("Shared cache statistics for worker {w}: {h} hits, {m} misses.".format(w=stats["worker"],
+                                                                                          h=stats["hits"],
+                                                                                          m=stats["misses"]))
+        return stats
+
     @keyword
     def add_sort(self, field_name, ascending=True):
         """
@@ -303,7 +837,7 @@ class RESTQuery:
         | Query Table Is | ticket         |
         | Add Sort       | sys_created_on | ascending=${FALSE} | # Sort tickets on the created date, most recent first |
         """
-        if not self._query_is_empty():
+        if self.query._query:
             self.query.AND()
         if ascending:
             logger.info("Sorting records by {} in ascending order.".format(field_name))
@@ -340,12 +874,16 @@ class RESTQuery:
         if self.response is None:
             raise QueryNotExecuted("No query has been executed.")
         try:
-            values = [record[field_name.lower()] for record in self.response]  # lowercase for convenience
+            if isinstance(self.response, ColumnarRecords):
+                values = self.response.column(field_name.lower())
+            else:
+                values = [record[field_name.lower()] for record in self.response]  # lowercase for convenience
         except KeyError:
             logger.error("Field not found in response from {q}: {f}".format(q=self.query_table,
                                                                             f=field_name)
                          )
-            logger.info("Available fields were: " + str(", ".join(self.response[0].keys())))
+            if len(self.response) > 0:
+                logger.info("Available fields were: " + str(", ".join(self.response[0].keys())))
             raise
         return values
 
@@ -378,6 +916,348 @@ class RESTQuery:
                 "Field not found in response from {table}: {field}".format(table=self.query_table, field=field_to_get))
         return data
 
+    def _count_matching_records(self, query, limit=1):
+        """
+        Returns the number of records in the query table matching the encoded ``query``, without downloading them. The
+        total is read from the X-Total-Count header of a request for the sys_id of ``limit`` records. If the header is
+        missing, the sys_ids returned are counted instead, so the count is exact up to ``limit``.
+        """
+        query_resource = self.client.resource(api_path="/table/{query_table}".format(query_table=self.query_table))
+        response = query_resource.get(query=query, stream=True, fields=["sys_id"], limit=limit)
+        total = response.headers.get("X-Total-Count")
+        if total is None:
+            return sum(1 for _ in self._stream_records(response))
+        response._response.close()
+        return int(total)
+
+    @keyword
+    def wait_until_query_returns(self, expected_count=1, timeout="1 minute", initial_interval="1 second",
+                                 max_interval="30 seconds", updated_after=None):
+        """
+        Polls the query table until at least ``expected_count`` records match the current query parameters, and returns
+        the number of attempts it took. Each poll only asks ServiceNow for the number of matching records, so no
+        records are downloaded while waiting. If the instance does not return that number in the X-Total-Count header,
+        the sys_ids of up to ``expected_count`` records are counted instead. The time between polls starts at
+        ``initial_interval`` and doubles (with random jitter) up to ``max_interval``. If the records are not there after
+        ``timeout``, the keyword fails. Times can be given in Robot Framework time format, e.g. ``1 minute 30 seconds``
+        or ``90``.
+
+        If ``updated_after`` is provided in the format ``YYYY-MM-DD hh:mm:ss``, only records updated after that time are
+        counted, which is useful for waiting on business rules or workflows to update existing records.
+
+        The query parameters are kept, so `Execute Query` can be used afterwards to retrieve the records. For example:
+
+        | Query Table Is              | sc_task        |
+        | Required Query Parameter Is | request_item   | EQUALS   | ${ritm_sys_id} |
+        | ${attempts}=                | Wait Until Query Returns | expected_count=2 | timeout=2 minutes |
+        | Execute Query               | multiple=${TRUE} |
+        """
+        assert self.query_table is not None, "Query table must already be specified in this test case, but is not."
+        expected_count = int(expected_count)
+        deadline = time.time() + timestr_to_secs(timeout)
+        queries = [""] if self._query_is_empty() else self._chunked_queries()
+        if updated_after is not None:
+            updated_after = self._parse_datetime(updated_after).strftime("%Y-%m-%d %H:%M:%S")
+            queries = ["^".join(q for q in (query, "sys_updated_on>{}".format(updated_after)) if q)
+                       for query in queries]
+        delays = exponential_backoff(timestr_to_secs(initial_interval), timestr_to_secs(max_interval))
+        attempts = 0
+        while True:
+            attempts += 1
+            count = sum(self._count_matching_records(query, max(expected_count, 1)) for query in queries)
+            logger.debug("Poll attempt {a} found {c} matching records.".format(a=attempts, c=count))
+            if count >= expected_count:
+                logger.info("Found {c} matching records after {a} attempts.".format(c=count, a=attempts))
+                return attempts
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise AssertionError("Expected at least {e} matching records in {t}, but found {c} after {a} attempts "
+                                     "in {timeout}.".format(e=expected_count, t=self.query_table, c=count, a=attempts,
+                                                            timeout=timeout))
+            time.sleep(min(next(delays), remaining))
+
+    @keyword
+    def capture_table_watermark(self, table=None):
+        """
+        Records the most recent ``sys_updated_on`` value in ``table`` (the query table by default), along with the
+        ``sys_mod_count`` of every record updated at that exact time, and returns it as a watermark. Pass the watermark
+        to `Get Records Changed Since Watermark` later to retrieve only the records that were inserted or updated in
+        the meantime. For example:
+
+        | ${watermark}=  | Capture Table Watermark | u_supplier |
+        | Run Supplier Integration |
+        | Query Table Is | u_supplier |
+        | ${changed}=    | Get Records Changed Since Watermark | ${watermark} |
+        """
+        table = table or self.query_table
+        assert table is not None, "Query table must already be specified in this test case, but is not."
+        query_resource = self.client.resource(api_path="/table/{query_table}".format(query_table=table))
+        latest = self._first_or_none(query_resource.get(query="ORDERBYDESCsys_updated_on", stream=True,
+                                                        fields=["sys_updated_on"], limit=1))
+        watermark = {"table": table, "sys_updated_on": None, "sys_mod_count": {}}
+        if latest is not None:
+            watermark["sys_updated_on"] = latest["sys_updated_on"]
+            boundary = self._paginate("sys_updated_on={}".format(latest["sys_updated_on"]),
+                                      fields=["sys_id", "sys_mod_count"], table=table)
+            watermark["sys_mod_count"] = {r["sys_id"]: r["sys_mod_count"] for r in boundary}
+        logger.info("Watermark for {t} is {w} ({n} records at the watermark).".format(
+            t=table, w=watermark["sys_updated_on"], n=len(watermark["sys_mod_count"])))
+        return watermark
+
+    @keyword
+    def get_records_changed_since_watermark(self, watermark, page_size=1000):
+        """
+        Returns a list of the records in the watermark's table that were inserted or updated since the watermark was
+        captured with `Capture Table Watermark`, and sets them as the response like `Execute Query` with ``multiple``
+        set to *True*. Only the changed records are transferred, ``page_size`` records per request. Any query
+        parameters and response fields that have been defined are applied as well.
+        """
+        if self.query_table is not None and self.query_table != watermark["table"]:
+            raise AssertionError("The watermark was captured for {w}, but the query table is {t}.".format(
+                w=watermark["table"], t=self.query_table))
+        queries = [""] if self._query_is_empty() else self._chunked_queries()
+        if watermark["sys_updated_on"] is not None:
+            queries = ["^".join(q for q in (query, "sys_updated_on>={}".format(watermark["sys_updated_on"])) if q)
+                       for query in queries]
+        fields = list(self.desired_response_fields)
+        if fields:
+            fields.extend(f for f in ("sys_id", "sys_mod_count") if f not in fields)
+        boundary = watermark["sys_mod_count"]
+        changed = dict()  # Records are merged by sys_id across the chunks of a long IN list.
+        for query in queries:
+            for record in self._paginate(query, fields=fields, page_size=int(page_size), table=watermark["table"]):
+                if boundary.get(record["sys_id"]) != record["sys_mod_count"]:
+                    changed.setdefault(record["sys_id"], record)
+        self.response = list(changed.values())
+        self.record_count = len(self.response)
+        logger.info("Number of records changed since {w}: {n}".format(w=watermark["sys_updated_on"],
+                                                                      n=self.record_count))
+        self._reset_query()
+        return self.response
+
+    @keyword
+    def export_query_results_to_file(self, file_name, file_format="CSV", delimiter="COMMA", compress=False,
+                                     page_size=1000):
+        """
+        Writes every record matching the current query parameters to the file ``file_name``, which must be absolute,
+        and returns the number of records written. Records are fetched ``page_size`` at a time and written as they
+        arrive, so memory use stays the same however many records match. Only the fields set with
+        `Include Fields In Response` are written if any were specified, in that order.
+
+        - ``file_format``: ``CSV`` (default) or ``JSONL`` (one JSON record per line).
+        - ``delimiter``: The CSV delimiter, one of the delimiters supported by `Define Delimiter` in DataFile.
+        - ``compress``: Write the file gzip compressed. This is also done if ``file_name`` ends with ``.gz``.
+
+        For CSV files, reference fields are written as their sys_id value. For example:
+
+        | Query Table Is               | incident         |
+        | Required Query Parameter Is  | active           | EQUALS | true |
+        | Include Fields In Response   | number           | state  | assignment_group |
+        | ${count}=                    | Export Query Results To File | ${OUTPUT DIR}/incidents.csv.gz |
+        """
+        assert self.query_table is not None, "Query table must already be specified in this test case, but is not."
+        if not os.path.isabs(file_name):
+            raise AssertionError("The file name must be absolute. It should begin with a slash (/) character or a drive"
+                                 " specification, such as C:\\.")
+        file_format = file_format.upper()
+        if file_format not in ["CSV", "JSONL"]:
+            raise AssertionError("Invalid file format {}. Expected CSV or JSONL.".format(file_format))
+        if delimiter.upper() not in DataFile.VALID_DELIMITERS:
+            raise AssertionError("Invalid delimiter.  Delimiter must be COMMA, PIPE, TAB, COLON, or SEMICOLON.")
+        if compress or file_name.endswith(".gz"):
+            f = gzip.open(file_name, "wt", newline="", encoding="utf-8")
+        else:
+            f = open(file_name, "w", newline="", encoding="utf-8")
+        fields = list(self.desired_response_fields)
+        written = 0
+        start = time.time()
+        with f:
+            writer = None
+            for query in [""] if self._query_is_empty() else self._chunked_queries():
+                for record in self._paginate(query, fields=fields, page_size=int(page_size)):
+                    if file_format == "JSONL":
+                        f.write(json.dumps(record, separators=(",", ":")))
+                        f.write("\n")
+                    else:
+                        if writer is None:
+                            writer = csv.DictWriter(f, fieldnames=fields or list(record), extrasaction="ignore",
+                                                    delimiter=DataFile.VALID_DELIMITERS[delimiter.upper()])
+                            writer.writeheader()
+                        writer.writerow({k: v["value"] if isinstance(v, dict) else v for k, v in record.items()})
+                    written += 1
+        elapsed = time.time() - start
+        logger.info("Exported {n} records from {t} to {f} in {s:.1f} seconds.".format(n=written, t=self.query_table,
+                                                                                      f=file_name, s=elapsed))
+        self._reset_query()
+        return written
+
+    @keyword
+    def verify_data_file_against_table(self, file_name, key_header, *field_mappings, delimiter="COMMA",
+                                       fail_on_differences=True):
+        """
+        Verifies that every row in the delimited data file ``file_name`` (e.g. one generated with DataFile and loaded
+        through an import set) has a matching record in the query table, and returns a dictionary with the number of
+        ``matched`` rows, the keys of the ``missing`` and ``extra`` rows, and the ``mismatched`` rows, each as a
+        dictionary with its ``key`` and its ``differences``: the expected and actual value of each field that differs.
+        The file's first row must be its header row. Keys must be unique in the file and cannot contain commas, which
+        would break the IN queries.
+
+        ``key_header`` is the header of the column identifying each row, and each of ``field_mappings`` is the header
+        of a column to compare. Either can be given as ``HEADER=field`` when the table field has a different name,
+        otherwise the lowercase header is used as the field name. Rows are compared on the value of each mapped field
+        (the sys_id value for reference fields). Records are fetched in batches with IN queries on the key field, so
+        the number of requests grows with the number of rows divided by the IN_CHUNK_SIZE rather than with the
+        number of rows. Table records sharing a key with another record are reported as ``extra``. Records of the
+        table whose key is not in the file are not checked, since that would mean reading the whole table.
+
+        Unless ``fail_on_differences`` is *False*, the keyword fails if any row is missing, mismatched or extra.
+
+        | Query Table Is                 | u_supplier     |
+        | Verify Data File Against Table | ${file_name}   | SUPPLIER_ID=u_supplier_id | SUPPLIER_NAME=u_name | REQ_STATUS=u_status |
+        """
+        assert self.query_table is not None, "Query table must already be specified in this test case, but is not."
+        if delimiter.upper() not in DataFile.VALID_DELIMITERS:
+            raise AssertionError("Invalid delimiter.  Delimiter must be COMMA, PIPE, TAB, COLON, or SEMICOLON.")
+        mappings = list()
+        for mapping in (key_header,) + field_mappings:
+            header, _, field = mapping.partition("=")
+            mappings.append((header.strip(), (field or header).strip().lower()))
+        key_field = mappings[0][1]
+        fields = [field for _, field in mappings]
+
+        expected = dict()
+        with open(file_name, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f, delimiter=DataFile.VALID_DELIMITERS[delimiter.upper()])
+            headers = next(reader, [])
+            try:
+                positions = [headers.index(header) for header, _ in mappings]
+            except ValueError as e:
+                raise AssertionError("Header not found in {f}: {e}".format(f=file_name, e=e))
+            duplicates = list()
+            for row in reader:
+                if row:
+                    values = tuple(row[p].strip() for p in positions)
+                    if "," in values[0]:
+                        raise AssertionError("The key {k} in {f} contains a comma, which cannot be used in an IN "
+                                             "query.".format(k=values[0], f=file_name))
+                    if values[0] in expected:
+                        duplicates.append(values[0])
+                    expected[values[0]] = values[1:]
+        if duplicates:
+            raise AssertionError("Keys must be unique, but {f} has duplicate keys: {d}.".format(f=file_name,
+                                                                                                d=duplicates[:10]))
+        logger.info("Read {n} rows from {f}.".format(n=len(expected), f=file_name))
+
+        report = {"matched": 0, "missing": list(), "mismatched": list(), "extra": list()}
+        found = set()
+        keys = list(expected)
+        for i in range(0, len(keys), self.IN_CHUNK_SIZE):
+            query = "{f}IN{v}".format(f=key_field, v=",".join(keys[i:i + self.IN_CHUNK_SIZE]))
+            for record in self._paginate(query, fields=fields):
+                values = tuple((v["value"] if isinstance(v, dict) else str(v)).strip()
+                               for v in (record.get(field, "") for field in fields))
+                key = values[0]
+                if key not in expected:
+                    continue
+                if key in found:
+                    report["extra"].append(key)
+                    continue
+                found.add(key)
+                if values[1:] == expected[key]:
+                    report["matched"] += 1
+                else:
+                    report["mismatched"].append({"key": key, "differences": {
+                        field: {"expected": e, "actual": a}
+                        for field, e, a in zip(fields[1:], expected[key], values[1:]) if e != a}})
+        report["missing"] = [key for key in keys if key not in found]
+        logger.info("Data file verification against {t}: {m} matched, {mi} missing, {mm} mismatched, {e} extra.".format(
+            t=self.query_table, m=report["matched"], mi=len(report["missing"]), mm=len(report["mismatched"]),
+            e=len(report["extra"])))
+        if fail_on_differences and (report["missing"] or report["mismatched"] or report["extra"]):
+            raise AssertionError("Data file {f} does not match {t}. Missing: {mi}. Mismatched: {mm}. Extra: {e}.".format(
+                f=file_name, t=self.query_table, mi=report["missing"][:10], mm=[
+                    "{k} ({d})".format(k=m["key"], d=", ".join("{f}: expected {e}, found {a}".format(
+                        f=f, e=v["expected"], a=v["actual"]) for f, v in m["differences"].items()))
+                    for m in report["mismatched"][:10]],
+                e=report["extra"][:10]))
+        return report
+
+    @staticmethod
+    def _normalize_message(text):
+        """Returns ``text`` with runs of whitespace collapsed to single spaces and case folded, for comparing messages."""
+        return " ".join(text.split()).casefold()
+
+    @keyword
+    def verify_notifications_sent(self, expected_messages, start, end=None, table="sys_email", query=None,
+                                  match_fields="subject, body_text", page_size=1000, fail_on_missing=True,
+                                  fail_on_unexpected=False):
+        """
+        Verifies that each of ``expected_messages`` was sent between ``start`` and ``end`` (now by default), in the format
+        ``YYYY-MM-DD hh:mm:ss``, and returns a dictionary with the number of ``matched`` messages, the ``missing``
+        messages and the ``unexpected`` records, i.e. the records sent in that time which did not match any expected
+        message, each as a dictionary with its ``sys_id`` and ``subject``.
+
+        The expected messages can be strings, or the dictionaries returned by NotificationHelper
+        `Get Expected Notification Messages`, in which case both their ``sms`` and ``email`` messages are expected. A
+        message matches a record of ``table`` (``sys_email`` by default) if it is equal to one of its ``match_fields``,
+        ignoring case and differences in whitespace, and each record matches one message at most. The records sent in
+        the time window are fetched ``page_size`` at a time, with only the fields needed, and indexed by their normalized
+        fields, so the number of requests does not depend on the number of expected messages. Use ``query`` to add an
+        encoded query restricting the records, e.g. ``type=sent``.
+
+        Unless ``fail_on_missing`` is *False*, the keyword fails if any message is missing. If ``fail_on_unexpected`` is
+        *True*, it also fails if any record was unexpected.
+
+        | ${start}=    | Get Time |
+        | Run OIR Notification Scenario |
+        | ${messages}= | Get Expected Notification Messages | ${records} |
+        | ${report}=   | Verify Notifications Sent | ${messages} | ${start} | query=type=sent |
+        """
+        start_dt = self._parse_datetime(start)
+        end_dt = self._parse_datetime(end if end is not None else BuiltIn().get_time())
+        fields = [field.strip() for field in match_fields.split(",")]
+        expected = list()
+        for message in expected_messages:
+            if isinstance(message, dict):
+                expected.extend(message[t] for t in ("sms", "email") if t in message)
+            else:
+                expected.append(message)
+
+        conditions = ["sys_created_onBETWEENjavascript:gs.dateGenerate('{start}')@javascript:gs.dateGenerate('{end}')"
+                      .format(start=start_dt, end=end_dt)]
+        if query:
+            conditions.append(query)
+        index = dict()
+        candidates = list()
+        for record in self._paginate("^".join(conditions), fields=["sys_id"] + fields, page_size=int(page_size),
+                                     table=table):
+            position = len(candidates)
+            candidates.append({"sys_id": record["sys_id"], "subject": record.get("subject", "")})
+            for key in {self._normalize_message(record.get(field) or "") for field in fields}:
+                index.setdefault(key, list()).append(position)
+        logger.info("Found {n} records in {t} sent between {s} and {e}.".format(n=len(candidates), t=table, s=start_dt,
+                                                                                e=end_dt))
+
+        report = {"matched": 0, "missing": list(), "unexpected": list()}
+        used = set()
+        for message in expected:
+            positions = index.get(self._normalize_message(message), [])
+            while positions and positions[-1] in used:
+                positions.pop()
+            if positions:
+                used.add(positions.pop())
+                report["matched"] += 1
+            else:
+                report["missing"].append(message)
+        report["unexpected"] = [c for i, c in enumerate(candidates) if i not in used]
+        logger.info("Notification verification: {m} matched, {mi} missing, {u} unexpected.".format(
+            m=report["matched"], mi=len(report["missing"]), u=len(report["unexpected"])))
+        if (fail_on_missing and report["missing"]) or (fail_on_unexpected and report["unexpected"]):
+            raise AssertionError("Notifications sent do not match the expected messages. Missing: {mi}. Unexpected: "
+                                 "{u}.".format(mi=report["missing"][:10],
+                                               u=[c["subject"] for c in report["unexpected"][:10]]))
+        return report
+
     @keyword
     def get_records_created_after(self, when):
         """Returns the number of records created in the defined query_table after ``when``. The argument ``when`` must
@@ -448,6 +1328,10 @@ class RESTInsert:
 
     ROBOT_LIBRARY_SCOPE = "TEST CASE"
 
+    # Bulk updates and deletes send this many requests per batch API call, with this many calls in flight at once.
+    BATCH_SIZE = 100
+    MAX_WORKERS = 4
+
     def __init__(self, host=None, user=None, password=None, insert_table=None, response=None):
 
         """The following arguments can be optionally provided when importing this library:
@@ -486,7 +1370,7 @@ class RESTInsert:
             raise AssertionError(
                 "Unable to determine SNOW Instance. Verify that the SNOW_TEST_URL environment variable been set.")
 
-        self.client = pysnow.Client(instance=self.instance, user=self.user, password=self.password)
+        self.client = pysnow.Client(instance=self.instance, session=get_session(self.instance, self.user, self.password))
         self.insert_table = insert_table
         self.response = response
 
@@ -499,7 +1383,7 @@ class RESTInsert:
         r = RESTQuery()
         r.query_table_is("sys_db_object")
         r.required_query_parameter_is("name", "EQUALS", insert_table)
-        r.execute_query()
+        r.execute_query(use_cache=True)
         if r.response is None:
             raise AssertionError("Insert table not found, please check the table name")
         else:
@@ -527,10 +1411,187 @@ class RESTInsert:
             self.new_record_payload = new_record_payload
 
     @keyword
-    def insert_record(self):
+    def insert_record(self, correlation_field=None):
         """This keyword inserts the record in Servicenow by calling Create function from pysnow. It returns the sysid
-        of the newly created record."""
+        of the newly created record.
+
+        Inserts are not retried by default, because a request that failed on the way back may still have created the
+        record. If ``correlation_field`` names a field of the payload with a value unique to this record (e.g.
+        ``correlation_id``), an insert failing with a connection error or a gateway error (502, 503 or 504) is retried
+        like queries are (see `Set Retry Policy` in RESTQuery), but only after checking that no record with that value
+        exists yet. If one does, its sys_id is returned instead.
+
+        | ${sys_id}= | Insert Record | correlation_field=correlation_id |
+        """
         insert_resource = self.client.resource(api_path="/table/{insert_table}".format(insert_table=self.insert_table))
-        result = insert_resource.create(payload=self.new_record_payload)
-        sys_id = result['sys_id']
+        if correlation_field is not None and correlation_field not in self.new_record_payload:
+            raise AssertionError("The correlation field {} is not in the payload.".format(correlation_field))
+        session = self.client.session
+        delays = exponential_backoff(session.retry_initial, session.retry_max)
+        attempts = 0
+        while True:
+            try:
+                result = insert_resource.create(payload=self.new_record_payload)
+                sys_id = result['sys_id']
+                break
+            except RequestException as e:
+                if correlation_field is None or attempts == session.retries or not self._is_transient(e):
+                    raise
+                attempts += 1
+                logger.info("Insert failed with {e}, checking whether the record was created.".format(e=e))
+                time.sleep(next(delays))
+                value = self.new_record_payload[correlation_field]
+                existing = RESTQuery._first_or_none(insert_resource.get(query={correlation_field: value}, stream=True,
+                                                                        fields=["sys_id"], limit=1))
+                if existing is not None:
+                    sys_id = existing["sys_id"]
+                    logger.info("The record was created by the failed insert, with sys_id {}.".format(sys_id))
+                    break
+        tracker.track(self.insert_table, sys_id)
         return sys_id
+
+    @staticmethod
+    def _is_transient(error):
+        """Returns whether a request failed because of a connection problem or a gateway error, worth retrying."""
+        if isinstance(error, (ConnectionError, Timeout)):
+            return True
+        response = getattr(error, "response", None)
+        return response is not None and response.status_code in SnowSession.RETRY_STATUSES
+
+    def _send_batch(self, rest_requests):
+        """Sends ``rest_requests`` in one call to the batch API, and returns the ids of the requests that failed."""
+        body = {"batch_request_id": str(uuid.uuid4()), "rest_requests": rest_requests}
+        response = self.client.session.post(self.client.base_url + "/api/now/v1/batch", json=body)
+        response.raise_for_status()
+        result = response.json()
+        methods = {r["id"]: r["method"] for r in rest_requests}
+        failed = [r["id"] for r in result.get("serviced_requests", [])
+                  if not (200 <= r["status_code"] < 300 or (r["status_code"] == 404 and methods[r["id"]] == "DELETE"))]
+        return failed + list(result.get("unserviced_requests", []))
+
+    def _send_in_batches(self, method, records, payload=None, batch_size=None, max_workers=None):
+        """
+        Sends a ``method`` request for each of ``records`` (dictionaries with a table and a sys_id) through the batch
+        API, ``batch_size`` requests per call with up to ``max_workers`` calls at once. Returns the records that failed.
+        A record that no longer exists counts as deleted.
+        """
+        batch_size = int(batch_size or self.BATCH_SIZE)
+        max_workers = int(max_workers or self.MAX_WORKERS)
+        headers = [{"name": "Content-Type", "value": "application/json"},
+                   {"name": "Accept", "value": "application/json"}]
+        body = base64.b64encode(json.dumps(payload).encode("utf-8")).decode("ascii") if payload is not None else None
+        rest_requests = list()
+        for number, record in enumerate(records):
+            request = {"id": str(number), "method": method, "headers": headers,
+                       "url": "/api/now/table/{t}/{s}".format(t=record["table"], s=record["sys_id"])}
+            if body is not None:
+                request["body"] = body
+            rest_requests.append(request)
+        batches = [rest_requests[i:i + batch_size] for i in range(0, len(rest_requests), batch_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            failed = {int(i) for ids in pool.map(self._send_batch, batches) for i in ids}
+        return [record for number, record in enumerate(records) if number in failed]
+
+    def _matching_records(self, table, query):
+        """Returns the table and sys_id of every record in ``table`` matching the encoded ``query``."""
+        if not query:
+            raise AssertionError("A query is required, to avoid changing every record in {}.".format(table))
+        r = RESTQuery(host=self.host, user=self.user, password=self.password)
+        return [{"table": table, "sys_id": record["sys_id"]} for record in r._paginate(query, fields=["sys_id"],
+                                                                                      table=table)]
+
+    @keyword
+    def upload_attachment(self, table, sys_id, path, file_name=None, content_type=None, checksum=None):
+        """
+        Attaches the file at ``path`` to the record ``sys_id`` in ``table``, sending it in chunks as the connection
+        takes them so that memory use does not depend on its size, e.g. for large files made with DataFile. The
+        attachment is named ``file_name`` (by default, the name of the file) and its ``content_type`` is guessed from
+        the name if it is not given. The upload is not retried if it fails, since the file would have to be read again.
+
+        Returns a dictionary with the ``sys_id`` of the attachment, the number of ``bytes`` uploaded, the ``seconds`` it
+        took, the throughput in ``bytes_per_second`` and the ``checksum`` of the file, if a ``checksum`` algorithm such
+        as md5 or sha256 is given. Attachments are deleted by `Cleanup Created Records` like inserted records.
+
+        | ${upload}= | Upload Attachment | u_import_set | ${sys_id} | ${OUTPUT DIR}/orders.csv | checksum=sha256 |
+        """
+        if not os.path.isfile(path):
+            raise AssertionError("The file {} does not exist.".format(path))
+        file_name = file_name or os.path.basename(path)
+        content_type = content_type or mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        transfer = Transfer(file_name, os.path.getsize(path), checksum)
+        body = UploadStream(path, transfer)
+        try:
+            response = self.client.session.post(self.client.base_url + "/api/now/attachment/file", data=body,
+                                                params={"table_name": table, "table_sys_id": sys_id,
+                                                        "file_name": file_name},
+                                                headers={"Content-Type": content_type})
+        finally:
+            body.close()
+        response.raise_for_status()
+        result = dict(transfer.summary(), sys_id=response.json()["result"]["sys_id"])
+        tracker.track("sys_attachment", result["sys_id"])
+        logger.info("Uploaded {b:,} bytes from {p} in {s} seconds.".format(b=result["bytes"], p=path,
+                                                                            s=result["seconds"]))
+        return result
+
+    @keyword
+    def cleanup_created_records(self, scope="TEST", batch_size=None, max_workers=None):
+        """
+        Deletes the records created with `Insert Record` in the current ``TEST`` (default), the current ``SUITE``, or
+        ``ALL`` of them, and returns the number of records deleted. Intended to be used as a test or suite teardown so
+        that test data does not pile up in the instance. Records are deleted newest first through the batch API,
+        ``batch_size`` (default 100) records per request with up to ``max_workers`` (default 4) requests at once.
+        Records that were already deleted are ignored. The keyword fails if any record could not be deleted, and those
+        records are kept for the next cleanup.
+
+        | [Teardown] | Cleanup Created Records |
+        | Suite Teardown | Cleanup Created Records | scope=SUITE |
+        """
+        records = tracker.created(scope)
+        records.reverse()
+        failed = self._send_in_batches("DELETE", records, batch_size=batch_size, max_workers=max_workers)
+        failed_records = {id(record) for record in failed}
+        deleted = [record for record in records if id(record) not in failed_records]
+        tracker.forget(deleted)
+        logger.info("Deleted {n} created records.".format(n=len(deleted)))
+        if failed:
+            raise AssertionError("Failed to delete {n} created records: {r}".format(
+                n=len(failed), r=["{t}/{s}".format(t=f["table"], s=f["sys_id"]) for f in failed[:10]]))
+        return len(deleted)
+
+    @keyword
+    def update_records(self, table, query, payload, batch_size=None, max_workers=None):
+        """
+        Applies ``payload``, a dictionary of field values, to every record in ``table`` matching the encoded ``query``,
+        and returns the number of records updated. The matching records are found with paginated queries, and then
+        updated through the batch API like `Cleanup Created Records`. The keyword fails if any record could not be
+        updated.
+
+        | ${payload}= | Create Dictionary | state=7 |
+        | ${count}= | Update Records | incident | short_descriptionSTARTSWITHRobot test | ${payload} |
+        """
+        records = self._matching_records(table, query)
+        failed = self._send_in_batches("PATCH", records, payload=dict(payload), batch_size=batch_size,
+                                       max_workers=max_workers)
+        logger.info("Updated {n} records in {t}.".format(n=len(records) - len(failed), t=table))
+        if failed:
+            raise AssertionError("Failed to update {n} records in {t}: {s}".format(
+                n=len(failed), t=table, s=[f["sys_id"] for f in failed[:10]]))
+        return len(records)
+
+    @keyword
+    def delete_records_matching_query(self, table, query, batch_size=None, max_workers=None):
+        """
+        Deletes every record in ``table`` matching the encoded ``query``, and returns the number of records deleted. The
+        matching records are found with paginated queries, and then deleted through the batch API like
+        `Cleanup Created Records`. The keyword fails if any record could not be deleted.
+
+        | ${count}= | Delete Records Matching Query | incident | short_descriptionSTARTSWITHRobot test |
+        """
+        records = self._matching_records(table, query)
+        failed = self._send_in_batches("DELETE", records, batch_size=batch_size, max_workers=max_workers)
+        logger.info("Deleted {n} records from {t}.".format(n=len(records) - len(failed), t=table))
+        if failed:
+            raise AssertionError("Failed to delete {n} records from {t}: {s}".format(
+                n=len(failed), t=table, s=[f["sys_id"] for f in failed[:10]]))
+        return len(records)
@@ -0,0 +1,105 @@
+import os
+import struct
+from array import array
+from itertools import accumulate
+
+# The stride, the size of the indexed part of the file, its number of complete lines, and whether it ends in a partial line.
+_HEADER = struct.Struct("<QQQQ")
+
+
+class LineIndex:
+    """
+    A sparse index of the lines of a text file, stored next to it in ``<file name>.idx``. The index records the byte
+    offset of every ``stride``-th line, so that any line can be found by seeking to the nearest recorded offset and
+    reading at most ``stride`` lines, instead of reading the file from the start. The index remembers how much of the
+    file it covers, and `update` only scans the bytes appended since, so it is built once and then kept up to date in
+    time proportional to what was appended. If the file shrinks, the index is rebuilt.
+
+    Lines are separated by LF (or CRLF), so values containing line breaks span several lines.
+    """
+
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path, stride=1000):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.stride = int(stride)
+        self.offsets = array("Q", [0])
+        self.indexed_size = 0
+        self.complete_lines = 0
+        self.partial_line = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                stride, size, lines, partial = _HEADER.unpack(f.read(_HEADER.size))
+                offsets = array("Q")
+                offsets.frombytes(f.read())
+        except (OSError, struct.error, ValueError):
+            return  # No usable index, it will be built from scratch.
+        if stride == self.stride and len(offsets) == lines // stride + 1:
+            self.offsets, self.indexed_size, self.complete_lines, self.partial_line = offsets, size, lines, bool(partial)
+
+    def _save(self):
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(_HEADER.pack(self.stride, self.indexed_size, self.complete_lines, self.partial_line))
+            self.offsets.tofile(f)
+        os.replace(temporary, self.index_path)
+
+    def update(self):
+        """Index the bytes added to the file since the last update, and save the index if it changed."""
+        size = os.path.getsize(self.path)
+        if size == self.indexed_size:
+            return
+        if size < self.indexed_size:
+            self.offsets, self.indexed_size, self.complete_lines, self.partial_line = array("Q", [0]), 0, 0, False
+        with open(self.path, "rb") as f:
+            f.seek(self.indexed_size)
+            position = self.indexed_size
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._index_chunk(chunk, position)
+                self.partial_line = not chunk.endswith(b"\n")
+                position += len(chunk)
+        self.indexed_size = position
+        self._save()
+
+    def _index_chunk(self, chunk, position):
+        """Record the offsets of the stride-th lines starting in ``chunk``, which begins at byte ``position``."""
+        newlines = chunk.count(b"\n")
+        if newlines == 0:
+            return
+        stride, first = self.stride, self.complete_lines
+        following = first // stride * stride + stride  # The next line number to record.
+        if following <= first + newlines:
+            # The lines starting in this chunk start right after each of its newlines.
+            starts = list(accumulate(len(line) + 1 for line in chunk.split(b"\n")[:-1]))
+            self.offsets.extend(position + starts[number - first - 1]
+                                for number in range(following, first + newlines + 1, stride))
+        self.complete_lines += newlines
+
+    @property
+    def line_count(self):
+        """The number of lines in the indexed part of the file, including a last line without a line break."""
+        return self.complete_lines + self.partial_line
+
+    def read_line(self, number, f=None):
+        """Returns line ``number`` (counted from 0) as bytes, without its line break."""
+        if not 0 <= number < self.line_count:
+            raise IndexError("line {} is out of range".format(number))
+        if f is None:
+            with open(self.path, "rb") as f:
+                return self.read_line(number, f)
+        f.seek(self.offsets[number // self.stride])
+        for _ in range(number % self.stride):
+            f.readline()
+        return f.readline().rstrip(b"\r\n")
+
+    def read_lines(self, numbers):
+        """Returns the lines with the given numbers, in the same order, opening the file only once."""
+        with open(self.path, "rb") as f:
+            return [self.read_line(number, f) for number in numbers]
@@ -0,0 +1,154 @@
+import json
+import os
+import string
+from operator import itemgetter
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional, and only needed for YAML template files.
+    yaml = None
+
+SEVERITIES = {"1": "SEV1", "2": "SEV2", "3": "SEV3", "4": "SEV4", "5": "SEV5"}
+STATES = {"Work in Progress": "WIP", "Root Cause Pending": "RCP"}
+
+
+def _oir_number(number):
+    if len(number) != 10:
+        raise AssertionError("Please enter the correct number, which is expected to have 10 digits. Got {}.".format(
+            number))
+    return number[3:]
+
+
+def _lookup(table, description, expected=None):
+    """Returns a transform looking values up in ``table``, failing with a message saying the value is ``expected``."""
+    expected = expected or "one of " + ", ".join(table)
+
+    def transform(value):
+        try:
+            return table[value]
+        except KeyError:
+            raise AssertionError("Please enter the correct {d}, which is {x}. Got {v}.".format(d=description,
+                                                                                               x=expected, v=value))
+    return transform
+
+
+# Transforms that can be referred to by name in template definitions.
+TRANSFORMS = {"oir_number": _oir_number, "severity": _lookup(SEVERITIES, "severity", "the number from 1~5"),
+              "state": _lookup(STATES, "state", "Work in Progress or Root Cause Pending"), "upper": str.upper,
+              "lower": str.lower, "strip": str.strip}
+
+# The notification formats built into the library. A definition either has a ``format`` string, or a list of
+# ``fields`` joined by a ``separator``. ``transforms`` maps fields to the name of a transform, or to a lookup table, and
+# ``sources`` maps fields to the name of the value they are taken from, if it is different.
+BUILTIN_TEMPLATES = {
+    "oir_sms": {"fields": ["sms_number", "severity", "business", "state", "text"], "separator": "|",
+                "transforms": {"sms_number": "oir_number", "severity": "severity", "state": "state"},
+                "sources": {"sms_number": "number"}},
+    "oir_email": {"format": "{number} {severity} {business} {state} {application} | {text}",
+                  "transforms": {"severity": "severity", "state": "state"}},
+    "change_create": {"format": "{number} - updated - {description}"},
+    "change_approve": {"format": "{number} - requires your approval or rejection for group - {approval_group}"},
+    "change_reject": {"format": "{number} - rejected - {description}"},
+    "change_complete": {"format": "{number} - approved - {description}"},
+    "ctask_approve": {"format": "{number} authorized - {description}"},
+}
+
+
+class CompiledTemplate:
+    """
+    A notification template compiled from its definition: the format string, the fields it needs and the transform
+    of each field are worked out once, so rendering a message is one lookup of all its values, its transform calls and
+    one format call.
+    A definition can take a field from a differently named value with ``sources``, e.g. ``{"sms_number": "number"}``
+    to render the transformed ``number`` value given to `render` as ``sms_number``.
+    """
+
+    def __init__(self, name, definition):
+        self.name = name
+        if "format" in definition:
+            template = definition["format"]
+        elif "fields" in definition:
+            template = definition.get("separator", " ").join("{{{}}}".format(f) for f in definition["fields"])
+        else:
+            raise AssertionError("The definition of template {} has neither a format nor fields.".format(name))
+        sources = dict(definition.get("sources", {}))
+        # The named placeholders are replaced by positional ones, filled from a tuple of the values in field order.
+        self.fields = list()
+        positional = list()
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            positional.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is not None:
+                if field not in self.fields:
+                    self.fields.append(field)
+                positional.append("{" + str(self.fields.index(field)) + ("!" + conversion if conversion else "") +
+                                  (":" + spec if spec else "") + "}")
+        self.transforms = list()
+        for field, transform in definition.get("transforms", {}).items():
+            if isinstance(transform, dict):
+                transform = _lookup(transform, field)
+            elif transform in TRANSFORMS:
+                transform = TRANSFORMS[transform]
+            else:
+                raise AssertionError("Unknown transform {t} for the field {f} of template {n}. Expected a lookup table "
+                                     "or one of {v}.".format(t=transform, f=field, n=name, v=", ".join(TRANSFORMS)))
+            if field in self.fields:
+                self.transforms.append((self.fields.index(field), transform))
+        self.sources = [sources.get(field, field) for field in self.fields]
+        getter = itemgetter(*self.sources) if self.sources else lambda values: ()
+        self._get = getter if len(self.sources) != 1 else lambda values: (getter(values),)
+        self._format = "".join(positional).format
+
+    def render(self, values):
+        """Returns the message for the dictionary of field ``values``."""
+        try:
+            arguments = self._get(values)
+        except KeyError as e:
+            raise AssertionError("Template {n} requires the field {f}.".format(n=self.name, f=e))
+        if self.transforms:
+            arguments = list(arguments)
+            for position, transform in self.transforms:
+                arguments[position] = transform(arguments[position])
+        return self._format(*arguments)
+
+
+class TemplateRegistry:
+    """Holds the compiled notification templates by name, starting with the built-in ones."""
+
+    def __init__(self):
+        self.templates = dict()
+        self._loaded = dict()
+        self.register(BUILTIN_TEMPLATES)
+
+    def register(self, definitions):
+        """Compile and add the template ``definitions``, a dictionary of definitions by template name."""
+        for name, definition in definitions.items():
+            self.templates[name] = CompiledTemplate(name, definition)
+
+    def load(self, path):
+        """Register the definitions in the JSON or YAML file ``path``. Files are only read again if they changed."""
+        modified = os.path.getmtime(path)
+        if self._loaded.get(path) == modified:
+            return
+        with open(path, encoding="utf-8") as f:
+            if path.lower().endswith((".yaml", ".yml")):
+                if yaml is None:
+                    raise AssertionError("The PyYAML package is required to load YAML templates. Install it with "
+                                         "`pip install pyyaml`, or use a JSON file.")
+                definitions = yaml.safe_load(f)
+            else:
+                definitions = json.load(f)
+        if not isinstance(definitions, dict):
+            raise AssertionError("The template file {} must contain a mapping of template names to definitions.".format(
+                path))
+        self.register(definitions)
+        self._loaded[path] = modified
+
+    def get(self, name):
+        try:
+            return self.templates[name]
+        except KeyError:
+            raise AssertionError("Unknown notification template {n}. Expected one of {t}.".format(
+                n=name, t=", ".join(sorted(self.templates))))
+
+
+registry = TemplateRegistry()
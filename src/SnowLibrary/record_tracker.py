@@ -0,0 +1,55 @@
+import threading
+
+from robot.libraries.BuiltIn import BuiltIn, RobotNotRunningError
+
+
+class RecordTracker:
+    """
+    Remembers the records created by RESTInsert, with the suite and test they were created in, so that they can be
+    deleted when the test or suite ends. One tracker is shared by every library instance in the process.
+    """
+
+    def __init__(self):
+        self._records = list()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _current_scope():
+        """Returns the names of the running suite and test, which are None outside of a Robot Framework run."""
+        try:
+            bi = BuiltIn()
+            return bi.get_variable_value("${SUITE NAME}"), bi.get_variable_value("${TEST NAME}")
+        except RobotNotRunningError:
+            return None, None
+
+    def track(self, table, sys_id):
+        """Remember that the record ``sys_id`` was created in ``table`` by the current test."""
+        suite, test = self._current_scope()
+        with self._lock:
+            self._records.append({"table": table, "sys_id": sys_id, "suite": suite, "test": test})
+
+    def created(self, scope="TEST"):
+        """
+        Returns the records created in the current TEST, the current SUITE (including its tests and child suites) or ALL
+        of them, in the order they were created.
+        """
+        scope = scope.upper()
+        if scope not in ("TEST", "SUITE", "ALL"):
+            raise AssertionError("Invalid scope {}. Expected TEST, SUITE or ALL.".format(scope))
+        suite, test = self._current_scope()
+        with self._lock:
+            if scope == "ALL":
+                return list(self._records)
+            elif scope == "SUITE":
+                return [r for r in self._records if r["suite"] == suite or
+                        (suite is not None and (r["suite"] or "").startswith(suite + "."))]
+            return [r for r in self._records if r["suite"] == suite and r["test"] == test]
+
+    def forget(self, records):
+        """Stop tracking ``records``, e.g. because they have been deleted."""
+        forgotten = {id(r) for r in records}
+        with self._lock:
+            self._records = [r for r in self._records if id(r) not in forgotten]
+
+
+tracker = RecordTracker()
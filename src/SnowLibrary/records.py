@@ -0,0 +1,115 @@
+from collections.abc import Mapping, Sequence
+
+_MISSING = object()
+
+
+class RecordView(Mapping):
+    """A read-only, dict-like view of a single row in a ColumnarRecords store."""
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, field):
+        value = self._store._columns[self._store._index[field]][self._row]
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+    def __iter__(self):
+        for field, column in zip(self._store._fields, self._store._columns):
+            if column[self._row] is not _MISSING:
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ColumnarRecords(Sequence):
+    """
+    Stores ServiceNow records column by column instead of as a list of dictionaries. Field names are kept once in a
+    shared index rather than once per record, and repeated values in a column (states, group sys_ids, reference
+    fields...) are interned so that every row holding the same value points at the same object. Rows are exposed as
+    read-only RecordView mappings, and the values of a single field can be sliced out with `column`.
+
+    Interned reference values (e.g. ``{'link': ..., 'value': ...}``) are shared between rows, so they must not be
+    modified in place.
+    """
+
+    def __init__(self, records=()):
+        self._fields = list()
+        self._index = dict()
+        self._columns = list()
+        self._interned = list()
+        self._length = 0
+        for record in records:
+            self.append(record)
+
+    def _intern(self, column, value):
+        """Returns the canonical object equal to ``value`` in ``column``, registering it if it is new."""
+        try:
+            if isinstance(value, dict):
+                key = tuple(sorted(value.items()))
+            else:
+                key = value
+            return self._interned[column].setdefault(key, value)
+        except TypeError:  # Unhashable values are stored as they are.
+            return value
+
+    def _add_field(self, field):
+        self._index[field] = len(self._fields)
+        self._fields.append(field)
+        self._columns.append([_MISSING] * self._length)
+        self._interned.append(dict())
+
+    def append(self, record):
+        """Add a record (a mapping of field names to values) as a new row."""
+        for field in record:
+            if field not in self._index:
+                self._add_field(field)
+        for column, field in enumerate(self._fields):
+            value = record.get(field, _MISSING)
+            if value is not _MISSING:
+                value = self._intern(column, value)
+            self._columns[column].append(value)
+        self._length += 1
+
+    def fields(self):
+        """Returns the list of field names present in any row."""
+        return list(self._fields)
+
+    def column(self, field):
+        """
+        Returns a list of the values of ``field`` in every row, which is empty if there are no rows. Raises KeyError if
+        a row does not have the field.
+        """
+        if self._length == 0:
+            return []
+        values = self._columns[self._index[field]]
+        if _MISSING in values:
+            raise KeyError(field)
+        return list(values)
+
+    def to_list(self):
+        """Returns the rows as a list of plain dictionaries."""
+        return [dict(view) for view in self]
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [RecordView(self, i) for i in range(*row.indices(self._length))]
+        if row < 0:
+            row += self._length
+        if not 0 <= row < self._length:
+            raise IndexError("record index out of range")
+        return RecordView(self, row)
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return "<{} [{} records, {} fields]>".format(self.__class__.__name__, self._length, len(self._fields))
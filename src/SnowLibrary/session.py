@@ -0,0 +1,391 @@
+import atexit
+import io
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+from requests.models import Response
+from requests.auth import HTTPBasicAuth
+from requests.exceptions import ConnectionError, Timeout
+from robot.api import logger
+
+from SnowLibrary.backoff import exponential_backoff
+from SnowLibrary.cassette import Cassette
+from SnowLibrary.exceptions import CircuitOpen
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket allowing ``rate`` requests per second on average, with bursts of up to ``burst``
+    requests. A rate of None means no limit. `pause` stops every caller until a given time, e.g. when ServiceNow
+    says the rate limit has been reached.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.configure(rate, burst)
+
+    def configure(self, rate=None, burst=None):
+        with self._lock:
+            self.rate = float(rate) if rate else None
+            self.burst = float(burst) if burst else max(1.0, self.rate or 1.0)
+            self._tokens = self.burst
+            self._updated = time.monotonic()
+
+    def pause(self, seconds):
+        """Make every caller of `acquire` wait ``seconds`` from now."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        """Wait until a request may be sent, and take a token for it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of requests in flight, and adjusts the limit with additive increase, multiplicative decrease:
+    each successful request raises the limit by 1 / limit (so by about one per round of requests), and each request
+    rejected for exceeding the rate limit halves it. Until it is ``enabled``, requests are only counted, not limited;
+    the first rejected request enables it, with half the number of requests that were in flight as the limit.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, enabled=True):
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.limit = min(max(float(initial), self.minimum), self.maximum)
+        self.enabled = enabled
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.enabled and self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled and not self.enabled:
+                self.enabled = True
+                self.limit = min(self.maximum, max(self.minimum, (self.in_flight + 1) / 2))
+            elif throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Stops requests to an instance after ``threshold`` consecutive failures (connection errors and gateway errors that
+    were not solved by retrying), so that tests fail at once with CircuitOpen instead of each waiting for its own
+    timeouts while the instance is down. After ``reset_timeout`` seconds, one request is let through to try the instance
+    again: if it succeeds requests resume, otherwise the circuit stays open for another ``reset_timeout``.
+    """
+
+    def __init__(self, host, threshold=5, reset_timeout=30.0):
+        self.host = host
+        self.threshold = int(threshold)
+        self.reset_timeout = float(reset_timeout)
+        self.failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_request(self):
+        """Raises CircuitOpen if requests to the instance are currently stopped."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpen("{h} failed {n} requests in a row, not sending requests to it for {s:.0f} seconds."
+                                  .format(h=self.host, n=self.failures, s=self.reset_timeout))
+            self._opened_at = time.monotonic()  # Let this request through, and keep the others out until it is done.
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+_breakers = dict()
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(host):
+    """Returns the CircuitBreaker shared by all requests to ``host``."""
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def _retry_after(response):
+    """Returns the number of seconds ServiceNow asks to wait before the next request, or None if it does not say."""
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    if response.headers.get("X-RateLimit-Remaining") == "0" and response.headers.get("X-RateLimit-Reset"):
+        try:
+            return max(0.0, float(response.headers["X-RateLimit-Reset"]) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+class _Flight:
+    """A GET request in flight, which identical requests sent meanwhile wait for instead of sending their own."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.response = None
+        self.content = None
+        self.error = None
+
+    def share(self, request):
+        """Returns a copy of the leader's response for the identical ``request``."""
+        leader = self.response
+        response = Response()
+        response.status_code = leader.status_code
+        response.reason = leader.reason
+        response.headers = leader.headers.copy()
+        response.encoding = leader.encoding
+        response.url = leader.url
+        response.elapsed = leader.elapsed
+        response.raw = io.BytesIO(self.content)
+        response.request = request
+        return response
+
+
+def _flight_key(request):
+    """Identifies a GET request by its URL, with its query parameters in a normal order."""
+    url = urlparse(request.url)
+    return url.netloc, url.path, tuple(sorted(parse_qsl(url.query, keep_blank_values=True)))
+
+
+class SnowSession(requests.Session):
+    """
+    A requests session to a ServiceNow instance, shared by every RESTQuery and RESTInsert using the same instance and
+    user in the process (see `get_session`), so that they reuse connections and respect the same rate limit.
+
+    Idempotent requests (everything but POST and PATCH) failing with a connection error, a timeout or a gateway error
+    (502, 503 or 504) are retried up to ``retries`` times, after an exponential backoff with jitter starting at
+    ``retry_initial`` seconds and growing up to ``retry_max`` seconds. Failures that retrying did not solve count
+    towards the instance's CircuitBreaker, and no request is sent while it is open.
+
+    Requests wait for a token from the session's TokenBucket and for a slot from its AdaptiveConcurrency, which only
+    limits the number of requests in flight once a ``rate`` is set or ServiceNow has rejected a request, so sessions
+    without a rate limit are not capped. Responses with status 429 (Too Many Requests) pause every request for the time
+    given by their ``Retry-After`` or ``X-RateLimit-Reset`` header (or an exponential backoff if there is none), halve
+    the concurrency, and are retried up to ``max_retries`` times. A response saying no requests remain
+    (``X-RateLimit-Remaining: 0``) pauses requests until the limit resets.
+
+    Identical GET requests sent while one is in flight (e.g. the same lookup from several threads) are coalesced: only
+    the first is sent, and the others wait for it and get a copy of its response. ``coalesced`` counts them. The first
+    response is only read into memory if other requests are waiting for it, so single requests still stream.
+
+    With a ``cassette`` (see `use_cassette`), responses are recorded, or replayed without sending the request.
+    """
+
+    RETRY_STATUSES = (502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+    def __init__(self, rate=None, burst=None, max_retries=5, retries=3, retry_initial=0.5, retry_max=8.0):
+        super().__init__()
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(enabled=self.rate_limiter.rate is not None)
+        self.max_retries = max_retries
+        self.retries = retries
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.coalesce = True
+        self.coalesced = 0
+        self._flights = dict()
+        self._flights_lock = threading.Lock()
+        self.cassette = _cassette
+
+    def send(self, request, **kwargs):
+        cassette = self.cassette
+        if cassette is None:
+            return self._send_coalesced(request, **kwargs)
+        if not cassette.recording:
+            response = cassette.play(request)
+            if response is not None:
+                return response
+            return self._send_coalesced(request, **kwargs)
+        response = self._send_coalesced(request, **kwargs)
+        content = response.content
+        cassette.record(request, response, content)
+        response.raw = io.BytesIO(content)
+        return response
+
+    def _send_coalesced(self, request, **kwargs):
+        if request.method != "GET" or not self.coalesce:
+            return self._send_with_retries(request, **kwargs)
+        key = _flight_key(request)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.share(request)
+        try:
+            response = self._send_with_retries(request, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]  # Identical requests sent from now on get a new response.
+                followers = flight.followers
+            if followers == 0 or flight.error is not None:
+                flight.done.set()
+        if followers == 0:
+            return response
+        try:
+            flight.content = response.content
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            flight.response = response
+            flight.done.set()
+        response.raw = io.BytesIO(flight.content)
+        return response
+
+    def _send_with_retries(self, request, **kwargs):
+        breaker = get_circuit_breaker(urlparse(request.url).netloc)
+        repeatable = not hasattr(request.body, "read")  # A streamed body cannot be sent again.
+        retryable = repeatable and request.method in self.IDEMPOTENT_METHODS
+        throttles, failures = 0, 0
+        rate_delays, failure_delays = None, None
+        while True:
+            breaker.before_request()
+            self.rate_limiter.acquire()
+            self.concurrency.acquire()
+            throttled = False
+            try:
+                response = super().send(request, **kwargs)
+                throttled = response.status_code == 429
+            except (ConnectionError, Timeout) as e:
+                if not retryable or failures == self.retries:
+                    breaker.record_failure()
+                    raise
+                failures += 1
+                failure_delays = failure_delays or exponential_backoff(self.retry_initial, self.retry_max)
+                wait = next(failure_delays)
+                logger.info("{e} Retrying in {s:.1f} seconds.".format(e=e, s=wait))
+                time.sleep(wait)
+                continue
+            finally:
+                self.concurrency.release(throttled)
+            if response.status_code in self.RETRY_STATUSES:
+                if not retryable or failures == self.retries:
+                    breaker.record_failure()
+                    return response
+                failures += 1
+                failure_delays = failure_delays or exponential_backoff(self.retry_initial, self.retry_max)
+                wait = next(failure_delays)
+                logger.info("ServiceNow returned {c}, retrying in {s:.1f} seconds.".format(c=response.status_code,
+                                                                                        s=wait))
+                response.close()
+                time.sleep(wait)
+                continue
+            breaker.record_success()
+            wait = _retry_after(response)
+            if not throttled:
+                if wait:
+                    self.rate_limiter.pause(wait)
+                return response
+            if throttles == self.max_retries or not repeatable:
+                return response
+            throttles += 1
+            if wait is None:
+                rate_delays = rate_delays or exponential_backoff()
+                wait = next(rate_delays)
+            logger.info("Rate limited by ServiceNow, retrying in {s:.1f} seconds.".format(s=wait))
+            response.close()
+            self.rate_limiter.pause(wait)
+
+
+_sessions = dict()
+_sessions_lock = threading.Lock()
+_cassette = None
+
+
+def use_cassette(cassette):
+    """
+    Records or replays the requests of every SnowSession, existing or new, with ``cassette``, or stops if it is None.
+    A recording cassette is saved when it is replaced, or when the process exits.
+    """
+    global _cassette
+    with _sessions_lock:
+        if _cassette is not None and _cassette.recording:
+            atexit.unregister(_cassette.save)
+            _cassette.save()
+        _cassette = cassette
+        if cassette is not None and cassette.recording:
+            atexit.register(cassette.save)
+        for session in _sessions.values():
+            session.cassette = cassette
+
+
+def get_session(instance, user, password):
+    """
+    Returns the SnowSession for ``user`` on ``instance``, creating it on first use. The rate limit of new sessions is
+    read from the ``SNOW_RATE_LIMIT`` environment variable, in requests per second. There is no limit by default.
+
+    If the ``SNOW_CASSETTE`` environment variable gives the path to a cassette, the first session starts using it in
+    the mode given by ``SNOW_CASSETTE_MODE`` (RECORD, REPLAY or STRICT, REPLAY by default).
+    """
+    if _cassette is None and not _sessions and os.environ.get("SNOW_CASSETTE"):
+        use_cassette(Cassette(os.environ["SNOW_CASSETTE"], os.environ.get("SNOW_CASSETTE_MODE") or "REPLAY"))
+    with _sessions_lock:
+        session = _sessions.get((instance, user))
+        if session is None:
+            session = SnowSession(rate=os.environ.get("SNOW_RATE_LIMIT") or None)
+            _sessions[(instance, user)] = session
+        session.auth = HTTPBasicAuth(user, password)
+        return session
@@ -0,0 +1,163 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from robot.api import logger
+
+
+class SharedCache:
+    """
+    A small key/value cache backed by a local SQLite file, so that lookups fetched by one process (e.g. a pabot worker)
+    can be reused by every other process pointed at the same file. SQLite handles the file locking between processes.
+    Entries expire after ``ttl`` seconds and the cache is bounded to ``max_entries``, evicting the least recently used
+    entries first. Hit and miss counts are kept per worker in memory, and added to the totals stored alongside the
+    entries every ``flush_interval`` seconds, when the statistics are read and when the process exits, so that lookups
+    never write to the file just to be counted.
+    """
+
+    def __init__(self, path, ttl=300, max_entries=10000, worker=None, flush_interval=30):
+        """
+        :param path: The location of the SQLite file shared by all processes. It is created if it does not exist.
+        :param ttl: The number of seconds an entry is considered fresh.
+        :param max_entries: The maximum number of entries kept in the cache.
+        :param worker: A name for this process in the statistics. Defaults to the pabot pool id or the process id.
+        :param flush_interval: The number of seconds between writes of the hit and miss counts to the file.
+        """
+        self.path = path
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        if worker is None:
+            worker = os.environ.get("PABOTEXECUTIONPOOLID") or os.environ.get("PABOTQUEUEINDEX") or str(os.getpid())
+        self.worker = str(worker)
+        self.flush_interval = float(flush_interval)
+        self.hits = 0
+        self.misses = 0
+        self._unflushed_hits = 0
+        self._unflushed_misses = 0
+        self._flushed = time.monotonic()
+        self._counting_pid = os.getpid()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        """Returns a connection to the cache file for this process, creating the schema on first use."""
+        if self._connection is None or self._pid != os.getpid():  # Never reuse a connection across a fork.
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                                     "expires REAL NOT NULL, accessed REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS stats (worker TEXT PRIMARY KEY, "
+                                     "hits INTEGER NOT NULL, misses INTEGER NOT NULL)")
+            self._pid = os.getpid()
+        return self._connection
+
+    def _record(self, hit):
+        """Count a hit or a miss for this worker in memory, flushing the counts if they have not been for a while."""
+        if self._counting_pid != os.getpid():  # A forked process only flushes its own counts.
+            self._unflushed_hits = self._unflushed_misses = 0
+            self._counting_pid = os.getpid()
+        if hit:
+            self.hits += 1
+            self._unflushed_hits += 1
+        else:
+            self.misses += 1
+            self._unflushed_misses += 1
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self._flush()
+
+    def _flush(self):
+        """Add the counts not yet flushed to this worker's totals in the shared file. The caller must hold the lock."""
+        self._flushed = time.monotonic()
+        if self._counting_pid != os.getpid() or not (self._unflushed_hits or self._unflushed_misses):
+            return
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("INSERT OR IGNORE INTO stats (worker, hits, misses) VALUES (?, 0, 0)", (self.worker,))
+            connection.execute("UPDATE stats SET hits = hits + ?, misses = misses + ? WHERE worker = ?",
+                               (self._unflushed_hits, self._unflushed_misses, self.worker))
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+        self._unflushed_hits = self._unflushed_misses = 0
+
+    def flush(self):
+        """Add the hit and miss counts not yet flushed to this worker's totals in the shared file."""
+        with self._lock:
+            self._flush()
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key``, or ``default`` if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                self._record(hit=False)
+                return default
+            connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._record(hit=True)
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Store the JSON serializable ``value`` under ``key`` and evict stale or surplus entries."""
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else float(ttl))
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                                   (key, json.dumps(value), expires, now))
+                connection.execute("DELETE FROM entries WHERE expires < ?", (now,))
+                connection.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed DESC "
+                                   "LIMIT -1 OFFSET ?)", (self.max_entries,))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        """Remove every entry from the cache. Statistics are kept."""
+        with self._lock:
+            self._connect().execute("DELETE FROM entries")
+
+    def statistics(self):
+        """Returns a dictionary with this worker's hits and misses, the number of entries, and every worker's stats."""
+        with self._lock:
+            self._flush()
+            connection = self._connect()
+            entries = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            workers = {w: {"hits": h, "misses": m} for w, h, m in
+                       connection.execute("SELECT worker, hits, misses FROM stats")}
+        return {"worker": self.worker, "hits": self.hits, "misses": self.misses, "entries": entries,
+                "workers": workers}
+
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+def get_shared_cache(path, ttl=300, max_entries=10000):
+    """
+    Returns the process wide SharedCache for ``path``, so that statistics accumulate across library instances. The
+    ``ttl`` and ``max_entries`` of an existing cache are updated to the given values.
+    """
+    path = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = SharedCache(path, ttl, max_entries)
+            _caches[path] = cache
+            atexit.register(cache.flush)
+            logger.debug("Using shared cache file {} for worker {}.".format(path, cache.worker))
+        else:
+            cache.ttl = float(ttl)
+            cache.max_entries = int(max_entries)
+    return cache
@@ -0,0 +1,109 @@
+import csv
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it.
+    orjson = None
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl is optional, and only needed for XLSX files.
+    openpyxl = None
+
+
+class _Lines(list):
+    """A list that csv.writer can write to, so that each row is collected as one line of text."""
+    write = list.append
+
+
+class DelimitedWriter:
+    """Renders rows as delimited text with the csv module, e.g. comma separated values."""
+
+    def __init__(self, fields, delimiter=","):
+        self.delimiter = delimiter
+
+    def render(self, rows):
+        """Returns a list of lines of text, each with its line terminator, for ``rows``."""
+        lines = _Lines()
+        csv.writer(lines, delimiter=self.delimiter, quoting=csv.QUOTE_MINIMAL).writerows(rows)
+        return lines
+
+    def render_header(self, headers):
+        """Returns the lines of text for the header row."""
+        return self.render([headers])
+
+    def parse(self, line):
+        """Returns the list of values in a line of text, without its line terminator."""
+        return next(csv.reader([line], delimiter=self.delimiter))
+
+
+class FixedWidthWriter:
+    """
+    Renders rows as fixed width text. Each value is left aligned, padded with spaces and truncated to the width of its
+    column, which is worked out once from the field definitions. Every line is then produced by a single call of one
+    precompiled format string.
+    """
+
+    def __init__(self, fields, delimiter=None):
+        self.widths = [f.get_width() for f in fields]
+        self._line = "".join("{{!s:<{w}.{w}}}".format(w=w) for w in self.widths) + "\n"
+
+    def render(self, rows):
+        line = self._line.format
+        return [line(*row) for row in rows]
+
+    def render_header(self, headers):
+        return self.render([headers])
+
+    def parse(self, line):
+        values, start = list(), 0
+        for width in self.widths:
+            values.append(line[start:start + width].rstrip(" "))
+            start += width
+        return values
+
+
+class JSONLinesWriter:
+    """Renders rows as JSON Lines, one object keyed by the field headers per line. Uses orjson if it is installed."""
+
+    def __init__(self, fields, delimiter=None):
+        self.headers = [f.header for f in fields]
+        if orjson is not None:
+            dumps = orjson.dumps
+            self._encode = lambda record: dumps(record).decode("utf-8")
+        else:
+            self._encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def render(self, rows):
+        headers, encode = self.headers, self._encode
+        return [encode(dict(zip(headers, row))) + "\n" for row in rows]
+
+    def render_header(self, headers):
+        """JSON Lines files do not have a header row, the headers are the keys of every object."""
+        return []
+
+    def parse(self, line):
+        return json.loads(line)
+
+
+class XLSXWriter:
+    """Writes rows to Excel workbooks with openpyxl in write-only mode, which streams rows to the file."""
+
+    def __init__(self, fields, delimiter=None):
+        if openpyxl is None:
+            raise AssertionError("The openpyxl package is required to create XLSX files. Install it with "
+                                 "`pip install openpyxl`.")
+
+    def write(self, path, rows, headers=None):
+        """Write a new workbook at ``path`` with the ``headers`` row, if any, followed by the rows in ``rows``."""
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        if headers is not None:
+            sheet.append(headers)
+        for row in rows:
+            sheet.append(row)
+        workbook.save(path)
+
+
+WRITERS = {"CSV": DelimitedWriter, "FIXED_WIDTH": FixedWidthWriter, "JSONL": JSONLinesWriter, "XLSX": XLSXWriter}
@@ -0,0 +1,112 @@
+import base64
+import io
+import json
+import uuid
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+from SnowLibrary import session
+
+
+class FakeTableAPI(BaseAdapter):
+    """A requests transport adapter standing in for the ServiceNow Table API, so REST keywords run without a network."""
+
+    def __init__(self):
+        super().__init__()
+        self.tables = dict()
+        self.attachments = dict()
+        self.requests = list()
+        self.total_count = True
+
+    def _respond(self, request, status_code, content, headers=None):
+        response = Response()
+        response.status_code = status_code
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"}, **(headers or {}))
+        response.raw = io.BytesIO(json.dumps(content).encode("utf-8"))
+        response.request = request
+        response.url = request.url
+        return response
+
+    def _batch(self, request):
+        """Applies the DELETE and PATCH requests of a batch API call to the tables."""
+        served = list()
+        for rest_request in json.loads(request.body)["rest_requests"]:
+            table, sys_id = rest_request["url"].split("/")[-2:]
+            records = self.tables.get(table, [])
+            matches = [r for r in records if r["sys_id"] == sys_id]
+            if not matches:
+                status = 404
+            elif rest_request["method"] == "DELETE":
+                records.remove(matches[0])
+                status = 204
+            else:
+                matches[0].update(json.loads(base64.b64decode(rest_request["body"])))
+                status = 200
+            served.append({"id": rest_request["id"], "status_code": status})
+        return {"serviced_requests": served, "unserviced_requests": []}
+
+    def _attachment(self, request, url):
+        """Stores an uploaded attachment, read in chunks like a connection would, or returns a stored one."""
+        if request.method == "POST":
+            content = b"".join(iter(lambda: request.body.read(65536), b""))
+            sys_id = uuid.uuid4().hex
+            self.attachments[sys_id] = content
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            return self._respond(request, 201, {"result": {"sys_id": sys_id, "file_name": params["file_name"],
+                                                           "size_bytes": str(len(content))}})
+        sys_id = url.path.split("/")[-2]
+        if sys_id not in self.attachments:
+            return self._respond(request, 404, {"error": {"message": "Record doesn't exist"}})
+        response = self._respond(request, 200, None, {"Content-Type": "application/octet-stream",
+                                                      "Content-Length": str(len(self.attachments[sys_id]))})
+        response.raw = io.BytesIO(self.attachments[sys_id])
+        return response
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        url = urlparse(request.url)
+        if "/attachment/" in url.path:
+            return self._attachment(request, url)
+        if request.method == "POST" and url.path.endswith("/batch"):
+            return self._respond(request, 200, self._batch(request))
+        if request.method == "POST":
+            record = dict(json.loads(request.body), sys_id=uuid.uuid4().hex)
+            self.tables.setdefault(url.path.rstrip("/").split("/")[-1], []).append(record)
+            return self._respond(request, 201, {"result": record})
+        params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        table = url.path.rstrip("/").split("/")[-1]
+        records = self.tables.get(table, [])
+        offset = int(params.get("sysparm_offset") or 0)
+        limit = int(params.get("sysparm_limit") or 10000)
+        page = records[offset:offset + limit]
+        fields = params.get("sysparm_fields")
+        if fields:
+            page = [{f: r.get(f, "") for f in fields.split(",")} for r in page]
+        headers = {"X-Total-Count": str(len(records))} if self.total_count else {}
+        return self._respond(request, 200, {"result": page}, headers)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def new_sessions(monkeypatch):
+    """
+    Start every test with new shared sessions and circuit breakers and without a cassette, so that transport adapters
+    mounted, failures seen and requests recorded by other tests do not carry over.
+    """
+    session._sessions.clear()
+    session._breakers.clear()
+    monkeypatch.setattr(session, "_cassette", None)
+    yield
+    session._sessions.clear()
+    session._breakers.clear()
+
+
+@pytest.fixture
+def fake_table_api():
+    return FakeTableAPI()
@@ -1,10 +1,15 @@
+import json
 import os
 import string
 import re
+from datetime import datetime
 
 import pytest
 
+from SnowLibrary import writers
+from SnowLibrary.keywords import file_creator
 from SnowLibrary.keywords.file_creator import DataFile, DataRow, DataField
+from SnowLibrary.keywords.rest_api import RESTQuery
 
 
 class TestDataFile:
@@ -80,6 +85,213 @@ class TestDataFile:
             f.append_detail_rows()
         assert "The number of detail rows has not been defined. Use the `Number Of Detail Rows Is` keyword first." in str(e)
 
+    def test_append_detail_rows_in_batches(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.csv"))
+        f.BATCH_SIZE = 3
+        f.define_data_field("integer", "ID", min_length=4, max_length=4, sequence=True)
+        f.number_of_detail_rows_is(7)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        with open(f.absolute_name) as data:
+            assert data.read().splitlines() == ["ID"] + ["{:04d}".format(i) for i in range(1, 8)]
+
+    def test_fixed_width_output(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.txt"))
+        f.define_output_format("fixed_width")
+        f.define_data_field("integer", "ID", min_length=4, max_length=4, sequence=True)
+        f.define_data_field("string", "STATUS", options="OPEN, CLOSED")
+        f.define_data_field("string", "CODE", regexp="[A-Z]{3}", width=2)
+        f.number_of_detail_rows_is(3)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        with open(f.absolute_name) as data:
+            lines = data.read().splitlines()
+        assert lines[0] == "ID  STATUSCO"
+        assert [line[:4] for line in lines[1:]] == ["0001", "0002", "0003"]
+        assert all(len(line) == 12 and line[4:10].strip() in ("OPEN", "CLOSED") for line in lines[1:])
+
+    def test_fixed_width_needs_width_of_regexp_field(self):
+        f = DataFile("/rows.txt")
+        f.define_output_format("FIXED_WIDTH")
+        f.define_data_field("string", "CODE", regexp="[A-Z]{3}")
+        with pytest.raises(AssertionError) as e:
+            f._get_writer()
+        assert "The width of CODE cannot be worked out from its definition" in str(e)
+
+    def test_jsonl_output(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.jsonl"))
+        f.define_output_format("JSONL")
+        f.define_data_field("integer", "ID", min_length=2, max_length=2, sequence=True)
+        f.define_data_field("string", "STATUS", options="OPEN")
+        f.number_of_detail_rows_is(2)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        with open(f.absolute_name) as data:
+            assert [json.loads(line) for line in data] == [{"ID": "01", "STATUS": "OPEN"}, {"ID": "02", "STATUS": "OPEN"}]
+
+    def test_invalid_output_format(self):
+        with pytest.raises(AssertionError) as e:
+            DataFile().define_output_format("XML")
+        assert "Invalid output format.  Output format must be CSV, FIXED_WIDTH, JSONL or XLSX." in str(e)
+
+    def test_xlsx_needs_openpyxl(self, monkeypatch):
+        monkeypatch.setattr(writers, "openpyxl", None)
+        f = DataFile("/rows.xlsx")
+        f.define_output_format("XLSX")
+        f.define_data_field("string", "STATUS", options="OPEN")
+        with pytest.raises(AssertionError) as e:
+            f._get_writer()
+        assert "The openpyxl package is required to create XLSX files." in str(e)
+
+    def test_split_by_rows(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.csv"))
+        f.define_file_split(max_rows=3)
+        f.define_data_field("integer", "ID", min_length=2, max_length=2, sequence=True)
+        f.number_of_detail_rows_is(4)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        f.append_detail_rows()
+        names = f.get_data_file_names()
+        assert names == [str(tmp_path / "rows_00{}.csv".format(i)) for i in (1, 2, 3)]
+        contents = [open(name).read().splitlines() for name in names]
+        assert contents == [["ID", "01", "02", "03"], ["ID", "04", "05", "06"], ["ID", "07", "08"]]
+        assert not os.path.exists(f.absolute_name)
+        f.file_should_contain_rows(11)
+        f.remove_data_file()
+        assert not any(os.path.exists(name) for name in names)
+
+    def test_split_file_created_twice(self, tmp_path):
+        for _ in range(2):  # E.g. the same test in two runs.
+            f = DataFile(str(tmp_path / "rows.csv"))
+            f.define_file_split(max_rows=10)
+            f.define_data_field("integer", "ID", min_length=2, max_length=2, sequence=True)
+            f.number_of_detail_rows_is(15)
+            f.create_data_file()
+            f.append_header_row()
+            f.append_detail_rows()
+        assert [len(open(name).read().splitlines()) for name in f.get_data_file_names()] == [11, 6]
+        f.file_should_contain_rows(17)
+        DataFile(str(tmp_path / "rows.csv")).remove_data_file()
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_xlsx_output(self, tmp_path):
+        openpyxl = pytest.importorskip("openpyxl")
+        f = DataFile(str(tmp_path / "rows.xlsx"))
+        f.define_output_format("XLSX")
+        f.define_file_split(max_rows=2)
+        f.define_data_field("integer", "ID", min_length=2, max_length=2, sequence=True)
+        f.define_data_field("string", "STATUS", options="OPEN")
+        f.number_of_detail_rows_is(3)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        names = f.get_data_file_names()
+        assert names == [str(tmp_path / "rows_001.xlsx"), str(tmp_path / "rows_002.xlsx")]
+        rows = [list(openpyxl.load_workbook(name).active.iter_rows(values_only=True)) for name in names]
+        assert rows == [[("ID", "STATUS"), ("01", "OPEN"), ("02", "OPEN")], [("ID", "STATUS"), ("03", "OPEN")]]
+        with pytest.raises(AssertionError) as e:
+            f.append_detail_rows()
+        assert "The detail rows of XLSX files can only be appended once." in str(e)
+
+    def test_split_by_bytes(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.csv"))
+        f.define_file_split(max_bytes=10)
+        f.define_data_field("integer", "ID", min_length=2, max_length=2, sequence=True)
+        f.number_of_detail_rows_is(7)
+        f.create_data_file()
+        f.append_detail_rows()
+        sizes = [os.path.getsize(name) for name in f.get_data_file_names()]
+        assert sizes == [8, 8, 8, 4]  # Two digits and CRLF per row.
+
+    def test_invalid_file_split(self):
+        with pytest.raises(AssertionError) as e:
+            DataFile().define_file_split()
+        assert "Either max_rows or max_bytes must be provided to split the file." in str(e)
+        with pytest.raises(AssertionError) as e:
+            DataFile().define_file_split(max_rows=0)
+        assert "The maximum number of rows and bytes per file must be positive integers." in str(e)
+
+    def test_append_more_detail_rows(self, tmp_path):
+        name = str(tmp_path / "rows.csv")
+        f = DataFile(name)
+        f.define_data_field("integer", "ID", min_length=4, max_length=4, sequence=True)
+        f.number_of_detail_rows_is(2)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        later = DataFile(name)  # E.g. in a later test, the file already exists.
+        later.define_data_field("integer", "ID", min_length=4, max_length=4, sequence=True)
+        later.append_more_detail_rows(3)
+        with open(name) as data:
+            assert data.read().splitlines() == ["ID", "0001", "0002", "0003", "0004", "0005"]
+        later.file_should_contain_rows(6)
+
+    def test_append_more_detail_rows_keeps_unique_values(self, tmp_path):
+        name = str(tmp_path / "rows.csv")
+        DataFile(name).create_data_file()
+        for _ in range(3):  # E.g. one instance per test of a soak test.
+            f = DataFile(name)
+            f.define_data_field("integer", "ID", min_length=2, max_length=2, unique=True)
+            f.append_more_detail_rows(30)
+        with open(name) as data:
+            assert sorted(data.read().splitlines()) == [str(i) for i in range(10, 100)]
+        f.remove_data_file()
+        assert not os.path.exists(name + ".state")
+
+    def test_append_more_detail_rows_no_data_file(self, tmp_path):
+        f = DataFile(str(tmp_path / "missing.csv"))
+        with pytest.raises(AssertionError) as e:
+            f.append_more_detail_rows(1)
+        assert "The data file has not been created." in str(e)
+
+    def test_get_data_file_rows(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.csv"))
+        f.INDEX_STRIDE = 4
+        f.define_data_field("integer", "ID", min_length=3, max_length=3, sequence=True)
+        f.define_data_field("string", "STATUS", options="OPEN")
+        f.number_of_detail_rows_is(10)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        assert f.get_data_file_row(1) == ["ID", "STATUS"]
+        assert f.get_data_file_row(11) == ["010", "OPEN"]
+        assert os.path.exists(f.absolute_name + ".idx")
+        f.append_more_detail_rows(5)
+        assert f.get_data_file_row(16) == ["015", "OPEN"]
+        with pytest.raises(AssertionError) as e:
+            f.get_data_file_row(17)
+        assert "Row 17 is out of range, the file has 16 rows." in str(e)
+        sample = f.get_random_data_file_rows(15, skip_header_row=True)
+        assert sample == [["{:03d}".format(i), "OPEN"] for i in range(1, 16)]
+        assert len(f.get_random_data_file_rows(3)) == 3
+
+    def test_data_files_are_utf8(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.csv"))
+        f.define_data_field("string", "CITY", options="Zürich")
+        f.number_of_detail_rows_is(1)
+        f.create_data_file()
+        f.append_header_row()
+        f.append_detail_rows()
+        f.append_more_detail_rows(1)
+        with open(f.absolute_name, "rb") as data:
+            assert data.read().splitlines() == [b"CITY", "Zürich".encode("utf-8"), "Zürich".encode("utf-8")]
+        assert f.get_data_file_row(3) == ["Zürich"]
+
+    def test_get_fixed_width_data_file_row(self, tmp_path):
+        f = DataFile(str(tmp_path / "rows.txt"))
+        f.define_output_format("FIXED_WIDTH")
+        f.define_data_field("integer", "ID", min_length=3, max_length=3, sequence=True)
+        f.define_data_field("string", "STATUS", options="OPEN, CLOSED")
+        f.number_of_detail_rows_is(3)
+        f.create_data_file()
+        f.append_detail_rows()
+        row = f.get_data_file_row(2)
+        assert row[0] == "002" and row[1] in ("OPEN", "CLOSED")
+
 
 class TestDataRow:
     # Create a test field for each major type of data for testing.
@@ -122,6 +334,14 @@ class TestDataRow:
             assert f.header not in detail_row
         assert isinstance(detail_row, list)
 
+    def test_create_detail_rows(self):
+        row = DataRow()
+        for field in self.test_fields:
+            row.add_data_field(field)
+        detail_rows = row.create_detail_rows(10)
+        assert len(detail_rows) == 10
+        assert all(len(r) == 5 for r in detail_rows)
+
     def test_data_row_has_no_fields(self):
         """Don't create a row if no fields have been specified. Raise an AssertionError."""
         row = DataRow()
@@ -137,8 +357,8 @@ class TestDataField:
     def test_invalid_data_type(self):
         with pytest.raises(AssertionError) as e:
             f = DataField("test_no_data", "test_field_name")
-        assert "Invalid data type specified.  Expected either integer, string, or boolean, but `test_no_data` was " \
-               "provided." in str(e)
+        assert "Invalid data type specified.  Expected one of integer, string, boolean, date, datetime, decimal, " \
+               "sys_id or email, but `test_no_data` was provided." in str(e)
 
     def test_invalid_characters(self):
         with pytest.raises(AssertionError) as e:
@@ -212,3 +432,142 @@ class TestDataField:
         assert isinstance(str_data, str)
         assert 10 <= len(str_data) <= 12
         assert str_data.index("Michael") == 0
+
+    def test_get_source_data_fetches_values_once(self, monkeypatch):
+        fetched = list()
+
+        def fake_paginate(self, query, fields=None, page_size=1000, table=None):
+            fetched.append((self.query_table, query, fields))
+            return iter([{"user_name": "abel"}, {"user_name": "beth"}, {"user_name": ""},
+                         {"user_name": {"link": "https://x", "value": "carl"}}])
+        monkeypatch.setattr(RESTQuery, "_paginate", fake_paginate)
+        monkeypatch.setattr(file_creator, "_source_values", dict())
+        field = DataField("STRING", "USER", source_table="sys_user", source_field="user_name",
+                          source_query="active=true", replacement=False)
+        values = sorted(field.get_data() for _ in range(3))
+        assert values == ["abel", "beth", "carl"]
+        with pytest.raises(AssertionError) as e:
+            field.get_data()
+        assert "Every value of user_name in sys_user has already been used for USER." in str(e)
+        other = DataField("STRING", "USER", source_table="sys_user", source_field="user_name",
+                          source_query="active=true")
+        assert other.get_data() in ["abel", "beth", "carl"]
+        assert fetched == [("sys_user", "active=true", ["user_name"])]
+
+    def test_unique_values_are_never_repeated(self):
+        field = DataField("INTEGER", "ID", min_length=3, max_length=3, unique=True)
+        values = field.get_data_batch(899) + [field.get_data()]
+        assert len(set(values)) == 900
+        assert all(len(v) == 3 and v[0] != "0" for v in values)
+        with pytest.raises(AssertionError) as e:
+            field.get_data()
+        assert "Only 900 unique values of 3 digits exist for ID." in str(e)
+
+    def test_unique_values_with_starts_with(self):
+        field = DataField("STRING", "NUMBER", starts_with="TKT", min_length=5, max_length=5, characters="digits",
+                          unique="True")
+        values = field.get_data_batch(100)
+        assert sorted(values) == ["TKT{:02d}".format(i) for i in range(100)]
+
+    def test_unique_requires_digits(self):
+        with pytest.raises(AssertionError) as e:
+            DataField("STRING", "NAME", unique=True)
+        assert "Unique and sequence values are only supported for integer fields or digit characters." in str(e)
+
+    def test_sequence_values(self):
+        field = DataField("INTEGER", "LINE", starts_with="9", min_length=4, max_length=4, sequence=True,
+                          sequence_start=8, sequence_step=2)
+        assert field.get_data_batch(2) + [field.get_data()] == ["9008", "9010", "9012"]
+
+    def test_sequence_overflow(self):
+        field = DataField("INTEGER", "LINE", min_length=1, max_length=1, sequence=True, sequence_start=9)
+        field.get_data()
+        with pytest.raises(AssertionError) as e:
+            field.get_data()
+        assert "The sequence for LINE exceeded 1 digits." in str(e)
+
+    def test_get_date_data(self):
+        field = DataField("date", "DUE", min_value="2018-02-27", max_value="2018-03-01")
+        values = set(field.get_data_batch(200))
+        assert values == {"2018-02-27", "2018-02-28", "2018-03-01"}
+
+    def test_get_datetime_data(self):
+        field = DataField("DATETIME", "OPENED", min_value="2018-08-08 14:40:48", max_value="2018-08-08 14:40:50")
+        assert field.get_data() in ["2018-08-08 14:40:48", "2018-08-08 14:40:49", "2018-08-08 14:40:50"]
+        for value in field.get_data_batch(100):
+            datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+    def test_invalid_date_range(self):
+        with pytest.raises(AssertionError) as e:
+            DataField("date", "DUE", min_value="03/01/2018")
+        assert "Invalid range for a date field, values must be in the format YYYY-MM-DD." in str(e)
+        with pytest.raises(AssertionError) as e:
+            DataField("date", "DUE", min_value="2018-03-02", max_value="2018-03-01")
+        assert "The minimum value of DUE is greater than its maximum value." in str(e)
+
+    def test_get_decimal_data(self):
+        field = DataField("decimal", "COST", min_value="-1.5", max_value="2.25", precision=4, scale=2)
+        for value in field.get_data_batch(500):
+            assert re.match(r"^-?\d\.\d\d$", value)
+            assert -1.5 <= float(value) <= 2.25
+        with pytest.raises(AssertionError) as e:
+            DataField("decimal", "COST", max_value="1000", precision=4, scale=2)
+        assert "The range of the decimal field does not fit its precision and scale." in str(e)
+
+    def test_get_sys_id_data(self):
+        values = DataField("sys_id", "SYS_ID").get_data_batch(100)
+        assert all(re.match("^[0-9a-f]{32}$", v) for v in values)
+        assert len(set(values)) == 100
+
+    def test_get_email_data(self):
+        field = DataField("email", "EMAIL", min_length=5, max_length=8, domain="ice.com")
+        for value in field.get_data_batch(100):
+            assert re.match("^[a-z0-9]{5,8}@ice\\.com$", value)
+        assert field.get_width() == 16
+        assert DataField("email", "EMAIL", max_length=100, domain="ice.com").get_width() == 72
+        with pytest.raises(AssertionError) as e:
+            DataField("email", "EMAIL", min_length=70, max_length=100, domain="ice.com")
+        assert "The part of an email address before the @ is at most 64 characters, but the minimum length of EMAIL " \
+               "is 70." in str(e)
+
+    def test_weighted_options(self):
+        field = DataField("string", "STATUS", options="APPROVED, REJECTED, WITHDRAWN", weights="70, 30, 0")
+        values = field.get_data_batch(10000) + [field.get_data() for _ in range(1000)]
+        assert "WITHDRAWN" not in values
+        assert 0.65 < values.count("APPROVED") / len(values) < 0.75
+
+    def test_invalid_weights(self):
+        with pytest.raises(AssertionError) as e:
+            DataField("string", "STATUS", options="A, B", weights="1")
+        assert "Expected 2 weights, one for each option, but got 1." in str(e)
+        with pytest.raises(AssertionError) as e:
+            DataField("string", "STATUS", options="A, B", weights="0, 0")
+        assert "Weights must not be negative, and at least one must be positive." in str(e)
+        with pytest.raises(AssertionError) as e:
+            DataField("string", "STATUS", weights="1, 2")
+        assert "Weights can only be provided along with options." in str(e)
+
+    def test_alias_sampler_matches_weights(self):
+        sampler = file_creator._AliasSampler([1, 2, 7])
+        counts = [0, 0, 0]
+        for i in sampler.sample_batch(20000):
+            counts[i] += 1
+        assert abs(counts[2] / 20000 - 0.7) < 0.02
+        assert abs(counts[0] / 20000 - 0.1) < 0.02
+
+    def test_zipf_length_distribution(self):
+        field = DataField("string", "COMMENTS", min_length=1, max_length=50, length_distribution="zipf")
+        lengths = [len(v) for v in field.get_data_batch(2000)]
+        assert all(1 <= n <= 50 for n in lengths)
+        assert lengths.count(1) > lengths.count(50) * 10
+
+    def test_normal_length_distribution(self):
+        field = DataField("string", "NAME", min_length=1, max_length=21, length_distribution="normal", length_stddev=1)
+        lengths = [len(field.get_data()) for _ in range(1000)]
+        assert all(1 <= n <= 21 for n in lengths)
+        assert sum(8 <= n <= 14 for n in lengths) > 950
+
+    def test_invalid_length_distribution(self):
+        with pytest.raises(AssertionError) as e:
+            DataField("string", "NAME", length_distribution="poisson")
+        assert "Invalid length distribution `poisson`. Expected uniform, normal or zipf." in str(e)
@@ -0,0 +1,54 @@
+import pytest
+
+from SnowLibrary.keywords.notification_helper import NotificationHelper
+
+
+class TestNotificationHelper:
+    def test_get_expected_notification_message(self):
+        n = NotificationHelper()
+        args = ("OIR0001234", "Work in Progress", "Futures", "Clearing", "2", "Slow logins")
+        assert n.get_expected_notification_message(*args, type="sms") == "0001234|SEV2|Futures|WIP|Slow logins"
+        assert n.get_expected_notification_message(*args, type="email", work_note="Fixed") == \
+            "OIR0001234 SEV2 Futures WIP Clearing | Fixed"
+
+    def test_invalid_severity_and_type(self):
+        n = NotificationHelper()
+        with pytest.raises(AssertionError) as e:
+            n.get_expected_notification_message("OIR0001234", "Work in Progress", "F", "C", "6", "D", type="sms")
+        assert "Please enter the correct severity, which is the number from 1~5." in str(e)
+        with pytest.raises(AssertionError) as e:
+            n.get_expected_notification_message("OIR0001234", "Work in Progress", "F", "C", "1", "D", type="fax")
+        assert "Please enter the correct type, which is sms or email." in str(e)
+
+    def test_get_expected_notification_messages(self):
+        records = [{"number": "OIR0001234", "state": "Root Cause Pending", "severity": "1", "business": "Futures",
+                    "application": {"value": "abc", "display_value": "Clearing"}, "short_description": "Down",
+                    "work_notes": ""},
+                   {"number": "OIR0001235", "state": "Work in Progress", "severity": "3", "business": "Equities",
+                    "application": {"value": "def"}, "short_description": "Slow", "work_notes": "Restarted"}]
+        messages = NotificationHelper().get_expected_notification_messages(records, description_field="short_description",
+                                                                           work_note_field="work_notes")
+        assert messages == [{"number": "OIR0001234", "sms": "0001234|SEV1|Futures|RCP|Down",
+                             "email": "OIR0001234 SEV1 Futures RCP Clearing | Down"},
+                            {"number": "OIR0001235", "sms": "0001235|SEV3|Equities|WIP|Restarted",
+                             "email": "OIR0001235 SEV3 Equities WIP def | Restarted"}]
+
+    def test_get_expected_notification_messages_invalid_state(self):
+        records = [{"number": "OIR0001234", "state": "Closed", "severity": "1", "business": "B", "application": "A",
+                    "description": "D"}]
+        with pytest.raises(AssertionError) as e:
+            NotificationHelper().get_expected_notification_messages(records)
+        assert "Please enter the correct state, which is Work in Progress or Root Cause Pending. Got Closed. " \
+               "Record: OIR0001234." in str(e)
+
+    def test_change_and_ctask_messages(self):
+        n = NotificationHelper()
+        assert n.get_expected_change_email_notification_message("CHG0001234", "Patch", "CAB", "create") == \
+            "CHG0001234 - updated - Patch"
+        assert n.get_expected_change_email_notification_message("CHG0001234", "Patch", "CAB", "approve") == \
+            "CHG0001234 - requires your approval or rejection for group - CAB"
+        assert n.get_expected_ctask_email_notification_message("CTASK0001", "Patch", "approve") == \
+            "CTASK0001 authorized - Patch"
+        with pytest.raises(AssertionError) as e:
+            n.get_expected_change_email_notification_message("CHG0001234", "Patch", "CAB", "cancel")
+        assert "Please enter the correct type, which is create, approve, complete or reject." in str(e)
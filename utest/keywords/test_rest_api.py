@@ -1,10 +1,15 @@
+import gzip
+import hashlib
+import json
 import os
+from urllib.parse import parse_qs, urlparse
 
 import pytest
 
 from SnowLibrary.keywords.rest_api import RESTQuery
 from SnowLibrary.keywords.rest_api import RESTInsert
-from SnowLibrary.exceptions import QueryNotExecuted
+from SnowLibrary.exceptions import CassetteMiss, QueryNotExecuted
+from SnowLibrary.record_tracker import tracker
 
 
 class TestRESTQuery:
@@ -181,6 +186,393 @@ class TestRESTQuery:
         assert r._query_is_empty()
         assert not r.desired_response_fields
 
+    def test_execute_query_uses_shared_cache(self, tmp_path, fake_table_api):
+        fake_table_api.tables["sys_db_object"] = [{"name": "incident", "sys_id": "1"}]
+        cache_file = str(tmp_path / "cache.db")
+        for attempt in range(2):
+            r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", shared_cache=cache_file)
+            r.client.session.mount("https://", fake_table_api)
+            r.query_table_is("sys_db_object")
+            r.required_query_parameter_is("name", "EQUALS", "incident")
+            r.execute_query(use_cache=True)
+            assert r.response == {"name": "incident", "sys_id": "1"}
+        assert len(fake_table_api.requests) == 1
+        assert r.get_shared_cache_statistics()["hits"] >= 1
+
+    def test_get_shared_cache_statistics_requires_cache(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", shared_cache="")
+        with pytest.raises(AssertionError) as e:
+            r.get_shared_cache_statistics()
+        assert "No shared cache has been configured." in str(e)
+
+    def test_wait_until_query_returns_counts_without_downloading(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": str(i), "state": "2"} for i in range(3)]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        attempts = r.wait_until_query_returns(expected_count=3, updated_after="2018-08-08 14:40:48")
+        assert attempts == 1
+        assert "sysparm_limit=3&" in fake_table_api.requests[0].url
+        assert "sys_updated_on%3E2018-08-08+14%3A40%3A48" in fake_table_api.requests[0].url
+        assert not r._query_is_empty()
+
+    def test_wait_until_query_returns_without_total_count(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": str(i), "state": "2"} for i in range(5)]
+        fake_table_api.total_count = False
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        assert r.wait_until_query_returns(expected_count=3) == 1
+        assert "sysparm_limit=3&" in fake_table_api.requests[0].url
+
+    def test_wait_until_query_returns_times_out(self, fake_table_api):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        with pytest.raises(AssertionError) as e:
+            r.wait_until_query_returns(timeout="0.3s", initial_interval="0.05s", max_interval="0.1s")
+        assert "Expected at least 1 matching records in incident, but found 0" in str(e)
+        assert len(fake_table_api.requests) > 1
+
+    def test_paginate_requests_pages_until_short_page(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": str(i)} for i in range(5)]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        records = list(r._paginate("active=true", page_size=2))
+        assert [rec["sys_id"] for rec in records] == ["0", "1", "2", "3", "4"]
+        assert len(fake_table_api.requests) == 3
+
+    def test_get_records_changed_since_watermark_skips_unchanged_boundary_records(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": "a", "sys_updated_on": "2018-08-08 14:40:48",
+                                              "sys_mod_count": "1"}]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        watermark = r.capture_table_watermark()
+        assert watermark == {"table": "incident", "sys_updated_on": "2018-08-08 14:40:48",
+                             "sys_mod_count": {"a": "1"}}
+        fake_table_api.tables["incident"].append({"sys_id": "b", "sys_updated_on": "2018-08-08 14:40:49",
+                                                  "sys_mod_count": "0"})
+        changed = r.get_records_changed_since_watermark(watermark)
+        assert [rec["sys_id"] for rec in changed] == ["b"]
+        assert r.get_response_record_count() == 1
+        assert "sys_updated_on%3E%3D2018-08-08" in fake_table_api.requests[-1].url
+
+    def test_watermark_table_must_match_query_table(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        with pytest.raises(AssertionError) as e:
+            r.get_records_changed_since_watermark({"table": "problem", "sys_updated_on": None, "sys_mod_count": {}})
+        assert "The watermark was captured for problem, but the query table is incident." in str(e)
+
+    def test_execute_query_columnar(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": str(i), "state": "2"} for i in range(3)]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        r.execute_query(multiple=True, columnar=True)
+        assert r.get_response_record_count() == 3
+        assert r.response[1] == {"sys_id": "1", "state": "2"}
+        assert r.get_response_field_values("SYS_ID") == ["0", "1", "2"]
+        with pytest.raises(KeyError):
+            r.get_response_field_values("number")
+
+    def test_execute_query_columnar_empty_result(self, fake_table_api):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        for columnar in (False, True):
+            r.required_query_parameter_is("state", "EQUALS", "2")
+            r.execute_query(multiple=True, columnar=columnar)
+            assert r.get_response_field_values("number") == []
+
+    def test_execute_query_options(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": "1", "state": "2"}]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        r.execute_query()
+        assert "sysparm_display_value=False" in fake_table_api.requests[0].url
+        assert "sysparm_exclude_reference_link=False" in fake_table_api.requests[0].url
+        assert "sysparm_no_count" not in fake_table_api.requests[0].url
+        r.set_query_options(exclude_reference_link=True, display_value="ALL", no_count=True)
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        r.execute_query()
+        assert "sysparm_display_value=all" in fake_table_api.requests[1].url
+        assert "sysparm_exclude_reference_link=True" in fake_table_api.requests[1].url
+        assert "sysparm_no_count=true" in fake_table_api.requests[1].url
+        with pytest.raises(AssertionError) as e:
+            r.set_query_options(display_value="labels")
+        assert "Invalid display value labels. Expected True, False or all." in str(e)
+
+    def test_query_template(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.define_query_template("by_group", "assignment_group EQUALS", "and STATE does not equal",
+                                "OR sys_mod_count BETWEEN", "NQ description IS EMPTY")
+        r.use_query_template("by_group", "abc123", "7", 1, 5)
+        assert r._encoded_query() == "assignment_group=abc123^state!=7^ORsys_mod_countBETWEEN1@5^NQdescriptionISEMPTY"
+        r.add_query_parameter("OR", "active", "EQUALS", "true")
+        r.add_sort("number")
+        assert r._encoded_query().endswith("ISEMPTY^ORactive=true^ORDERBYnumber")
+        r._reset_query()
+        r.use_query_template("by_group", "abc123", "7", 1, 5)
+        r.add_sort("number", ascending=False)
+        assert r._encoded_query().endswith("ISEMPTY^ORDERBYDESCnumber")
+
+    def test_query_template_matches_query_builder(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.required_query_parameter_is("number", "STARTS WITH", "INC")
+        r.add_query_parameter("AND", "priority", "LESS THAN", "3")
+        r.add_query_parameter("AND", "sys_created_on", "BETWEEN", "2018-08-10 00:00:00", "2018-08-15 23:59:59",
+                              is_date_field=True)
+        expected = r._encoded_query()
+        r._reset_query()
+        r.define_query_template("by_number", "number STARTS WITH", "AND priority LESS THAN",
+                                "AND sys_created_on BETWEEN")
+        r.use_query_template("by_number", "INC", 3, "2018-08-10 00:00:00", "2018-08-15 23:59:59")
+        assert r._encoded_query() == expected
+
+    def test_query_template_in_values(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.IN_CHUNK_SIZE = 2
+        r.define_query_template("by_numbers", "number IN", "AND state NOT IN")
+        r.use_query_template("by_numbers", ["INC1", " INC2"], "6, 7,8")
+        assert r._encoded_query() == "numberININC1,INC2^stateNOT IN6,7,8"
+        r._reset_query()
+        r.use_query_template("by_numbers", ["INC1", "INC2", "INC3"], ["7"])
+        assert r._chunked_queries() == ["numberININC1,INC2^stateNOT IN7", "numberININC3^stateNOT IN7"]
+
+    def test_query_template_values_are_escaped(self, fake_table_api):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.define_query_template("by_description", "short_description EQUALS")
+        r.use_query_template("by_description", "Down^ORactive=true")
+        r.execute_query()
+        assert "sysparm_query=short_description%3DDown%5E%5EORactive%3Dtrue&" in fake_table_api.requests[0].url
+
+    def test_query_template_errors(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        with pytest.raises(AssertionError) as e:
+            r.define_query_template("bad", "number", "AND state EQUALS")
+        assert "Invalid condition 'number': expected a field and a condition type." in str(e)
+        with pytest.raises(AssertionError) as e:
+            r.define_query_template("bad", "number EQUALS", "state EQUALS")
+        assert "must begin with one of the logical operators" in str(e)
+        with pytest.raises(AssertionError) as e:
+            r.use_query_template("not_defined")
+        assert "Query template not found: not_defined." in str(e)
+        r.define_query_template("one", "number EQUALS")
+        with pytest.raises(AssertionError) as e:
+            r.use_query_template("one", "a", "b")
+        assert "Query template one expects 1 values, but got 2." in str(e)
+
+    def test_extended_query_types(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.required_query_parameter_is("state", "IN", "1, 2,3")
+        r.add_query_parameter("AND", "priority", "NOT IN", ["4", "5"])
+        r.add_query_parameter("AND", "assignment_group.name", "IS NOT EMPTY")
+        r.add_query_parameter("AND", "short_description", "LIKE", "disk")
+        r.add_query_parameter("OR", "category", "ANYTHING")
+        assert str(r.query) == ("stateIN1,2,3^priorityNOT IN4,5^assignment_group.nameISNOTEMPTY"
+                                "^short_descriptionLIKEdisk^ORcategoryANYTHING")
+
+    def test_on_and_relative_date_query_types(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.required_query_parameter_is("sys_created_on", "ON", "2018-08-10")
+        r.add_query_parameter("AND", "sys_updated_on", "ON", "today")
+        r.add_query_parameter("AND", "opened_at", "RELATIVE AFTER", "3", "days")
+        r.add_query_parameter("AND", "closed_at", "relative before", 1, "HOUR")
+        assert str(r.query) == ("sys_created_onON2018-08-10@javascript:gs.dateGenerate('2018-08-10','start')"
+                                "@javascript:gs.dateGenerate('2018-08-10','end')"
+                                "^sys_updated_onONToday@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()"
+                                "^opened_atRELATIVEGT@dayofweek@ago@3^closed_atRELATIVELT@hour@ago@1")
+
+    def test_extended_query_type_errors(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        with pytest.raises(AssertionError) as e:
+            r.required_query_parameter_is("sys_created_on", "ON", "10/08/2018")
+        assert "Invalid parameter for condition type ON" in str(e)
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        with pytest.raises(AssertionError) as e:
+            r.required_query_parameter_is("opened_at", "RELATIVE AFTER", "3", "fortnights")
+        assert "Invalid unit for a relative date: fortnights." in str(e)
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        with pytest.raises(AssertionError) as e:
+            r.required_query_parameter_is("opened_at", "RELATIVE AFTER", "3")
+        assert "expected 0 or 2 arguments, but got 1." in str(e)
+
+    def test_large_in_list_is_split_into_chunks(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": "1"}, {"sys_id": "2"}]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.IN_CHUNK_SIZE = 2
+        r.required_query_parameter_is("number", "IN", ["INC1", "INC2", "INC3", "INC4", "INC5"])
+        r.add_query_parameter("AND", "active", "EQUALS", "true")
+        r.execute_query(multiple=True)
+        assert len(fake_table_api.requests) == 3
+        assert "numberIN%2CINC5" not in fake_table_api.requests[2].url
+        assert "numberININC5%5Eactive%3Dtrue" in fake_table_api.requests[2].url
+        assert r.get_response_record_count() == 2  # Records returned for several chunks are only counted once
+
+    def test_large_in_list_is_chunked_when_polling_and_since_watermark(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": "1", "sys_mod_count": "0"},
+                                             {"sys_id": "2", "sys_mod_count": "0"}]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.IN_CHUNK_SIZE = 2
+        r.required_query_parameter_is("number", "IN", ["INC1", "INC2", "INC3"])
+        assert r.wait_until_query_returns(expected_count=4) == 1  # Each chunk counts the 2 records of the fake API.
+        changed = r.get_records_changed_since_watermark({"table": "incident", "sys_updated_on": None,
+                                                         "sys_mod_count": {}})
+        assert [rec["sys_id"] for rec in changed] == ["1", "2"]
+        queries = [parse_qs(urlparse(request.url).query)["sysparm_query"][0] for request in fake_table_api.requests]
+        assert queries == ["numberININC1,INC2", "numberININC3",
+                           "numberININC1,INC2^ORDERBYsys_id", "numberININC3^ORDERBYsys_id"]
+
+    def test_only_one_large_in_list_per_query(self):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.IN_CHUNK_SIZE = 1
+        r.required_query_parameter_is("number", "IN", "INC1,INC2")
+        with pytest.raises(AssertionError) as e:
+            r.add_query_parameter("AND", "state", "IN", "1,2")
+        assert "Only one IN condition with more than 1 values can be added to a query." in str(e)
+
+    def test_export_query_results_to_csv(self, tmp_path, fake_table_api):
+        fake_table_api.tables["incident"] = [{"number": "INC{}".format(i), "state": "2",
+                                              "caller_id": {"link": "https://x", "value": "abc"}} for i in range(5)]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        r.include_fields_in_response("number", "caller_id")
+        file_name = str(tmp_path / "incidents.csv")
+        assert r.export_query_results_to_file(file_name, delimiter="pipe", page_size=2) == 5
+        with open(file_name) as f:
+            lines = f.read().splitlines()
+        assert lines[0] == "number|caller_id"
+        assert lines[1:] == ["INC{}|abc".format(i) for i in range(5)]
+        assert len(fake_table_api.requests) == 3
+
+    def test_export_query_results_to_compressed_jsonl(self, tmp_path, fake_table_api):
+        fake_table_api.tables["incident"] = [{"number": "INC1", "state": "2"}]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        file_name = str(tmp_path / "incidents.jsonl.gz")
+        assert r.export_query_results_to_file(file_name, file_format="jsonl") == 1
+        with gzip.open(file_name, "rt") as f:
+            assert [json.loads(line) for line in f] == [{"number": "INC1", "state": "2"}]
+
+    def test_export_query_results_invalid_format(self, tmp_path):
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        with pytest.raises(AssertionError) as e:
+            r.export_query_results_to_file(str(tmp_path / "out.xml"), file_format="XML")
+        assert "Invalid file format XML. Expected CSV or JSONL." in str(e)
+
+    def test_verify_data_file_against_table(self, tmp_path, fake_table_api):
+        fake_table_api.tables["u_supplier"] = [
+            {"u_supplier_id": "1", "u_name": "Acme", "u_status": "APPROVED"},
+            {"u_supplier_id": "2", "u_name": "Globex", "u_status": "REJECTED"},
+            {"u_supplier_id": "2", "u_name": "Globex", "u_status": "REJECTED"},
+            {"u_supplier_id": "9", "u_name": "Not in file", "u_status": "APPROVED"}]
+        file_name = str(tmp_path / "suppliers.csv")
+        with open(file_name, "w") as f:
+            f.write("SUPPLIER_ID|NAME|U_STATUS\n1|Acme|APPROVED\n2|Globex|APPROVED\n3|Initech|APPROVED\n")
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="u_supplier")
+        r.client.session.mount("https://", fake_table_api)
+        with pytest.raises(AssertionError) as e:
+            r.verify_data_file_against_table(file_name, "SUPPLIER_ID=u_supplier_id", "NAME=u_name", "U_STATUS",
+                                             delimiter="PIPE")
+        assert "Missing: ['3']. Mismatched: ['2 (u_status: expected APPROVED, found REJECTED)']. Extra: ['2']." in str(e)
+        report = r.verify_data_file_against_table(file_name, "SUPPLIER_ID=u_supplier_id", "NAME=u_name", "U_STATUS",
+                                                  delimiter="PIPE", fail_on_differences=False)
+        assert report == {"matched": 1, "missing": ["3"], "extra": ["2"], "mismatched": [
+            {"key": "2", "differences": {"u_status": {"expected": "APPROVED", "actual": "REJECTED"}}}]}
+        assert "u_supplier_idIN1%2C2%2C3" in fake_table_api.requests[-1].url
+
+    def test_verify_data_file_against_table_unknown_header(self, tmp_path):
+        file_name = str(tmp_path / "suppliers.csv")
+        with open(file_name, "w") as f:
+            f.write("SUPPLIER_ID,NAME\n1,Acme\n")
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="u_supplier")
+        with pytest.raises(AssertionError) as e:
+            r.verify_data_file_against_table(file_name, "SUPPLIER_ID", "STATUS")
+        assert "Header not found in" in str(e)
+
+    def test_verify_data_file_against_table_invalid_keys(self, tmp_path):
+        file_name = str(tmp_path / "suppliers.csv")
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="u_supplier")
+        with open(file_name, "w") as f:
+            f.write("SUPPLIER_ID|NAME\n1|Acme\n2|Globex\n1|Acme again\n")
+        with pytest.raises(AssertionError) as e:
+            r.verify_data_file_against_table(file_name, "SUPPLIER_ID", "NAME", delimiter="PIPE")
+        assert "has duplicate keys: ['1']." in str(e)
+        with open(file_name, "w") as f:
+            f.write("SUPPLIER_ID|NAME\n1,2|Acme\n")
+        with pytest.raises(AssertionError) as e:
+            r.verify_data_file_against_table(file_name, "SUPPLIER_ID", "NAME", delimiter="PIPE")
+        assert "The key 1,2 in {} contains a comma".format(file_name) in str(e)
+
+    def test_verify_notifications_sent(self, fake_table_api):
+        fake_table_api.tables["sys_email"] = [
+            {"sys_id": "1", "subject": "OIR0001234  SEV1 Futures RCP Clearing | Down", "body_text": "Details..."},
+            {"sys_id": "2", "subject": "", "body_text": "0001234|sev1|Futures|RCP|Down\n"},
+            {"sys_id": "3", "subject": "Your password expires", "body_text": ""}]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.client.session.mount("https://", fake_table_api)
+        expected = [{"number": "OIR0001234", "sms": "0001234|SEV1|Futures|RCP|Down",
+                     "email": "OIR0001234 SEV1 Futures RCP Clearing | Down"}, "CHG0001234 - approved - Patch"]
+        report = r.verify_notifications_sent(expected, "2018-08-08 14:40:48", "2018-08-08 15:40:48",
+                                             query="type=sent", fail_on_missing=False)
+        assert report == {"matched": 2, "missing": ["CHG0001234 - approved - Patch"],
+                          "unexpected": [{"sys_id": "3", "subject": "Your password expires"}]}
+        assert len(fake_table_api.requests) == 1
+        assert "sysparm_fields=sys_id%2Csubject%2Cbody_text" in fake_table_api.requests[0].url
+        with pytest.raises(AssertionError) as e:
+            r.verify_notifications_sent(expected[:1], "2018-08-08 14:40:48", "2018-08-08 15:40:48",
+                                        fail_on_unexpected=True)
+        assert "Unexpected: ['Your password expires']" in str(e)
+
+    def test_record_and_replay_cassette(self, tmp_path, fake_table_api):
+        cassette = str(tmp_path / "incidents.json.gz")
+        fake_table_api.tables["incident"] = [{"sys_id": str(i), "state": "2"} for i in range(3)]
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p", query_table="incident")
+        r.client.session.mount("https://", fake_table_api)
+        r.use_cassette(cassette, "record")
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        r.execute_query(multiple=True)
+        assert r.stop_cassette() == {"hits": 0, "misses": 0}
+        fake_table_api.requests.clear()
+        r.use_cassette(cassette, "STRICT")
+        r.required_query_parameter_is("state", "EQUALS", "2")
+        r.execute_query(multiple=True)
+        assert r.get_response_record_count() == 3
+        assert r.response[1] == {"sys_id": "1", "state": "2"}
+        assert fake_table_api.requests == []
+        r.required_query_parameter_is("state", "EQUALS", "3")
+        with pytest.raises(CassetteMiss) as e:
+            r.execute_query(multiple=True)
+        assert "No response to GET https://iceuat.service-now.com/api/now/table/incident" in str(e)
+        assert r.stop_cassette() == {"hits": 1, "misses": 1}
+        with pytest.raises(AssertionError) as e:
+            r.stop_cassette()
+        assert "No cassette is in use" in str(e)
+
+    def test_download_attachment(self, tmp_path, fake_table_api):
+        fake_table_api.attachments["a1"] = b"number,state\n" * 100000
+        r = RESTQuery(host="iceuat.service-now.com", user="u", password="p")
+        r.client.session.mount("https://", fake_table_api)
+        path = str(tmp_path / "out" / "orders.csv")
+        sha256 = hashlib.sha256(fake_table_api.attachments["a1"]).hexdigest()
+        result = r.download_attachment("a1", path, expected_checksum=sha256.upper())
+        assert result["bytes"] == 1300000
+        assert result["checksum"] == sha256
+        with open(path, "rb") as f:
+            assert f.read() == fake_table_api.attachments["a1"]
+        assert fake_table_api.requests[0].url.endswith("/api/now/attachment/a1/file")
+        with pytest.raises(AssertionError) as e:
+            r.download_attachment("a1", path, checksum="md5", expected_checksum="0" * 32)
+        assert "The md5 checksum of {} is".format(path) in str(e)
+        with pytest.raises(AssertionError) as e:
+            r.download_attachment("a2", str(tmp_path / "missing.csv"))
+        assert "No attachment with sys_id a2 was found." in str(e)
+        assert sorted(os.listdir(str(tmp_path))) == ["out"]
+
 
 class TestRESTInsert:
     def test_default_new_rest_insert_object(self):
@@ -238,3 +630,75 @@ class TestRESTInsert:
         i.insert_record_parameters(values)
         result = i.insert_record()
         assert result is not None
+
+    def test_inserted_records_are_tracked_and_cleaned_up(self, fake_table_api):
+        tracker.forget(tracker.created("ALL"))
+        i = RESTInsert(host="iceuat.service-now.com", user="u", password="p", insert_table="incident")
+        i.client.session.mount("https://", fake_table_api)
+        i.new_record_payload = {"short_description": "Robot test"}
+        sys_ids = [i.insert_record() for _ in range(3)]
+        assert [r["sys_id"] for r in fake_table_api.tables["incident"]] == sys_ids
+        assert i.cleanup_created_records(batch_size=2, max_workers=2) == 3
+        assert fake_table_api.tables["incident"] == []
+        assert tracker.created("ALL") == []
+        assert sum(r.url.endswith("/api/now/v1/batch") for r in fake_table_api.requests) == 2
+
+    def test_upload_attachment(self, tmp_path, fake_table_api):
+        path = tmp_path / "orders.csv"
+        path.write_bytes(b"number,state\n" * 100000)
+        i = RESTInsert(host="iceuat.service-now.com", user="u", password="p")
+        i.client.session.mount("https://", fake_table_api)
+        result = i.upload_attachment("incident", "abc", str(path), checksum="sha256")
+        assert fake_table_api.attachments[result["sys_id"]] == path.read_bytes()
+        assert result["bytes"] == 1300000
+        assert result["checksum"] == hashlib.sha256(path.read_bytes()).hexdigest()
+        request = fake_table_api.requests[0]
+        assert request.headers["Content-Length"] == "1300000"
+        assert request.headers["Content-Type"] == "text/csv"
+        assert "table_name=incident&table_sys_id=abc&file_name=orders.csv" in request.url
+        assert tracker.created("ALL")[-1] == {"table": "sys_attachment", "sys_id": result["sys_id"], "suite": None,
+                                              "test": None}
+        tracker.forget(tracker.created("ALL"))
+        with pytest.raises(AssertionError) as e:
+            i.upload_attachment("incident", "abc", str(tmp_path / "missing.csv"))
+        assert "The file {} does not exist.".format(tmp_path / "missing.csv") in str(e)
+        with pytest.raises(AssertionError) as e:
+            i.upload_attachment("incident", "abc", str(path), checksum="crc")
+        assert "Unknown checksum algorithm crc." in str(e)
+
+    def test_update_and_delete_records_matching_query(self, fake_table_api):
+        fake_table_api.tables["incident"] = [{"sys_id": str(n), "state": "1"} for n in range(5)]
+        i = RESTInsert(host="iceuat.service-now.com", user="u", password="p")
+        i.client.session.mount("https://", fake_table_api)
+        assert i.update_records("incident", "state=1", {"state": "7"}, batch_size=2) == 5
+        assert all(r["state"] == "7" for r in fake_table_api.tables["incident"])
+        assert i.delete_records_matching_query("incident", "state=7") == 5
+        assert fake_table_api.tables["incident"] == []
+
+    def test_bulk_changes_require_query(self):
+        i = RESTInsert(host="iceuat.service-now.com", user="u", password="p")
+        with pytest.raises(AssertionError) as e:
+            i.delete_records_matching_query("incident", "")
+        assert "A query is required, to avoid changing every record in incident." in str(e)
+
+    def test_insert_with_correlation_field_is_not_duplicated(self, fake_table_api):
+        tracker.forget(tracker.created("ALL"))
+        send = fake_table_api.send
+
+        def lose_first_response(request, **kwargs):
+            response = send(request, **kwargs)
+            if request.method == "POST" and len(fake_table_api.tables["incident"]) == 1:
+                response.status_code = 502  # The record was created, but the response was lost.
+            return response
+
+        fake_table_api.send = lose_first_response
+        i = RESTInsert(host="iceuat.service-now.com", user="u", password="p", insert_table="incident")
+        i.client.session.mount("https://", fake_table_api)
+        i.client.session.retry_initial = i.client.session.retry_max = 0
+        i.new_record_payload = {"correlation_id": "abc"}
+        sys_id = i.insert_record(correlation_field="correlation_id")
+        assert [r["sys_id"] for r in fake_table_api.tables["incident"]] == [sys_id]
+        assert tracker.created("ALL")[0]["sys_id"] == sys_id
+        with pytest.raises(AssertionError) as e:
+            i.insert_record(correlation_field="number")
+        assert "The correlation field number is not in the payload." in str(e)
@@ -0,0 +1,66 @@
+import gzip
+import json
+
+import pytest
+import requests
+
+from SnowLibrary.cassette import Cassette, request_key
+from SnowLibrary.exceptions import CassetteMiss
+
+URL = "https://iceuat.service-now.com/api/now/table/incident"
+
+
+def response(content, status_code=200):
+    r = requests.models.Response()
+    r.status_code = status_code
+    r.reason = "OK"
+    r.url = URL
+    r.headers.update({"Content-Type": "application/json", "Content-Encoding": "gzip", "Set-Cookie": "JSESSIONID=1"})
+    r._content = content
+    return r
+
+
+def prepare(method, url, body=None):
+    return requests.Request(method, url, data=body).prepare()
+
+
+class TestCassette:
+    def test_request_key_is_normalized(self):
+        assert request_key("GET", URL + "?b=2&a=1") == request_key("GET", URL + "?a=1&b=2")
+        assert request_key("POST", URL, '{"a": 1, "b": 2}') == request_key("POST", URL, b'{"b":2,"a":1}')
+        assert request_key("POST", URL, '{"a": 1}') != request_key("PUT", URL, '{"a": 1}')
+        assert (request_key("POST", URL, '{"batch_request_id": "1", "rest_requests": []}') ==
+                request_key("POST", URL, '{"batch_request_id": "2", "rest_requests": []}'))
+
+    def test_record_and_replay(self, tmp_path):
+        path = str(tmp_path / "cassette.json.gz")
+        recorder = Cassette(path, "RECORD")
+        recorder.record(prepare("GET", URL + "?a=1"), response(b'{"result": []}'), b'{"result": []}')
+        recorder.record(prepare("GET", URL + "?a=1"), response(b'{"result": [1]}'), b'{"result": [1]}')
+        recorder.record(prepare("GET", URL + "?a=2"), response(b"\xff"), b"\xff")
+        recorder.save()
+        with gzip.open(path, "rt") as f:
+            headers = next(iter(json.load(f)["interactions"].values()))[0]["headers"]
+        assert headers == {"Content-Type": "application/json"}
+        player = Cassette(path)
+        assert player.play(prepare("GET", URL + "?a=1")).json() == {"result": []}
+        assert player.play(prepare("GET", URL + "?a=1")).json() == {"result": [1]}
+        assert player.play(prepare("GET", URL + "?a=1")).json() == {"result": [1]}
+        assert player.play(prepare("GET", URL + "?a=2")).content == b"\xff"
+        assert player.play(prepare("GET", URL + "?a=3")) is None
+        assert (player.hits, player.misses) == (4, 1)
+
+    def test_strict_miss(self, tmp_path):
+        path = str(tmp_path / "cassette.json.gz")
+        Cassette(path, "RECORD").save()
+        with pytest.raises(CassetteMiss) as e:
+            Cassette(path, "STRICT").play(prepare("GET", URL))
+        assert "No response to GET {} was recorded".format(URL) in str(e)
+
+    def test_errors(self, tmp_path):
+        with pytest.raises(AssertionError) as e:
+            Cassette(str(tmp_path / "cassette.json.gz"), "PLAYBACK")
+        assert "Invalid cassette mode PLAYBACK. Expected one of RECORD, REPLAY, STRICT." in str(e)
+        with pytest.raises(AssertionError) as e:
+            Cassette(str(tmp_path / "missing.json.gz"))
+        assert "does not exist. Record it first." in str(e)
@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+from pysnow.exceptions import MissingResult, ResponseError
+
+from SnowLibrary.json_stream import iter_records
+
+
+class CountingReader(io.BytesIO):
+    """A BytesIO that remembers how many bytes have been read from it."""
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+class TestIterRecords:
+    records = [{"number": "INC{:04d}".format(i), "description": "café \"quoted\" {braces} [brackets]" * 5,
+                "caller_id": {"link": "https://x/{}".format(i), "value": str(i)}} for i in range(200)]
+
+    def test_yields_every_record_across_small_chunks(self):
+        body = json.dumps({"result": self.records}).encode("utf-8")
+        assert list(iter_records(io.BytesIO(body), chunk_size=7)) == self.records
+
+    def test_single_record_result(self):
+        body = json.dumps({"result": self.records[0]}).encode("utf-8")
+        assert list(iter_records(io.BytesIO(body))) == [self.records[0]]
+
+    def test_empty_result(self):
+        assert list(iter_records(io.BytesIO(b'{"result": []}'))) == []
+
+    def test_stops_reading_after_first_record(self):
+        raw = CountingReader(json.dumps({"result": self.records}).encode("utf-8"))
+        assert next(iter_records(raw, chunk_size=1024)) == self.records[0]
+        assert raw.bytes_read < len(raw.getvalue()) / 10
+
+    def test_error_response_raises(self):
+        body = json.dumps({"error": {"message": "No Record found", "detail": "ACL"}, "status": "failure"})
+        with pytest.raises(ResponseError) as e:
+            list(iter_records(io.BytesIO(body.encode("utf-8"))))
+        assert "No Record found" in str(e)
+
+    def test_missing_result_raises(self):
+        with pytest.raises(MissingResult):
+            list(iter_records(io.BytesIO(b'{"status": "ok"}')))
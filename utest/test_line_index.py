@@ -0,0 +1,45 @@
+import os
+
+from SnowLibrary.line_index import LineIndex
+
+
+def write(path, text, mode="w"):
+    with open(path, mode, newline="") as f:
+        f.write(text)
+
+
+class TestLineIndex:
+    def test_read_lines(self, tmp_path):
+        path = str(tmp_path / "data.csv")
+        lines = ["line {}".format(i) * (i % 5) for i in range(100)]
+        write(path, "\r\n".join(lines))
+        index = LineIndex(path, stride=7)
+        index.CHUNK_SIZE = 64
+        index.update()
+        assert index.line_count == 100
+        assert [index.read_line(i).decode() for i in range(100)] == lines
+        assert index.read_lines([99, 3]) == [lines[99].encode(), lines[3].encode()]
+
+    def test_index_is_saved_and_extended(self, tmp_path):
+        path = str(tmp_path / "data.csv")
+        write(path, "".join("{}\n".format(i) for i in range(50)))
+        LineIndex(path, stride=10).update()
+        write(path, "".join("{}\n".format(i) for i in range(50, 75)), mode="a")
+        index = LineIndex(path, stride=10)
+        assert index.line_count == 50  # Loaded from the index file.
+        index.update()
+        assert index.line_count == 75
+        assert index.read_line(74) == b"74"
+        os.remove(index.index_path)
+        rebuilt = LineIndex(path, stride=10)
+        rebuilt.update()
+        assert rebuilt.offsets == index.offsets
+
+    def test_index_is_rebuilt_if_file_shrinks(self, tmp_path):
+        path = str(tmp_path / "data.csv")
+        write(path, "a\nb\nc\n")
+        LineIndex(path, stride=2).update()
+        write(path, "d\n")
+        index = LineIndex(path, stride=2)
+        index.update()
+        assert index.line_count == 1 and index.read_line(0) == b"d"
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from SnowLibrary import notification_templates
+from SnowLibrary.notification_templates import CompiledTemplate, TemplateRegistry
+from SnowLibrary.keywords.notification_helper import NotificationHelper
+
+
+class TestNotificationTemplates:
+    def test_builtin_templates_match_helper_keywords(self):
+        n = NotificationHelper()
+        values = {"number": "OIR0001234", "state": "Work in Progress", "business": "Futures", "application": "Clearing",
+                  "severity": "2", "text": "Slow logins"}
+        args = ("OIR0001234", "Work in Progress", "Futures", "Clearing", "2", "Slow logins")
+        assert n.get_expected_message("oir_sms", **values) == n.get_expected_notification_message(*args, type="sms")
+        assert n.get_expected_message("oir_email", **values) == n.get_expected_notification_message(*args, type="email")
+        assert n.get_expected_message("change_approve", number="CHG0001234", approval_group="CAB") == \
+            n.get_expected_change_email_notification_message("CHG0001234", "", "CAB", "approve")
+
+    def test_fields_and_lookup_transform(self):
+        template = CompiledTemplate("t", {"fields": ["number", "priority"], "separator": " - ",
+                                          "transforms": {"priority": {"1": "P1"}, "number": "lower"}})
+        assert template.fields == ["number", "priority"]
+        assert template.render({"number": "PRB01", "priority": "1", "unused": "x"}) == "prb01 - P1"
+        with pytest.raises(AssertionError) as e:
+            template.render({"number": "PRB01", "priority": "2"})
+        assert "Please enter the correct priority, which is one of 1. Got 2." in str(e)
+
+    def test_missing_field_and_unknown_template(self):
+        with pytest.raises(AssertionError) as e:
+            NotificationHelper().get_expected_message("change_create", number="CHG0001234")
+        assert "Template change_create requires the field 'description'." in str(e)
+        with pytest.raises(AssertionError) as e:
+            NotificationHelper().get_expected_message("nope")
+        assert "Unknown notification template nope." in str(e)
+
+    def test_unknown_transform(self):
+        with pytest.raises(AssertionError) as e:
+            CompiledTemplate("t", {"format": "{a}", "transforms": {"a": "reverse"}})
+        assert "Unknown transform reverse for the field a of template t." in str(e)
+
+    def test_load_json_templates(self, tmp_path):
+        path = str(tmp_path / "templates.json")
+        with open(path, "w") as f:
+            json.dump({"problem": {"format": "{number}: {short_description}"}}, f)
+        registry = TemplateRegistry()
+        registry.load(path)
+        assert registry.get("problem").render({"number": "PRB1", "short_description": "Down"}) == "PRB1: Down"
+        assert "oir_sms" in registry.templates
+
+    def test_load_yaml_without_pyyaml(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(notification_templates, "yaml", None)
+        path = str(tmp_path / "templates.yaml")
+        open(path, "w").close()
+        with pytest.raises(AssertionError) as e:
+            TemplateRegistry().load(path)
+        assert "The PyYAML package is required to load YAML templates." in str(e)
@@ -0,0 +1,30 @@
+import pytest
+
+from SnowLibrary.record_tracker import RecordTracker
+
+
+class TestRecordTracker:
+    def test_records_are_selected_by_scope(self, monkeypatch):
+        t = RecordTracker()
+        for suite, test, sys_id in [("Top.Child", "One", "1"), ("Top.Child", "Two", "2"), ("Top", None, "3"),
+                                    ("Other", "Three", "4")]:
+            monkeypatch.setattr(t, "_current_scope", lambda: (suite, test))
+            t.track("incident", sys_id)
+        monkeypatch.setattr(t, "_current_scope", lambda: ("Top.Child", "Two"))
+        assert [r["sys_id"] for r in t.created("TEST")] == ["2"]
+        assert [r["sys_id"] for r in t.created("SUITE")] == ["1", "2"]
+        monkeypatch.setattr(t, "_current_scope", lambda: ("Top", None))
+        assert [r["sys_id"] for r in t.created("suite")] == ["1", "2", "3"]
+        assert len(t.created("ALL")) == 4
+
+    def test_forget(self):
+        t = RecordTracker()
+        t.track("incident", "1")
+        t.track("incident", "2")
+        t.forget(t.created("ALL")[:1])
+        assert [r["sys_id"] for r in t.created("ALL")] == ["2"]
+
+    def test_invalid_scope(self):
+        with pytest.raises(AssertionError) as e:
+            RecordTracker().created("RUN")
+        assert "Invalid scope RUN. Expected TEST, SUITE or ALL." in str(e)
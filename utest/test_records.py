@@ -0,0 +1,41 @@
+import pytest
+
+from SnowLibrary.records import ColumnarRecords
+
+
+class TestColumnarRecords:
+    records = [{"number": "INC0001", "state": "2", "assignment_group": {"link": "https://x/1", "value": "1"}},
+               {"number": "INC0002", "state": "2", "assignment_group": {"link": "https://x/1", "value": "1"}},
+               {"number": "INC0003", "state": "7"}]
+
+    def test_rows_behave_like_the_original_records(self):
+        store = ColumnarRecords(self.records)
+        assert len(store) == 3
+        assert store[0] == self.records[0]
+        assert store[-1] == self.records[2]
+        assert [dict(r) for r in store[1:]] == self.records[1:]
+        assert store.to_list() == self.records
+
+    def test_missing_fields_raise_key_error(self):
+        store = ColumnarRecords(self.records)
+        assert "assignment_group" not in store[2]
+        with pytest.raises(KeyError):
+            store[2]["assignment_group"]
+        with pytest.raises(KeyError):
+            store.column("assignment_group")
+
+    def test_column_slices_values(self):
+        store = ColumnarRecords(self.records)
+        assert store.column("number") == ["INC0001", "INC0002", "INC0003"]
+        assert store.fields() == ["number", "state", "assignment_group"]
+
+    def test_column_of_empty_store(self):
+        assert ColumnarRecords().column("number") == []
+
+    def test_repeated_values_are_interned(self):
+        store = ColumnarRecords([dict(r) for r in self.records[:2]])
+        assert store[0]["assignment_group"] is store[1]["assignment_group"]
+
+    def test_index_out_of_range(self):
+        with pytest.raises(IndexError):
+            ColumnarRecords(self.records)[3]
@@ -0,0 +1,206 @@
+import io
+import threading
+import time
+
+import pytest
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.models import Response
+
+from SnowLibrary import session
+from SnowLibrary.exceptions import CircuitOpen
+from SnowLibrary.session import AdaptiveConcurrency, CircuitBreaker, SnowSession, TokenBucket, get_session
+
+URL = "https://iceuat.service-now.com/api/now/table/incident"
+
+
+class ScriptedAdapter(BaseAdapter):
+    """Answers requests with the given status codes and headers, in order."""
+
+    def __init__(self, *responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        status_code, headers = self.responses.pop(0)
+        self.sent += 1
+        if status_code is None:
+            raise ConnectionError("Connection refused")
+        response = Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        response.raw = io.BytesIO(b"{}")
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class SlowAdapter(BaseAdapter):
+    """Holds each request until ``release`` is set, and answers with the number of the request."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        self.release.wait(5)
+        response = Response()
+        response.status_code = 200
+        response.raw = io.BytesIO('{{"request": {}}}'.format(self.sent).encode())
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def new_breakers(monkeypatch):
+    monkeypatch.setattr(session, "_breakers", dict())
+
+
+class TestSession:
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        assert time.monotonic() - start >= 0.09
+
+    def test_token_bucket_pause(self):
+        bucket = TokenBucket()
+        bucket.pause(0.05)
+        start = time.monotonic()
+        bucket.acquire()
+        assert time.monotonic() - start >= 0.04
+
+    def test_adaptive_concurrency(self):
+        concurrency = AdaptiveConcurrency(initial=4, maximum=5)
+        for _ in range(20):
+            concurrency.acquire()
+            concurrency.release()
+        assert concurrency.limit == 5
+        concurrency.acquire()
+        concurrency.release(throttled=True)
+        assert concurrency.limit == 2.5
+
+    def test_adaptive_concurrency_is_enabled_by_rate_limiting(self):
+        concurrency = AdaptiveConcurrency(initial=1, enabled=False)
+        for _ in range(6):
+            concurrency.acquire()  # Would block if the limit was enforced.
+        assert concurrency.in_flight == 6
+        concurrency.release(throttled=True)
+        assert concurrency.enabled and concurrency.limit == 3
+        assert not SnowSession().concurrency.enabled
+        assert SnowSession(rate=10).concurrency.enabled
+
+    def test_rate_limited_requests_are_retried(self):
+        s = SnowSession()
+        adapter = ScriptedAdapter((429, {"Retry-After": "0"}), (429, {"X-RateLimit-Remaining": "0",
+                                                                       "X-RateLimit-Reset": "0"}), (200, {}))
+        s.mount("https://", adapter)
+        assert s.get("https://iceuat.service-now.com/api/now/table/incident").status_code == 200
+        assert adapter.sent == 3
+        assert s.concurrency.enabled and s.concurrency.limit < 4
+
+    def test_rate_limited_response_is_returned_after_max_retries(self):
+        s = SnowSession(max_retries=1)
+        s.mount("https://", ScriptedAdapter((429, {"Retry-After": "0"}), (429, {"Retry-After": "0"})))
+        assert s.get("https://iceuat.service-now.com/api/now/table/incident").status_code == 429
+
+    def test_sessions_are_shared_per_instance_and_user(self, monkeypatch):
+        monkeypatch.setattr(session, "_sessions", dict())
+        monkeypatch.setenv("SNOW_RATE_LIMIT", "10")
+        assert get_session("iceuat", "u", "p") is get_session("iceuat", "u", "p")
+        assert get_session("iceuat", "u", "p") is not get_session("iceuat", "other", "p")
+        assert get_session("iceuat", "u", "p").rate_limiter.rate == 10
+
+    def test_gateway_errors_and_connection_errors_are_retried(self):
+        s = SnowSession(retry_initial=0, retry_max=0)
+        adapter = ScriptedAdapter((502, {}), (None, {}), (503, {}), (200, {}))
+        s.mount("https://", adapter)
+        assert s.get(URL).status_code == 200
+        assert adapter.sent == 4
+
+    def test_inserts_are_not_retried(self):
+        s = SnowSession(retry_initial=0, retry_max=0)
+        s.mount("https://", ScriptedAdapter((502, {}), (200, {})))
+        assert s.post(URL, data="{}").status_code == 502
+
+    def test_circuit_opens_after_repeated_failures(self):
+        s = SnowSession(retries=0)
+        session.get_circuit_breaker("iceuat.service-now.com").threshold = 2
+        adapter = ScriptedAdapter((None, {}), (504, {}), (200, {}))
+        s.mount("https://", adapter)
+        with pytest.raises(ConnectionError):
+            s.get(URL)
+        assert s.get(URL).status_code == 504
+        with pytest.raises(CircuitOpen) as e:
+            s.get(URL)
+        assert "iceuat.service-now.com failed 2 requests in a row" in str(e)
+        assert adapter.sent == 2
+
+    def test_circuit_breaker_lets_one_request_through_after_timeout(self):
+        breaker = CircuitBreaker("iceuat.service-now.com", threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        with pytest.raises(CircuitOpen):
+            breaker.before_request()
+        time.sleep(0.02)
+        breaker.before_request()
+        with pytest.raises(CircuitOpen):
+            breaker.before_request()
+        breaker.record_success()
+        breaker.before_request()
+        assert not breaker.is_open
+
+    def test_identical_gets_are_coalesced(self):
+        s = SnowSession()
+        adapter = SlowAdapter()
+        s.mount("https://", adapter)
+        results = list()
+        urls = [URL + "?a=1&b=2", URL + "?b=2&a=1", URL + "?a=1&b=2", URL + "?a=1&b=2"]
+        threads = [threading.Thread(target=lambda u=u: results.append(s.get(u).json())) for u in urls]
+        threads[0].start()
+        while adapter.sent == 0:
+            time.sleep(0.001)
+        for t in threads[1:]:
+            t.start()
+        while s.coalesced < 3:
+            time.sleep(0.001)
+        adapter.release.set()
+        for t in threads:
+            t.join()
+        assert adapter.sent == 1
+        assert results == [{"request": 1}] * 4
+        assert s.get(URL + "?a=1&b=2").json() == {"request": 2}
+
+    def test_single_get_is_streamed(self):
+        s = SnowSession()
+        adapter = SlowAdapter()
+        adapter.release.set()
+        s.mount("https://", adapter)
+        response = s.get(URL, stream=True)
+        assert not response._content_consumed
+        assert response.json() == {"request": 1}
+        assert s.coalesced == 0
+
+    def test_coalescing_can_be_turned_off(self):
+        s = SnowSession()
+        s.coalesce = False
+        adapter = SlowAdapter()
+        s.mount("https://", adapter)
+        threads = [threading.Thread(target=s.get, args=(URL,)) for _ in range(2)]
+        for t in threads:
+            t.start()
+        while adapter.sent < 2:
+            time.sleep(0.001)
+        adapter.release.set()
+        for t in threads:
+            t.join()
+        assert adapter.sent == 2
+        assert s.coalesced == 0
@@ -0,0 +1,54 @@
+import time
+
+from SnowLibrary.shared_cache import SharedCache, get_shared_cache
+
+
+class TestSharedCache:
+    def test_get_missing_key_is_a_miss(self, tmp_path):
+        c = SharedCache(str(tmp_path / "cache.db"), worker="1")
+        assert c.get("missing") is None
+        assert c.misses == 1 and c.hits == 0
+
+    def test_set_then_get_is_a_hit(self, tmp_path):
+        c = SharedCache(str(tmp_path / "cache.db"), worker="1")
+        c.set("key", {"name": "incident"})
+        assert c.get("key") == {"name": "incident"}
+        assert c.hits == 1
+
+    def test_entries_are_shared_between_instances(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        SharedCache(path, worker="1").set("key", [1, 2, 3])
+        other = SharedCache(path, worker="2")
+        assert other.get("key") == [1, 2, 3]
+        stats = other.statistics()
+        assert stats["workers"]["2"] == {"hits": 1, "misses": 0}
+
+    def test_expired_entries_are_misses(self, tmp_path):
+        c = SharedCache(str(tmp_path / "cache.db"), ttl=0.01, worker="1")
+        c.set("key", "value")
+        time.sleep(0.05)
+        assert c.get("key") is None
+
+    def test_cache_is_bounded(self, tmp_path):
+        c = SharedCache(str(tmp_path / "cache.db"), max_entries=2, worker="1")
+        for i in range(5):
+            c.set("key{}".format(i), i)
+        assert c.statistics()["entries"] == 2
+        assert c.get("key4") == 4
+        assert c.get("key0") is None
+
+    def test_get_shared_cache_reuses_instance(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        assert get_shared_cache(path) is get_shared_cache(path)
+
+    def test_statistics_are_added_to_the_totals(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        first = SharedCache(path, worker="1")
+        first.get("missing")
+        first.get("missing")
+        first.flush()
+        later = SharedCache(path, worker="1")  # E.g. the next process of the same pabot pool.
+        later.get("missing")
+        assert first.statistics()["workers"]["1"] == {"hits": 0, "misses": 2}
+        assert later.statistics()["workers"]["1"] == {"hits": 0, "misses": 3}
+        assert later.misses == 1